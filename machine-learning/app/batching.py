@@ -0,0 +1,115 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches. While a batch is running, new inputs are collected until `max_size`
+    are waiting, `max_wait` has passed since the first one arrived or the running batches finish. They are then
+    passed to `func` as one list, and each caller gets its own output back. When no batch is running, an input is
+    processed right away. If a batch fails, its inputs are retried one at a time so only the callers of bad inputs get
+    an error.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[list[Any]], list[Any]],
+        max_size: int,
+        max_wait: float,
+        executor: Executor | None = None,
+    ) -> None:
+        """
+        Args:
+            func: Processes a list of inputs, returning one output for each.
+            max_size: Maximum number of inputs in a batch.
+            max_wait: Maximum time in seconds an input waits for others before its batch is processed.
+            executor: Pool that runs `func`. Runs it in the event loop if None.
+        """
+
+        if max_size < 1:
+            raise ValueError(f"Batch size must be at least 1, but got {max_size}")
+        self.func = func
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.pending: list[tuple[Any, asyncio.Future[Any]]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        self.tasks: set[asyncio.Task[None]] = set()
+        self.running = 0
+
+    async def submit(self, inputs: Any) -> Any:
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self.pending.append((inputs, future))
+        # there's nothing to wait for when idle, so batches only form while earlier ones are running
+        if len(self.pending) >= self.max_size or self.running == 0:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """Starts processing the waiting inputs without waiting for more."""
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.running += 1
+        task = asyncio.create_task(self._run(batch))
+        # keep a reference so the task isn't garbage collected while it runs
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, "asyncio.Future[Any]"]]) -> None:
+        try:
+            outputs, errors = await self._process([item for item, _ in batch])
+        except asyncio.CancelledError:
+            # the callers would otherwise wait forever, e.g. when the server shuts down
+            for _, future in batch:
+                future.cancel()
+            raise
+        finally:
+            # before the callers resume, so their next inputs don't wait for a batch that already finished
+            self.running -= 1
+            if self.running == 0:
+                self.flush()
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(outputs[i])
+
+    async def _process(self, inputs: list[Any]) -> tuple[list[Any], dict[int, Exception]]:
+        """Returns the output of each input, or the error it raised by its index."""
+
+        try:
+            return await self._call(inputs), {}
+        except Exception as e:
+            if len(inputs) == 1:
+                return [None], {0: e}
+
+        # one bad input fails the whole batch, so each is retried on its own to only fail its own caller
+        outputs: list[Any] = []
+        errors: dict[int, Exception] = {}
+        for i, item in enumerate(inputs):
+            try:
+                outputs += await self._call([item])
+            except Exception as e:
+                outputs.append(None)
+                errors[i] = e
+        return outputs, errors
+
+    async def _call(self, inputs: list[Any]) -> list[Any]:
+        if self.executor is None:
+            outputs = self.func(inputs)
+        else:
+            outputs = await asyncio.get_running_loop().run_in_executor(self.executor, self.func, inputs)
+        if len(outputs) != len(inputs):
+            raise ValueError(f"Expected {len(inputs)} outputs for the batch, but got {len(outputs)}")
+        return outputs
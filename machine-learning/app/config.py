@@ -6,7 +6,7 @@ from pathlib import Path
 from socket import socket
 
 from gunicorn.arbiter import Arbiter
-from pydantic import BaseSettings
+from pydantic import BaseModel, BaseSettings
 from rich.console import Console
 from rich.logging import RichHandler
 from uvicorn import Server
@@ -15,22 +15,47 @@ from uvicorn.workers import UvicornWorker
 from .schemas import ModelType
 
 
+class PreloadModelData(BaseModel):
+    """Names of the models of each type to load and warm up at startup, e.g. `MACHINE_LEARNING_PRELOAD__CLIP`."""
+
+    clip: str | None = None
+    facial_recognition: str | None = None
+    weapons_detection: str | None = None
+
+
 class Settings(BaseSettings):
     cache_folder: str = "/cache"
     model_ttl: int = 300
     model_ttl_poll_s: int = 10
+    model_cache_size_mb: int = 0
     host: str = "0.0.0.0"
     port: int = 3003
     workers: int = 1
     test_full: bool = False
     request_threads: int = os.cpu_count() or 4
+    request_batch_size: int = 0
+    request_batch_wait_ms: float = 5.0
+    image_batch_size: int = 8
+    video_threads: int = 1
+    video_jobs_folder: str = "/ml-results/jobs"
+    video_batch_size: int = 4
+    video_queue_size: int = 4
+    media_folders: str = ""
+    result_cache_folder: str = "/cache/results"
+    result_cache_size_mb: int = 0
+    clean_results_path: str = "/cache/clean.db"
+    weapons_model_path: str = str(Path(__file__).parent / "models" / "train9_model_v1.pt")
     model_inter_op_threads: int = 0
     model_intra_op_threads: int = 0
     ann: bool = True
+    quantized: bool = False
+    preload: PreloadModelData = PreloadModelData()
+    share_models: bool = False
 
     class Config:
         env_prefix = "MACHINE_LEARNING_"
         case_sensitive = False
+        env_nested_delimiter = "__"
 
 
 class LogSettings(BaseSettings):
@@ -1,14 +1,28 @@
 import json
+import shutil
+from pathlib import Path
 from typing import Any, Iterator
 from unittest import mock
 
+import cv2
 import numpy as np
+import onnx
 import pytest
+import torch
 from fastapi.testclient import TestClient
 from numpy.typing import NDArray
+from onnxruntime.quantization.calibrate import CalibrationDataReader
 from PIL import Image
+from pytest_mock import MockerFixture
+from ultralytics import YOLO
+
+from export.models.optimize import quantize
 
 from .main import app
+from .models.cache import ModelCache
+from .models.transforms import letterbox
+from .models.weapons_detector import WeaponsDetector
+from .schemas import ModelType
 
 
 @pytest.fixture
@@ -21,6 +35,157 @@ def cv_image(pil_image: Image.Image) -> NDArray[np.float32]:
     return np.asarray(pil_image)[:, :, ::-1]  # PIL uses RGB while cv2 uses BGR
 
 
+@pytest.fixture
+def video_file(tmp_path: Path) -> Path:
+    path = tmp_path / "video.mp4"
+    writer = cv2.VideoWriter(path.as_posix(), cv2.VideoWriter.fourcc(*"mp4v"), 10, (64, 48))
+    for i in range(20):
+        writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def weapons_detector(mocker: MockerFixture, tmp_path: Path) -> WeaponsDetector:
+    detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "model")
+    detector.model = mock.Mock()
+    detector.names = {0: "weapon"}
+    detector.loaded = True
+    # without a real tracker, detections are passed through as-is
+    mocker.patch.object(detector, "associate", side_effect=lambda tracker, boxes, frame: boxes)
+    return detector
+
+
+@pytest.fixture
+def deployed_detector(weapons_detector: WeaponsDetector, mocker: MockerFixture) -> WeaponsDetector:
+    """Serves `weapons_detector` to the app for weapons detection requests."""
+
+    get = ModelCache.get
+
+    async def get_model(cache: ModelCache, model_name: str, model_type: ModelType, **kwargs: Any) -> Any:
+        if model_type == ModelType.WEAPONS_DETECTION:
+            return weapons_detector
+        return await get(cache, model_name, model_type, **kwargs)
+
+    mocker.patch.object(ModelCache, "get", autospec=True, side_effect=get_model)
+    return weapons_detector
+
+
+@pytest.fixture(scope="session")
+def yolo_checkpoint(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """
+    A randomly initialized YOLOv8n at 320px. Its batch norm statistics are set from random images and its class
+    biases are zeroed, so that scores vary with the input rather than all being close to zero or one.
+    """
+
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    model = YOLO("yolov8n.yaml")
+    network = model.model
+    assert isinstance(network, torch.nn.Module)
+    images = [cv2.resize(rng.integers(0, 256, (40, 40, 3), dtype=np.uint8), (320, 320)) for _ in range(4)]
+    for module in network.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.momentum = 1.0
+    network.train()
+    with torch.no_grad():
+        network(torch.stack([torch.from_numpy(letterbox(image, 320)[0]) for image in images]))
+    with torch.no_grad():
+        for head in network.model[-1].cv3:
+            head[-1].weight.mul_(0.3)
+            head[-1].bias.zero_()
+    network.eval()
+
+    path = tmp_path_factory.mktemp("yolo") / "model.pt"
+    # saved as training does, which is where the input size is read from
+    torch.save({"model": network, "train_args": {"imgsz": 320, "task": "detect"}}, path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def yolo_export(yolo_checkpoint: Path) -> Path:
+    """`yolo_checkpoint` exported to ONNX as `export/models/yolo.py` does."""
+
+    model = YOLO(yolo_checkpoint.as_posix())
+    exported = model.export(format="onnx", imgsz=320, dynamic=True, simplify=False, verbose=False)
+    export_dir = yolo_checkpoint.parent / "onnx"
+    export_dir.mkdir()
+    shutil.move(exported, export_dir / "model.onnx")
+    (export_dir / "config.json").write_text(json.dumps({"names": model.names, "imgsz": 320}))
+    return export_dir
+
+
+@pytest.fixture(scope="session")
+def yolo_int8_export(yolo_export: Path) -> Path:
+    """`yolo_export` with its convolutions quantized to INT8 next to it, calibrated on random images."""
+
+    export_dir = yolo_export.parent / "onnx_int8"
+    shutil.copytree(yolo_export, export_dir)
+    rng = np.random.default_rng(4)
+    images = [cv2.resize(rng.integers(0, 256, (40, 40, 3), dtype=np.uint8), (320, 320)) for _ in range(4)]
+    calibration = ListCalibrationReader([{"images": letterbox(image, 320)[0][None]} for image in images])
+    model_path = export_dir / "model.onnx"
+    nodes = [node.name for node in onnx.load(model_path).graph.node if node.name.startswith("/model.22/dfl/")]
+    quantize(model_path, calibration, nodes_to_exclude=nodes)
+    return export_dir
+
+
+class TinyVisualEncoder(torch.nn.Module):
+    """A small ViT with the inputs and outputs of a CLIP image encoder."""
+
+    def __init__(self, width: int = 192, embed_dim: int = 512) -> None:
+        super().__init__()
+        self.patches = torch.nn.Conv2d(3, width, kernel_size=32, stride=32)
+        # built separately rather than with `TransformerEncoder`, whose copies of one layer start with the same
+        # weights, which the ONNX export would merge into one
+        self.transformer = torch.nn.Sequential(
+            *[
+                torch.nn.TransformerEncoderLayer(width, nhead=4, dim_feedforward=width * 4, batch_first=True)
+                for _ in range(2)
+            ]
+        )
+        self.proj = torch.nn.Linear(width, embed_dim)
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        tokens = self.patches(image).flatten(2).transpose(1, 2)
+        embedding: torch.Tensor = self.proj(self.transformer(tokens).mean(1))
+        return embedding
+
+
+@pytest.fixture(scope="session")
+def clip_visual_export(tmp_path_factory: pytest.TempPathFactory, clip_preprocess_cfg: dict[str, Any]) -> Path:
+    """
+    A CLIP model folder with a randomly initialized visual encoder at 224px, with `model_int8.onnx` next to
+    `model.onnx` as the export writes it.
+    """
+
+    torch.manual_seed(0)
+    cache_dir = tmp_path_factory.mktemp("clip")
+    visual_path = cache_dir / "visual" / "model.onnx"
+    visual_path.parent.mkdir()
+    encoder = TinyVisualEncoder().eval()
+    torch.onnx.export(
+        encoder,
+        (torch.randn(1, 3, 224, 224),),
+        visual_path.as_posix(),
+        input_names=["image"],
+        output_names=["embedding"],
+        dynamic_axes={"image": {0: "batch_size"}, "embedding": {0: "batch_size"}},
+        dynamo=False,
+    )
+    (visual_path.parent / "preprocess_cfg.json").write_text(json.dumps(clip_preprocess_cfg))
+    quantize(visual_path)
+    return cache_dir
+
+
+class ListCalibrationReader(CalibrationDataReader):  # type: ignore[misc]
+    def __init__(self, inputs: list[dict[str, NDArray[np.float32]]]) -> None:
+        self.inputs = iter(inputs)
+
+    def get_next(self) -> dict[str, NDArray[np.float32]] | None:
+        return next(self.inputs, None)
+
+
 @pytest.fixture
 def mock_get_model() -> Iterator[mock.Mock]:
     with mock.patch("app.models.cache.from_model_type", autospec=True) as mocked:
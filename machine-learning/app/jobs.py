@@ -0,0 +1,225 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+from uuid import uuid4
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .config import log
+from .models.video import get_sampler
+from .models.weapons_detector import WeaponsDetector
+from .schemas import JobStatus, VideoJob
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class JobInterrupted(Exception):
+    """Raised inside a running job when the queue is stopped. The job is resumed from its checkpoint later."""
+
+
+class VideoJobQueue:
+    """Runs video weapons detection as background jobs that report progress and can resume after a restart."""
+
+    def __init__(
+        self,
+        jobs_dir: Path | str,
+        executor: Executor | None = None,
+        checkpoint_interval: int = 50,
+    ) -> None:
+        """
+        Args:
+            jobs_dir: Directory where job state and checkpoints are stored. Can be shared between workers.
+            executor: Pool that runs the jobs, which bounds how many are processed at once. Runs inline if None.
+            checkpoint_interval: Number of frames between checkpoints. Defaults to 50.
+        """
+
+        self.jobs_dir = Path(jobs_dir)
+        self.executor = executor
+        self.checkpoint_interval = checkpoint_interval
+        self.active: dict[str, VideoJob] = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.stopping = False
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0
+
+    def submit(
+        self,
+        detector: WeaponsDetector,
+        video_path: Path,
+        save_directory: Path,
+        min_score: float,
+        sampling: dict[str, Any] | None = None,
+    ) -> VideoJob:
+        get_sampler(sampling)  # fail on invalid options before queueing
+        job = VideoJob(
+            id=uuid4().hex,
+            modelName=detector.model_name,
+            videoFilePath=str(video_path),
+            saveDirectory=str(save_directory),
+            minScore=min_score,
+            sampling=sampling,
+        )
+        self._save(job)
+        self._schedule(job, detector)
+        return job
+
+    def get(self, job_id: str) -> VideoJob | None:
+        if job_id in self.active:
+            return self.active[job_id]
+        if not _JOB_ID.fullmatch(job_id) or not self._job_path(job_id).is_file():
+            return None
+        return VideoJob.parse_file(self._job_path(job_id))
+
+    def unfinished(self) -> list[VideoJob]:
+        """Jobs that were queued or running when the service last stopped."""
+
+        if not self.jobs_dir.is_dir():
+            return []
+
+        jobs = [VideoJob.parse_file(path) for path in self.jobs_dir.glob("*.json")]
+        return [job for job in jobs if job.status in (JobStatus.QUEUED, JobStatus.RUNNING)]
+
+    def resume(self, detectors: dict[str, WeaponsDetector]) -> list[VideoJob]:
+        """Requeues unfinished jobs, each with the detector of the model it was submitted for."""
+
+        unfinished = self.unfinished()
+        for job in unfinished:
+            log.info(f"Resuming video job '{job.id}' from frame {job.framesProcessed}.")
+            self._schedule(job, detectors[job.modelName])
+        return unfinished
+
+    def stop(self) -> None:
+        """Interrupts running jobs at their next frame. Their progress is kept so they can be resumed."""
+
+        self.stopping = True
+
+    def _schedule(self, job: VideoJob, detector: WeaponsDetector) -> None:
+        with self.lock:
+            self.pending += 1
+        if self.executor is None:
+            self._run(job, detector)
+        else:
+            self.executor.submit(self._run, job, detector)
+
+    def _run(self, job: VideoJob, detector: WeaponsDetector) -> None:
+        try:
+            with self._claim(job.id) as claimed:
+                # otherwise another worker sharing the jobs folder is already processing it
+                if claimed:
+                    self._run_claimed(VideoJob.parse_file(self._job_path(job.id)), detector)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def _run_claimed(self, job: VideoJob, detector: WeaponsDetector) -> None:
+        if job.status not in (JobStatus.QUEUED, JobStatus.RUNNING):
+            return
+
+        self.active[job.id] = job
+        try:
+            self._process(job, detector)
+        except JobInterrupted:
+            log.info(f"Interrupted video job '{job.id}' at frame {job.framesProcessed}.")
+        except Exception as e:
+            log.error(f"Video job '{job.id}' failed.", exc_info=e)
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        finally:
+            self._save(job)
+            del self.active[job.id]
+
+    def _process(self, job: VideoJob, detector: WeaponsDetector) -> None:
+        start_frame = job.framesProcessed
+        checkpoint = self._load_checkpoint(job.id, start_frame)
+        job.status = JobStatus.RUNNING
+        self._save(job)
+
+        started = time.monotonic()
+        with self._checkpoint_path(job.id).open("a") as checkpoint_file:
+
+            def on_frame(index: int, total: int, boxes: NDArray[np.float32]) -> None:
+                if self.stopping:
+                    raise JobInterrupted
+                job.framesProcessed = index + 1
+                job.framesTotal = total if total > 0 else None
+                if index >= start_frame:
+                    if len(boxes):
+                        checkpoint_file.write(json.dumps({"frame": index, "boxes": boxes.tolist()}) + "\n")
+                    if job.framesTotal is not None:
+                        rate = (time.monotonic() - started) / (index + 1 - start_frame)
+                        job.eta = rate * max(job.framesTotal - job.framesProcessed, 0)
+                if job.framesProcessed % self.checkpoint_interval == 0:
+                    checkpoint_file.flush()
+                    self._save(job)
+
+            response = detector.run_prediction_video(
+                Path(job.videoFilePath),
+                Path(job.saveDirectory),
+                job.minScore,
+                on_frame=on_frame,
+                start_frame=start_frame,
+                checkpoint=checkpoint,
+                sampler=get_sampler(job.sampling),
+            )
+
+        job.status = JobStatus.COMPLETED
+        job.filePath = response["filePath"]
+        job.eta = 0.0
+        self._checkpoint_path(job.id).unlink(missing_ok=True)
+
+    def _load_checkpoint(self, job_id: str, start_frame: int) -> dict[int, NDArray[np.float32]]:
+        checkpoint: dict[int, NDArray[np.float32]] = {}
+        path = self._checkpoint_path(job_id)
+        if start_frame == 0 or not path.is_file():
+            return checkpoint
+
+        with path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be cut off if the process was killed mid-write
+                    continue
+                if entry["frame"] < start_frame:
+                    checkpoint[entry["frame"]] = np.array(entry["boxes"], dtype=np.float32)
+        return checkpoint
+
+    @contextmanager
+    def _claim(self, job_id: str) -> Iterator[bool]:
+        with self._lock_path(job_id).open("a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, job: VideoJob) -> None:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        path = self._job_path(job.id)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(job.json())
+        os.replace(tmp_path, path)
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _checkpoint_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.checkpoint.jsonl"
+
+    def _lock_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.lock"
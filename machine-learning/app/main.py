@@ -1,29 +1,51 @@
 import asyncio
 import gc
+import mmap
 import os
 import signal
-import threading
+import tarfile
 import time
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from functools import partial
+from io import BytesIO
 from typing import Any, AsyncGenerator, Callable, Iterator
+from weakref import WeakKeyDictionary, ref
 from zipfile import BadZipFile
 
 import orjson
-from fastapi import Depends, FastAPI, Form, HTTPException, UploadFile
-from fastapi.responses import ORJSONResponse
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import ORJSONResponse, Response
 from onnxruntime.capi.onnxruntime_pybind11_state import InvalidProtobuf, NoSuchFile
+from pydantic import ValidationError
 from starlette.formparsers import MultiPartParser
 
 from app.models.base import InferenceModel
 
-from .config import log, settings
+from .batching import MicroBatcher
+from .config import PreloadModelData, log, settings
+from .jobs import VideoJobQueue
 from .models.cache import ModelCache
+from .models.transforms import DecodedImage, decode_reduced
+from .models.video import get_sampler, resolve_video_path
+from .models.weapons_detector import WeaponsDetector
+from .results import CleanResults, ResultCache
 from .schemas import (
+    OPTIONS,
+    CacheStats,
+    DetectedWeapons,
+    JobStatus,
     MessageResponse,
+    ModelCacheStats,
+    ModelOptions,
+    ModelStatus,
     ModelType,
+    PreloadedModel,
+    ReadinessResponse,
     TextResponse,
-    DetectedWeapons,
+    VideoJob,
+    WeaponsDetectionOptions,
+    parse_options,
 )
 
 import cv2
@@ -33,21 +55,30 @@ from pathlib import Path
 
 MultiPartParser.max_file_size = 2**26  # spools to disk if payload is 64 MiB or larger
 
-model_cache = ModelCache(ttl=settings.model_ttl, revalidate=settings.model_ttl > 0)
+model_cache = ModelCache(
+    ttl=settings.model_ttl, revalidate=settings.model_ttl > 0, max_size=settings.model_cache_size_mb * 2**20
+)
+result_cache = (
+    ResultCache(settings.result_cache_folder, settings.result_cache_size_mb * 2**20)
+    if settings.result_cache_size_mb > 0
+    else None
+)
 thread_pool: ThreadPoolExecutor | None = None
-lock = threading.Lock()
+video_thread_pool: ThreadPoolExecutor | None = None
+video_jobs: VideoJobQueue | None = None
+# batchers of each loaded model, by request options
+batchers: WeakKeyDictionary[InferenceModel, dict[ModelOptions, MicroBatcher]] = WeakKeyDictionary()
+clean_results = CleanResults(settings.clean_results_path) if settings.clean_results_path else None
+# models of MACHINE_LEARNING_PRELOAD and how far their warm-up got
+preloaded: list[PreloadedModel] = []
 active_requests = 0
 last_called: float | None = None
 
 
-### -- test code
-from .models.weapons_detector import ThreatDetector
-threat_detector = ThreatDetector()
-
-
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
-    global thread_pool
+    global thread_pool, video_thread_pool, video_jobs
+    preload_task = None
     log.info(
         (
             "Created in-memory cache with unloading "
@@ -60,15 +91,32 @@ async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
             # asyncio is a huge bottleneck for performance, so we use a thread pool to run blocking code
             thread_pool = ThreadPoolExecutor(settings.request_threads) if settings.request_threads > 0 else None
             log.info(f"Initialized request thread pool with {settings.request_threads} threads.")
+        if settings.video_threads > 0:
+            # videos can take minutes, so they get their own pool to avoid starving short requests
+            video_thread_pool = ThreadPoolExecutor(settings.video_threads)
+            log.info(f"Initialized video thread pool with {settings.video_threads} threads.")
+        video_jobs = VideoJobQueue(settings.video_jobs_folder, video_thread_pool or thread_pool)
+        # the detector is only loaded at startup if there are interrupted jobs to finish
+        model_names = {job.modelName for job in video_jobs.unfinished()}
+        video_jobs.resume({model_name: await get_weapons_detector(model_name) for model_name in model_names})
+        # warmed up in the background, so the worker can report that it isn't ready yet in the meantime
+        preloaded[:] = get_preloaded_models(settings.preload)
+        preload_task = asyncio.ensure_future(preload_models(preloaded)) if preloaded else None
         if settings.model_ttl > 0 and settings.model_ttl_poll_s > 0:
             asyncio.ensure_future(idle_shutdown_task())
         yield
     finally:
+        if preload_task is not None:
+            preload_task.cancel()
         log.handlers.clear()
         for model in model_cache.cache._cache.values():
             del model
+        if video_jobs is not None:
+            video_jobs.stop()
         if thread_pool is not None:
             thread_pool.shutdown()
+        if video_thread_pool is not None:
+            video_thread_pool.shutdown(cancel_futures=True)
         gc.collect()
 
 
@@ -95,6 +143,18 @@ def ping() -> str:
     return "pong"
 
 
+@app.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+def ready() -> ORJSONResponse:
+    """
+    Reports whether the models of `MACHINE_LEARNING_PRELOAD` are loaded and warmed up, with the status of each.
+    Responds with 503 until all of them are, so load balancers only send requests to workers that are warm.
+    """
+
+    is_ready = all(model.status == ModelStatus.WARM for model in preloaded)
+    response = ReadinessResponse(ready=is_ready, models=preloaded)
+    return ORJSONResponse(response.dict(), status_code=200 if is_ready else 503)
+
+
 @app.post("/predict", dependencies=[Depends(update_state)])
 async def predict(
     model_name: str = Form(alias="modelName"),
@@ -105,68 +165,462 @@ async def predict(
     video: str | None = Form(alias="videoFilePath", default=None)
 ) -> Any:
     if image is not None:
-        inputs: str | bytes = await image.read()
+        inputs: str | bytes | memoryview = read_upload(image)
     elif video is not None:
         inputs = video
     elif text is not None:
         inputs = text
     else:
         raise HTTPException(400, "Either image or text must be provided")
-    try:
-        kwargs = orjson.loads(options)
-    except orjson.JSONDecodeError:
-        raise HTTPException(400, f"Invalid options JSON: {options}")
+    model_options = get_options(model_type, options)
 
-    if model_type == ModelType.WEAPONS_DETECTION:
-        mediaType = kwargs.get("mode", "")
-        detection_threshold = eval(options).get("minScore", 0.2)
+    model = await get_model(model_name, model_type, model_options)
+
+    if isinstance(model_options, WeaponsDetectionOptions):
+        assert isinstance(model, WeaponsDetector)
+        mediaType = model_options.mode
+        detection_threshold = model_options.minScore
 
         if mediaType == "image":
             image = inputs
             save_directory = Path("/ml-results/")
-            asset_id = kwargs.get("assetId", None)
-            detection_response = threat_detector.run_image_prediction_byte_stream(image, 
-                                                                                asset_id, 
-                                                                                save_directory,
-                                                                                detection_threshold)
+            asset_id = model_options.assetId
+            key = result_key(inputs, model_type, model_name, model.version, model_options)
+            if (cached := await get_result(key, model_type)) is not None:
+                reused = model.reuse_result(orjson.loads(cached), asset_id, save_directory)
+                if reused is not None:
+                    return ORJSONResponse(reused)
+            detection_response = await run(
+                partial(
+                    model.run_image_prediction_byte_stream,
+                    asset_id=asset_id,
+                    save_directory=save_directory,
+                    confidence=detection_threshold,
+                    render=model_options.render,
+                ),
+                image,
+            )
 
-            return ORJSONResponse(detection_response)
+            return await put_result(key, ORJSONResponse(detection_response))
             
         elif mediaType == "video":
-            video_file_path = Path(inputs)
             save_directory = Path("/ml-results/")
-            video_file_path = save_directory / video_file_path.name
-
-            detection_response = threat_detector.run_prediction_video(video_file_path, 
-                                                                      save_directory,
-                                                                      detection_threshold)
+            video_file_path = resolve_video_path(inputs, save_directory)
+            sampling = model_options.sampling.dict(exclude_none=True) if model_options.sampling else None
+            try:
+                sampler = get_sampler(sampling)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+
+            if model_options.output == "timeline":
+                # detection only: skips encoding, optionally keeping short clips around the detections
+                timeline = await run(
+                    partial(
+                        model.detect_video,
+                        confidence=detection_threshold,
+                        sampler=sampler,
+                        clip_directory=save_directory if model_options.clips else None,
+                        clip_padding=model_options.clipPadding,
+                    ),
+                    video_file_path,
+                    video_thread_pool,
+                )
+                return ORJSONResponse(timeline)
+
+            detection_response = await run(
+                partial(
+                    model.run_prediction_video,
+                    save_directory=save_directory,
+                    confidence=detection_threshold,
+                    sampler=sampler,
+                ),
+                video_file_path,
+                video_thread_pool,
+            )
 
             return ORJSONResponse(detection_response)
         
 
-    model = await load(await model_cache.get(model_name, model_type, **kwargs))
-    model.configure(**kwargs)
-    outputs = await run(model.predict, inputs)
+    key = result_key(inputs, model_type, model_name, model.version, model_options)
+    if (cached := await get_result(key, model_type)) is not None:
+        return Response(cached, media_type="application/json")
+    if settings.request_batch_size > 1:
+        outputs = await get_batcher(model, model_options).submit(inputs)
+    else:
+        outputs = await run(partial(model.predict, options=model_options), inputs)
+    return await put_result(key, ORJSONResponse(outputs))
+
+
+async def get_model(model_name: str, model_type: ModelType, options: ModelOptions) -> InferenceModel:
+    if model_type == ModelType.WEAPONS_DETECTION:
+        return await get_weapons_detector(model_name)
+    return await load(await model_cache.get(model_name, model_type, **options.dict(exclude_unset=True)))
+
+
+async def get_weapons_detector(model_name: str) -> WeaponsDetector:
+    # images and videos are detected with the same weights, so unlike other models the options don't select one
+    model = await load(await model_cache.get(model_name, ModelType.WEAPONS_DETECTION, clean_results=clean_results))
+    assert isinstance(model, WeaponsDetector)
+    return model
+
+
+def get_options(model_type: ModelType, options: str | dict[str, Any]) -> ModelOptions:
+    try:
+        if isinstance(options, str):
+            return parse_options(model_type, options)
+        return OPTIONS[model_type].parse_obj(options)
+    except orjson.JSONDecodeError:
+        raise HTTPException(400, f"Invalid options JSON: {options}")
+    except ValidationError as e:
+        raise HTTPException(400, f"Invalid options: {e}")
+
+
+def get_weapons_options(options: str) -> WeaponsDetectionOptions:
+    weapons_options = get_options(ModelType.WEAPONS_DETECTION, options)
+    assert isinstance(weapons_options, WeaponsDetectionOptions)
+    return weapons_options
+
+
+def result_key(inputs: Any, model_type: ModelType, model_name: str, version: str, options: ModelOptions) -> str | None:
+    if result_cache is None or not isinstance(inputs, bytes | memoryview | str):
+        return None
+    # the asset ID only names the rendered image, so duplicates of an asset can share results
+    return result_cache.key(inputs, model_type, model_name, version, options.dict(exclude={"assetId"}))
+
+
+async def get_result(key: str | None, model_type: ModelType) -> bytes | None:
+    if result_cache is None or key is None:
+        return None
+    cached: bytes | None = await run(partial(result_cache.get, category=model_type), key)
+    return cached
+
+
+async def put_result(key: str | None, response: ORJSONResponse) -> ORJSONResponse:
+    if result_cache is not None and key is not None:
+        await run(partial(result_cache.put, key), response.body)
+    return response
+
+
+@app.delete("/cache/clean")
+async def invalidate_clean_results(
+    model: str | None = None,
+    stale: bool = False,
+    model_name: str = Query(alias="modelName", default="yoloV8"),
+) -> dict[str, int]:
+    """
+    Forgets which inputs weapons detection found nothing in, e.g. after the model changed. Only removes those of the
+    model version `model` if given, or those of other versions than the current one of `modelName` if `stale` is set.
+    """
+
+    if clean_results is None:
+        raise HTTPException(404, "Clean result cache is disabled")
+    keep = (await get_weapons_detector(model_name)).version if stale else None
+    return {"removed": await run(partial(clean_results.invalidate, model), keep)}
+
+
+@app.get("/cache/models")
+def get_model_cache_stats() -> ModelCacheStats:
+    return model_cache.stats()
+
+
+@app.get("/cache/results")
+def get_result_cache_stats() -> dict[str, CacheStats]:
+    if result_cache is None:
+        raise HTTPException(404, "Result cache is disabled")
+    return result_cache.stats()
+
+
+def get_batcher(model: InferenceModel, options: ModelOptions) -> MicroBatcher:
+    # requests are only batched with others that have the same options, since these configure the model
+    model_batchers = batchers.setdefault(model, {})
+    if options not in model_batchers:
+        # a weak reference lets the model be unloaded, while requests waiting on a batch keep it alive
+        model_ref = ref(model)
+
+        def predict_batch(inputs: list[Any]) -> list[Any]:
+            model = model_ref()
+            assert model is not None
+            return model.predict_batch(inputs, options)
+
+        model_batchers[options] = MicroBatcher(
+            predict_batch,
+            settings.request_batch_size,
+            settings.request_batch_wait_ms / 1000,
+            thread_pool,
+        )
+    return model_batchers[options]
+
+
+@app.post("/predict/batch", dependencies=[Depends(update_state)])
+async def predict_batch(
+    model_name: str = Form(alias="modelName"),
+    model_type: ModelType = Form(alias="modelType"),
+    options: str = Form(default="{}"),
+    texts: list[str] = Form(default=[]),
+    images: list[UploadFile] = File(default=[]),
+) -> Any:
+    """
+    Runs a model on many texts or images at once, such as to embed a whole album with CLIP. Returns one output for
+    each input, with the images first in the order they were sent.
+    """
+
+    model_options = get_options(model_type, options)
+    inputs: list[str | bytes] = [await image.read() for image in images]
+    inputs.extend(texts)
+    if not inputs:
+        raise HTTPException(400, "Either images or texts must be provided")
+
+    model = await get_model(model_name, model_type, model_options)
+    size = max(settings.image_batch_size, 1)
+    outputs: list[Any] = []
+    for i in range(0, len(inputs), size):
+        outputs.extend(await run(partial(model.predict_batch, options=model_options), inputs[i : i + size]))
     return ORJSONResponse(outputs)
 
 
-async def run(func: Callable[..., Any], inputs: Any) -> Any:
-    if thread_pool is None:
+@app.post("/predict/analyze", dependencies=[Depends(update_state)])
+async def analyze(
+    image: UploadFile,
+    entries: str = Form(alias="models"),
+) -> Any:
+    """
+    Runs several models on one image, which is uploaded once and decoded once for all models but CLIP. `models` is a
+    JSON object keyed by model type, with the `modelName` and `options` of each model. The response has the same keys.
+    """
+
+    try:
+        requested = {ModelType(model_type): entry for model_type, entry in orjson.loads(entries).items()}
+        model_names: dict[ModelType, str] = {model_type: entry["modelName"] for model_type, entry in requested.items()}
+    except (orjson.JSONDecodeError, AttributeError, KeyError, TypeError, ValueError):
+        raise HTTPException(400, f"Invalid models JSON: {entries}")
+    if not requested:
+        raise HTTPException(400, "At least one model must be requested")
+    model_options = {
+        model_type: get_options(model_type, entry.get("options", {})) for model_type, entry in requested.items()
+    }
+
+    data = read_upload(image)
+    loaded = [get_model(model_names[model_type], model_type, model_options[model_type]) for model_type in requested]
+    models = dict(zip(requested, await asyncio.gather(*loaded)))
+
+    outputs: dict[ModelType, Any] = {}
+    keys: dict[ModelType, str | None] = {}
+    for model_type, model in models.items():
+        options = model_options[model_type]
+        keys[model_type] = result_key(data, model_type, model_names[model_type], model.version, options)
+        if (cached := await get_result(keys[model_type], model_type)) is None:
+            continue
+        output = orjson.loads(cached)
+        if isinstance(model, WeaponsDetector) and isinstance(options, WeaponsDetectionOptions):
+            output = model.reuse_result(output, options.assetId, Path("/ml-results/"))
+        if output is not None:
+            outputs[model_type] = output
+    pending = [model_type for model_type in requested if model_type not in outputs]
+    if not pending:
+        return ORJSONResponse({model_type: outputs[model_type] for model_type in requested})
+
+    # CLIP decodes the upload with Pillow as in `/predict`, which unlike cv2 ignores the EXIF orientation, so both
+    # endpoints embed an image the same way and can share its cached result
+    shared = [model_type for model_type in pending if model_type != ModelType.CLIP]
+    decoded: DecodedImage | None = None
+    if shared:
+        # decoded at the largest size any of the models needs, or at full size if one of them doesn't say
+        decode_sizes: list[int | None] = [getattr(models[model_type], "decode_size", None) for model_type in shared]
+        min_size = None if None in decode_sizes else max(size for size in decode_sizes if size is not None)
+        try:
+            decoded = await run(partial(decode_reduced, min_size=min_size), data)
+        except ValueError:
+            raise HTTPException(400, "Could not decode image")
+
+    async def predict(model_type: ModelType) -> Any:
+        inputs = data if model_type == ModelType.CLIP else decoded
+        output = await run(partial(models[model_type].predict, options=model_options[model_type]), inputs)
+        await put_result(keys[model_type], ORJSONResponse(output))
+        return output
+
+    outputs.update(zip(pending, await asyncio.gather(*[predict(model_type) for model_type in pending])))
+    return ORJSONResponse({model_type: outputs[model_type] for model_type in requested})
+
+
+@app.post("/predict/weapons", dependencies=[Depends(update_state)])
+async def predict_weapons_batch(
+    images: list[UploadFile] = File(default=[]),
+    asset_ids: list[str] = Form(alias="assetIds", default=[]),
+    archive: UploadFile | None = None,
+    options: str = Form(default="{}"),
+    model_name: str = Form(alias="modelName", default="yoloV8"),
+) -> Any:
+    """
+    Detects weapons in many images at once. The images are either sent as a list of files with an `assetIds` field
+    for each one, or as a single tar `archive` whose files are named after their asset IDs.
+    """
+
+    weapons_options = get_weapons_options(options)
+
+    if archive is not None:
+        try:
+            asset_ids, inputs = await run(read_archive, await archive.read())
+        except tarfile.TarError as e:
+            raise HTTPException(400, f"Invalid archive: {e}")
+    else:
+        if len(images) != len(asset_ids):
+            raise HTTPException(400, f"Got {len(images)} images but {len(asset_ids)} asset IDs")
+        inputs = [await image.read() for image in images]
+    if not inputs:
+        raise HTTPException(400, "Either images or an archive must be provided")
+    detector = await get_weapons_detector(model_name)
+
+    async def decode(asset_id: str, data: bytes) -> Any:
+        try:
+            return await run(partial(decode_reduced, min_size=detector.input_size), data)
+        except ValueError:
+            raise HTTPException(400, f"Could not decode image for asset '{asset_id}'")
+
+    decoded = await asyncio.gather(*[decode(asset_id, data) for asset_id, data in zip(asset_ids, inputs)])
+    outputs = await run(
+        partial(
+            detector.run_image_batch,
+            asset_ids=asset_ids,
+            save_directory=Path("/ml-results/"),
+            confidence=weapons_options.minScore,
+            render=weapons_options.render,
+        ),
+        decoded,
+    )
+    return ORJSONResponse(outputs)
+
+
+def read_upload(upload: UploadFile) -> bytes | memoryview:
+    """
+    Returns the content of an upload without copying it. An upload held in memory shares the buffer it was parsed
+    into, while one spooled to disk is memory-mapped so its pages are read on demand and can be reclaimed.
+    """
+
+    file = upload.file
+    if not getattr(file, "_rolled", True):
+        # BytesIO returns its own buffer rather than a copy when nothing else references it
+        value: bytes = file._file.getvalue()  # type: ignore[attr-defined]
+        return value
+    file.flush()
+    if os.fstat(file.fileno()).st_size == 0:
+        return b""
+    return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def read_archive(data: bytes) -> tuple[list[str], list[bytes]]:
+    asset_ids: list[str] = []
+    images: list[bytes] = []
+    with tarfile.open(fileobj=BytesIO(data)) as archive:
+        for member in archive:
+            file = archive.extractfile(member) if member.isfile() else None
+            if file is not None:
+                asset_ids.append(Path(member.name).stem)
+                images.append(file.read())
+    return asset_ids, images
+
+
+@app.post("/jobs/video", response_model=VideoJob, dependencies=[Depends(update_state)])
+async def submit_video_job(
+    video: str = Form(alias="videoFilePath"),
+    options: str = Form(default="{}"),
+    model_name: str = Form(alias="modelName", default="yoloV8"),
+) -> VideoJob:
+    weapons_options = get_weapons_options(options)
+    sampling = weapons_options.sampling.dict(exclude_none=True) if weapons_options.sampling else None
+
+    assert video_jobs is not None
+    save_directory = Path("/ml-results/")
+    try:
+        return video_jobs.submit(
+            await get_weapons_detector(model_name),
+            resolve_video_path(video, save_directory),
+            save_directory,
+            weapons_options.minScore,
+            sampling,
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.get("/jobs/video/{job_id}", response_model=VideoJob)
+def get_video_job(job_id: str) -> VideoJob:
+    assert video_jobs is not None
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Video job '{job_id}' not found")
+    return job
+
+
+@app.get("/jobs/video/{job_id}/result")
+def get_video_job_result(job_id: str) -> DetectedWeapons:
+    job = get_video_job(job_id)
+    if job.status != JobStatus.COMPLETED or job.filePath is None:
+        raise HTTPException(409, f"Video job '{job_id}' is {job.status}{f': {job.error}' if job.error else ''}")
+    return {"filePath": job.filePath}
+
+
+def get_preloaded_models(preload: PreloadModelData) -> list[PreloadedModel]:
+    models = []
+    if preload.clip is not None:
+        # the server encodes images and text with separate requests, which get a model for each mode from the cache
+        for mode in ["vision", "text"]:
+            models.append(PreloadedModel(modelType=ModelType.CLIP, modelName=preload.clip, mode=mode))
+    if preload.facial_recognition is not None:
+        models.append(PreloadedModel(modelType=ModelType.FACIAL_RECOGNITION, modelName=preload.facial_recognition))
+    if preload.weapons_detection is not None:
+        models.append(PreloadedModel(modelType=ModelType.WEAPONS_DETECTION, modelName=preload.weapons_detection))
+    return models
+
+
+async def preload_models(models: list[PreloadedModel]) -> None:
+    log.info(f"Preloading {len(models)} models.")
+    await asyncio.gather(*[warm_up(model) for model in models])
+
+
+async def warm_up(preloaded_model: PreloadedModel) -> None:
+    options = get_options(preloaded_model.modelType, {"mode": preloaded_model.mode} if preloaded_model.mode else {})
+    try:
+        model = await get_model(preloaded_model.modelName, preloaded_model.modelType, options)
+        await run(InferenceModel.warm_up, model)
+    except Exception:
+        log.exception(f"Failed to preload {preloaded_model.modelType} model '{preloaded_model.modelName}'.")
+        preloaded_model.status = ModelStatus.FAILED
+    else:
+        log.info(f"Preloaded {preloaded_model.modelType} model '{preloaded_model.modelName}'.")
+        preloaded_model.status = ModelStatus.WARM
+
+
+def share_models() -> None:
+    """
+    Loads and warms up the preloaded models in the gunicorn master, before it forks the workers (`--preload`). The
+    workers then share the memory of the weights, and of the buffers ONNX Runtime prepares from them, rather than each
+    loading a copy, since memory is only copied once a process writes to it and inference doesn't.
+    """
+
+    asyncio.run(preload_models(get_preloaded_models(settings.preload)))
+    # a worker would load a model that expired or was evicted again as a copy of its own
+    model_cache.pin()
+
+
+async def run(func: Callable[..., Any], inputs: Any, pool: ThreadPoolExecutor | None = None) -> Any:
+    pool = pool or thread_pool
+    if pool is None:
         return func(inputs)
-    return await asyncio.get_running_loop().run_in_executor(thread_pool, func, inputs)
+    return await asyncio.get_running_loop().run_in_executor(pool, func, inputs)
 
 
 async def load(model: InferenceModel) -> InferenceModel:
     if model.loaded:
         return model
 
+    load_lock = model_cache.load_lock(model)
+
     def _load(model: InferenceModel) -> None:
-        with lock:
+        with load_lock:
             model.load()
 
     try:
         await run(_load, model)
-        return model
     except (OSError, InvalidProtobuf, BadZipFile, NoSuchFile):
         log.warning(
             (
@@ -176,7 +630,8 @@ async def load(model: InferenceModel) -> InferenceModel:
         )
         model.clear_cache()
         await run(_load, model)
-        return model
+    await model_cache.evict(keep=model)
+    return model
 
 
 async def idle_shutdown_task() -> None:
@@ -185,10 +640,16 @@ async def idle_shutdown_task() -> None:
         if (
             last_called is not None
             and not active_requests
-            and not lock.locked()
+            and not model_cache.loading
+            and not (video_jobs is not None and video_jobs.busy)
             and time.time() - last_called > settings.model_ttl
         ):
             log.info("Shutting down due to inactivity.")
             os.kill(os.getpid(), signal.SIGINT)
             break
         await asyncio.sleep(settings.model_ttl_poll_s)
+
+
+# with gunicorn's `--preload`, the app is imported once by the master before it forks the workers
+if settings.share_models:
+    share_models()
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import hashlib
 from abc import ABC, abstractmethod
+from functools import cached_property
 from pathlib import Path
 from shutil import rmtree
 from typing import Any
@@ -15,7 +17,7 @@ import ann.ann
 from app.models.constants import STATIC_INPUT_PROVIDERS, SUPPORTED_PROVIDERS
 
 from ..config import get_cache_dir, get_hf_model_name, log, settings
-from ..schemas import ModelRuntime, ModelType
+from ..schemas import ModelOptions, ModelRuntime, ModelType
 from .ann import AnnSession
 
 
@@ -33,6 +35,8 @@ class InferenceModel(ABC):
         **model_kwargs: Any,
     ) -> None:
         self.loaded = False
+        # the memory the loaded model is expected to take, in bytes
+        self.estimated_size = 0
         self.model_name = model_name
         self.cache_dir = Path(cache_dir) if cache_dir is not None else self.cache_dir_default
         self.providers = providers if providers is not None else self.providers_default
@@ -52,22 +56,60 @@ class InferenceModel(ABC):
             return
         self.download()
         log.info(f"Loading {self.model_type.replace('-', ' ')} model '{self.model_name}' to memory")
+        self.estimated_size = 0
         self._load()
         self.loaded = True
 
-    def predict(self, inputs: Any, **model_kwargs: Any) -> Any:
+    def predict(self, inputs: Any, options: ModelOptions | None = None) -> Any:
         self.load()
-        if model_kwargs:
-            self.configure(**model_kwargs)
+        if options is not None:
+            self.configure(options)
         return self._predict(inputs)
 
+    def predict_batch(self, inputs: list[Any], options: ModelOptions | None = None) -> list[Any]:
+        self.load()
+        if options is not None:
+            self.configure(options)
+        return self._predict_batch(inputs)
+
     @abstractmethod
     def _predict(self, inputs: Any) -> Any:
         ...
 
-    def configure(self, **model_kwargs: Any) -> None:
+    def _predict_batch(self, inputs: list[Any]) -> list[Any]:
+        # models whose sessions have a batch axis can override this to run the inputs at once
+        return [self._predict(item) for item in inputs]
+
+    def configure(self, options: ModelOptions) -> None:
+        """Applies the options of a request, which were validated with the options model of `model_type`."""
+
         pass
 
+    def warm_up(self) -> None:
+        """
+        Loads the model and runs dummy inputs through it, so the first request doesn't wait for the download, the
+        sessions or the first-run setup of their kernels.
+        """
+
+        self.load()
+        self._warm_up()
+
+    def _warm_up(self) -> None:
+        pass
+
+    @cached_property
+    def version(self) -> str:
+        """Identifies the files of the model, so results of a model that was downloaded again aren't reused."""
+
+        digest = hashlib.sha256()
+        for path in sorted(path for path in self.cache_dir.rglob("*") if path.is_file()):
+            stat = path.stat()
+            digest.update(f"{path.relative_to(self.cache_dir)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        # the quantized models give slightly different results from the ones they were quantized from
+        if settings.quantized:
+            digest.update(b"quantized")
+        return digest.hexdigest()[:16]
+
     def _download(self) -> None:
         ignore_patterns = [] if self.preferred_runtime == ModelRuntime.ARMNN else ["*.armnn"]
         snapshot_download(
@@ -115,8 +157,17 @@ class InferenceModel(ABC):
             )
             model_path = onnx_path
 
+        if settings.quantized and model_path.suffix == ".onnx":
+            quantized_path = model_path.with_name(f"{model_path.stem}_int8.onnx")
+            if quantized_path.is_file():
+                model_path = quantized_path
+            else:
+                log.debug(f"No quantized model found at '{quantized_path}'. Using '{model_path}' instead.")
+
+        self.estimated_size += self._weights_size(model_path)
+
         if any(provider in STATIC_INPUT_PROVIDERS for provider in self.providers):
-            static_path = model_path.parent / "static_1" / "model.onnx"
+            static_path = model_path.parent / "static_1" / model_path.name
             static_path.parent.mkdir(parents=True, exist_ok=True)
             if not static_path.is_file():
                 self._convert_to_static(model_path, static_path)
@@ -136,6 +187,22 @@ class InferenceModel(ABC):
                 raise ValueError(f"Unsupported model file type: {model_path.suffix}")
         return session
 
+    def _weights_size(self, model_path: Path) -> int:
+        """
+        Estimates the memory a session of the model takes from the size of its weights, which is most of it. Large
+        ONNX models keep their weights in external files, which the model file only refers to.
+        """
+
+        size = model_path.stat().st_size
+        if model_path.suffix != ".onnx" or size > 2**24:
+            return size
+
+        graph = onnx.load(model_path.as_posix(), load_external_data=False).graph
+        constants = [attr.t for node in graph.node for attr in node.attribute if attr.HasField("t")]
+        tensors = [*graph.initializer, *constants]
+        locations = {entry.value for tensor in tensors for entry in tensor.external_data if entry.key == "location"}
+        return size + sum((model_path.parent / location).stat().st_size for location in locations)
+
     def _convert_to_static(self, source_path: Path, target_path: Path) -> None:
         inferred = infer_shapes(onnx.load(source_path))
         inputs = self._get_static_dims(inferred.graph.input)
@@ -172,6 +239,14 @@ class InferenceModel(ABC):
             for field in graph_io
         }
 
+    @property
+    def dynamic_batching(self) -> bool:
+        """Whether the model's sessions accept more than one input at a time."""
+
+        return self.preferred_runtime != ModelRuntime.ARMNN and not any(
+            provider in STATIC_INPUT_PROVIDERS for provider in self.providers
+        )
+
     @property
     def model_type(self) -> ModelType:
         return self._model_type
@@ -256,6 +331,12 @@ class InferenceModel(ABC):
         sess_options = ort.SessionOptions()
         sess_options.enable_cpu_mem_arena = False
 
+        # shared models are loaded before gunicorn forks the workers, and the threads of a session don't survive that
+        if settings.share_models:
+            sess_options.inter_op_num_threads = 1
+            sess_options.intra_op_num_threads = 1
+            return sess_options
+
         # avoid thread contention between models
         if settings.model_inter_op_threads > 0:
             sess_options.inter_op_num_threads = settings.model_inter_op_threads
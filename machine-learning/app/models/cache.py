@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict, defaultdict
 from typing import Any
 
 from aiocache.backends.memory import SimpleMemoryCache
@@ -6,12 +8,16 @@ from aiocache.plugins import BasePlugin, TimingPlugin
 
 from app.models import from_model_type
 
-from ..schemas import ModelType, has_profiling
+from ..config import log
+from ..schemas import CachedModel, ModelCacheStats, ModelType, has_profiling
 from .base import InferenceModel
 
 
 class ModelCache:
-    """Fetches a model from an in-memory cache, instantiating it if it's missing."""
+    """
+    Fetches a model from an in-memory cache, instantiating it if it's missing. If the loaded models take more memory
+    than `max_size`, the least recently used ones are unloaded.
+    """
 
     def __init__(
         self,
@@ -19,6 +25,7 @@ class ModelCache:
         revalidate: bool = False,
         timeout: int | None = None,
         profiling: bool = False,
+        max_size: int = 0,
     ) -> None:
         """
         Args:
@@ -26,9 +33,11 @@ class ModelCache:
             revalidate: Resets TTL on cache hit. Useful to keep models in memory while active. Defaults to False.
             timeout: Maximum allowed time for model to load. Disabled if None. Defaults to None.
             profiling: Collects metrics for cache operations, adding slight overhead. Defaults to False.
+            max_size: Maximum total estimated size of the loaded models in bytes. Disabled if 0. Defaults to 0.
         """
 
         self.ttl = ttl
+        self.max_size = max_size
         plugins = []
 
         if revalidate:
@@ -37,6 +46,15 @@ class ModelCache:
             plugins.append(TimingPlugin())
 
         self.cache = SimpleMemoryCache(ttl=ttl, timeout=timeout, plugins=plugins, namespace=None)
+        # held while a model loads, so models load in parallel with each other but each one only loads once
+        self.load_locks: defaultdict[str, threading.Lock] = defaultdict(threading.Lock)
+        # keys of the cached models, from least to most recently used
+        self.recency: OrderedDict[str, None] = OrderedDict()
+        # keys of the models that neither expire nor get evicted
+        self.pinned: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     async def get(self, model_name: str, model_type: ModelType, **model_kwargs: Any) -> InferenceModel:
         """
@@ -48,14 +66,101 @@ class ModelCache:
             model: The requested model.
         """
 
-        key = f"{model_name}{model_type.value}{model_kwargs.get('mode', '')}"
+        key = self._key(model_name, model_type, model_kwargs.get("mode"))
         async with OptimisticLock(self.cache, key) as lock:
             model: InferenceModel | None = await self.cache.get(key)
             if model is None:
+                self.misses += 1
                 model = from_model_type(model_type, model_name, **model_kwargs)
                 await lock.cas(model, ttl=self.ttl)
+            else:
+                self.hits += 1
+        self.recency[key] = None
+        self.recency.move_to_end(key)
         return model
 
+    async def evict(self, keep: InferenceModel | None = None) -> None:
+        """
+        Removes the least recently used loaded models until the rest fit in `max_size`. Call this after loading a
+        model, passing it as `keep`, so the model that was just loaded isn't the one that's evicted.
+        """
+
+        if self.max_size <= 0:
+            return
+
+        models = self._models()
+        size = sum(model.estimated_size for model in models.values() if model.loaded)
+        for key, model in models.items():
+            if size <= self.max_size:
+                break
+            if model is keep or not model.loaded or key in self.pinned:
+                continue
+            # requests that already got the model finish with it, after which it's garbage collected
+            await self.cache.delete(key)
+            del self.recency[key]
+            size -= model.estimated_size
+            self.evictions += 1
+            log.info(f"Unloaded {model.model_type.replace('-', ' ')} model '{model.model_name}' to free memory")
+        if size > self.max_size:
+            log.warning(f"Loaded models take an estimated {size} bytes, more than the budget of {self.max_size}")
+
+    def pin(self) -> None:
+        """Keeps the models that are cached now for as long as the cache exists, ignoring the TTL and `max_size`."""
+
+        for key in self._models():
+            if (handle := self.cache._handlers.pop(key, None)) is not None:
+                handle.cancel()
+            self.pinned.add(key)
+
+    def stats(self) -> ModelCacheStats:
+        """Hits, misses and evictions of this worker since it started, and the models it has cached."""
+
+        requests = self.hits + self.misses
+        models: list[CachedModel] = [
+            {
+                "modelName": model.model_name,
+                "modelType": model.model_type,
+                "loaded": model.loaded,
+                "size": model.estimated_size,
+            }
+            for model in self._models().values()
+        ]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "size": sum(model["size"] for model in models if model["loaded"]),
+            "maxSize": self.max_size,
+            "models": models,
+        }
+
+    def _models(self) -> dict[str, InferenceModel]:
+        """The cached models, from least to most recently used. Models whose TTL ran out are forgotten."""
+
+        models = {}
+        for key in list(self.recency):
+            model = self.cache._cache.get(key)
+            if model is None:
+                del self.recency[key]
+            else:
+                models[key] = model
+        return models
+
+    def load_lock(self, model: InferenceModel) -> threading.Lock:
+        """The lock to hold while loading `model`, which it shares with other instances of the same model."""
+
+        return self.load_locks[self._key(model.model_name, model.model_type, getattr(model, "mode", None))]
+
+    @property
+    def loading(self) -> bool:
+        """Whether any model is being loaded."""
+
+        return any(lock.locked() for lock in list(self.load_locks.values()))
+
+    def _key(self, model_name: str, model_type: ModelType, mode: str | None) -> str:
+        return f"{model_name}{model_type.value}{mode or ''}"
+
     async def get_profiling(self) -> dict[str, float] | None:
         if not has_profiling(self.cache):
             return None
@@ -1,7 +1,6 @@
 import json
 from abc import abstractmethod
 from functools import cached_property
-from io import BytesIO
 from pathlib import Path
 from typing import Any, Literal
 
@@ -11,7 +10,7 @@ from PIL import Image
 from tokenizers import Encoding, Tokenizer
 
 from app.config import clean_name, log
-from app.models.transforms import crop, get_pil_resampling, normalize, resize, to_numpy
+from app.models.transforms import as_file, get_buffer, get_pil_resampling, preprocess
 from app.schemas import ModelType
 
 from .base import InferenceModel
@@ -41,9 +40,15 @@ class BaseCLIPEncoder(InferenceModel):
             self.vision_model = self._make_session(self.visual_path)
             log.debug(f"Loaded clip vision model '{self.model_name}'")
 
+    def _warm_up(self) -> None:
+        if self.mode == "vision" or self.mode is None:
+            self._predict(Image.new("RGB", (224, 224)))
+        if self.mode == "text" or self.mode is None:
+            self._predict("")
+
     def _predict(self, image_or_text: Image.Image | str) -> NDArray[np.float32]:
-        if isinstance(image_or_text, bytes):
-            image_or_text = Image.open(BytesIO(image_or_text))
+        if isinstance(image_or_text, bytes | memoryview):
+            image_or_text = Image.open(as_file(image_or_text))
 
         match image_or_text:
             case Image.Image():
@@ -59,14 +64,47 @@ class BaseCLIPEncoder(InferenceModel):
 
         return outputs
 
+    def _predict_batch(self, inputs: list[Image.Image | str | bytes | memoryview]) -> list[NDArray[np.float32]]:
+        if not self.dynamic_batching:
+            return super()._predict_batch(inputs)
+
+        items = [Image.open(as_file(item)) if isinstance(item, bytes | memoryview) else item for item in inputs]
+        images = {i: item for i, item in enumerate(items) if isinstance(item, Image.Image)}
+        texts = {i: item for i, item in enumerate(items) if isinstance(item, str)}
+        if len(images) + len(texts) != len(items):
+            invalid = next(item for item in items if not isinstance(item, (Image.Image, str)))
+            raise TypeError(f"Expected Image or str, but got: {type(invalid)}")
+
+        outputs: list[NDArray[np.float32]] = [np.empty(0, dtype=np.float32)] * len(items)
+        if images:
+            if self.mode == "text":
+                raise TypeError("Cannot encode image as text-only model")
+            batch = self.transform_batch(list(images.values()))
+            for i, embedding in zip(images, self.vision_model.run(None, batch)[0]):
+                outputs[i] = embedding
+        if texts:
+            if self.mode == "vision":
+                raise TypeError("Cannot encode text as vision-only model")
+            tokens = self.tokenize_batch(list(texts.values()))
+            for i, embedding in zip(texts, self.text_model.run(None, tokens)[0]):
+                outputs[i] = embedding
+        return outputs
+
     @abstractmethod
     def tokenize(self, text: str) -> dict[str, NDArray[np.int32]]:
         pass
 
+    @abstractmethod
+    def tokenize_batch(self, texts: list[str]) -> dict[str, NDArray[np.int32]]:
+        pass
+
     @abstractmethod
     def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
         pass
 
+    def transform_batch(self, images: list[Image.Image]) -> dict[str, NDArray[np.float32]]:
+        return _concatenate([self.transform(image) for image in images])
+
     @property
     def textual_dir(self) -> Path:
         return self.cache_dir / "textual"
@@ -153,6 +191,11 @@ class OpenCLIPEncoder(BaseCLIPEncoder):
         self.mean = np.array(self.preprocess_cfg["mean"], dtype=np.float32)
         self.std = np.array(self.preprocess_cfg["std"], dtype=np.float32)
 
+    @property
+    def decode_size(self) -> int:
+        # same as the reduced JPEG decoding in `preprocess`
+        return self.size * 2
+
     def _load_tokenizer(self) -> Tokenizer:
         log.debug(f"Loading tokenizer for CLIP model '{self.model_name}'")
 
@@ -172,12 +215,19 @@ class OpenCLIPEncoder(BaseCLIPEncoder):
         tokens: Encoding = self.tokenizer.encode(text)
         return {"text": np.array([tokens.ids], dtype=np.int32)}
 
+    def tokenize_batch(self, texts: list[str]) -> dict[str, NDArray[np.int32]]:
+        batch: list[Encoding] = self.tokenizer.encode_batch(texts)
+        return {"text": np.array([tokens.ids for tokens in batch], dtype=np.int32)}
+
     def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
-        image = resize(image, self.size)
-        image = crop(image, self.size)
-        image_np = to_numpy(image)
-        image_np = normalize(image_np, self.mean, self.std)
-        return {"image": np.expand_dims(image_np.transpose(2, 0, 1), 0)}
+        return self.transform_batch([image])
+
+    def transform_batch(self, images: list[Image.Image]) -> dict[str, NDArray[np.float32]]:
+        # reused by the next call in this thread, which is fine since the session runs on it right away
+        batch = get_buffer(len(images), self.size)
+        for image, out in zip(images, batch):
+            preprocess(image, self.size, self.mean, self.std, out=out)
+        return {"image": batch}
 
 
 class MCLIPEncoder(OpenCLIPEncoder):
@@ -187,3 +237,14 @@ class MCLIPEncoder(OpenCLIPEncoder):
             "input_ids": np.array([tokens.ids], dtype=np.int32),
             "attention_mask": np.array([tokens.attention_mask], dtype=np.int32),
         }
+
+    def tokenize_batch(self, texts: list[str]) -> dict[str, NDArray[np.int32]]:
+        batch: list[Encoding] = self.tokenizer.encode_batch(texts)
+        return {
+            "input_ids": np.array([tokens.ids for tokens in batch], dtype=np.int32),
+            "attention_mask": np.array([tokens.attention_mask for tokens in batch], dtype=np.int32),
+        }
+
+
+def _concatenate(inputs: list[dict[str, NDArray[Any]]]) -> dict[str, NDArray[Any]]:
+    return {name: np.concatenate([item[name] for item in inputs]) for name in inputs[0]}
@@ -1,20 +1,22 @@
 from pathlib import Path
 from typing import Any
 
-import cv2
 import numpy as np
 from insightface.model_zoo import ArcFaceONNX, RetinaFace
 from insightface.utils.face_align import norm_crop
 from numpy.typing import NDArray
 
 from app.config import clean_name
-from app.schemas import Face, ModelType, is_ndarray
+from app.schemas import Face, FacialRecognitionOptions, ModelOptions, ModelType, is_ndarray
 
 from .base import InferenceModel
+from .transforms import DecodedImage, decode_reduced
 
 
 class FaceRecognizer(InferenceModel):
     _model_type = ModelType.FACIAL_RECOGNITION
+    # twice the detection input size, since faces are cropped for recognition from the decoded image
+    decode_size = 1280
 
     def __init__(
         self,
@@ -37,11 +39,19 @@ class FaceRecognizer(InferenceModel):
         )
         self.rec_model.prepare(ctx_id=0)
 
-    def _predict(self, image: NDArray[np.uint8] | bytes) -> list[Face]:
-        if isinstance(image, bytes):
-            decoded_image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    def _warm_up(self) -> None:
+        # a blank image has no faces to recognize, so the recognition model is run on its own
+        self.det_model.detect(np.zeros((640, 640, 3), dtype=np.uint8))
+        self.rec_model.get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+
+    def _predict(self, image: NDArray[np.uint8] | bytes | memoryview | DecodedImage) -> list[Face]:
+        if isinstance(image, bytes | memoryview):
+            decoded = decode_reduced(image, self.decode_size)
+        elif isinstance(image, np.ndarray):
+            decoded = DecodedImage.full(image)
         else:
-            decoded_image = image
+            decoded = image
+        decoded_image = decoded.image
         assert is_ndarray(decoded_image, np.uint8)
         bboxes, kpss = self.det_model.detect(decoded_image)
         if bboxes.size == 0:
@@ -49,10 +59,10 @@ class FaceRecognizer(InferenceModel):
         assert is_ndarray(kpss, np.float32)
 
         scores = bboxes[:, 4].tolist()
-        bboxes = bboxes[:, :4].round().tolist()
+        bboxes = decoded.to_original(bboxes[:, :4]).round().tolist()
 
         results = []
-        height, width, _ = decoded_image.shape
+        height, width = decoded.height, decoded.width
         for (x1, y1, x2, y2), score, kps in zip(bboxes, scores, kpss):
             cropped_img = norm_crop(decoded_image, kps)
             embedding: NDArray[np.float32] = self.rec_model.get_feat(cropped_img)[0]
@@ -83,5 +93,7 @@ class FaceRecognizer(InferenceModel):
     def rec_file(self) -> Path:
         return self.cache_dir / "recognition" / f"model.{self.preferred_runtime}"
 
-    def configure(self, **model_kwargs: Any) -> None:
-        self.det_model.det_thresh = model_kwargs.pop("minScore", self.det_model.det_thresh)
+    def configure(self, options: ModelOptions) -> None:
+        assert isinstance(options, FacialRecognitionOptions)
+        if options.minScore is not None:
+            self.det_model.det_thresh = options.minScore
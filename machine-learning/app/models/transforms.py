@@ -1,8 +1,18 @@
+import threading
+from dataclasses import dataclass
+from io import BytesIO, RawIOBase
+from typing import BinaryIO
+
+import cv2
 import numpy as np
 from numpy.typing import NDArray
-from PIL import Image
+from PIL import ExifTags, Image, JpegImagePlugin
 
 _PIL_RESAMPLING_METHODS = {resampling.name.lower(): resampling for resampling in Image.Resampling}
+_buffers = threading.local()
+_CV2_REDUCED_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+# EXIF orientations that rotate the image by 90 degrees, which cv2 applies when decoding
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
 
 
 def resize(img: Image.Image, size: int) -> Image.Image:
@@ -32,5 +42,256 @@ def normalize(
     return (img - mean) / std
 
 
+def preprocess(
+    img: Image.Image,
+    size: int,
+    mean: NDArray[np.float32],
+    std: NDArray[np.float32],
+    out: NDArray[np.float32] | None = None,
+) -> NDArray[np.float32]:
+    """
+    Fused equivalent of `resize`, `crop`, `to_numpy` and `normalize` followed by a transpose to CHW. The crop is
+    applied as part of a single resize, and the pixels are normalized straight into `out` without intermediate
+    float copies. JPEGs that haven't been loaded yet are decoded at a reduced scale, down to twice the target size.
+    """
+
+    # no-op for other formats or images that were already decoded
+    img.draft(None, (size * 2, size * 2))
+    if img.width < img.height:
+        resized = (size, int((img.height / img.width) * size))
+    else:
+        resized = (int((img.width / img.height) * size), size)
+    left = int((resized[0] / 2) - (size / 2))
+    upper = int((resized[1] / 2) - (size / 2))
+    scale_x, scale_y = img.width / resized[0], img.height / resized[1]
+    box = (left * scale_x, upper * scale_y, (left + size) * scale_x, (upper + size) * scale_y)
+    pixels = np.asarray(img.resize((size, size), resample=Image.Resampling.BICUBIC, box=box).convert("RGB"))
+
+    if out is None:
+        out = np.empty((3, size, size), dtype=np.float32)
+    # (x / 255 - mean) / std, as one multiply and one subtract
+    np.multiply(pixels.transpose(2, 0, 1), (1 / (255 * std))[:, None, None], out=out)
+    np.subtract(out, (mean / std)[:, None, None], out=out)
+    return out
+
+
+def get_buffer(batch_size: int, size: int, width: int | None = None) -> NDArray[np.float32]:
+    """
+    Returns a contiguous NCHW buffer for a batch of RGB images that are `size` square, or `size` high and `width` wide.
+    The buffer is reused by later calls from the same thread, so its contents are only valid until then.
+    """
+
+    shape = (size, width or size)
+    buffers: dict[tuple[int, int], NDArray[np.float32]] = _buffers.__dict__.setdefault("buffers", {})
+    buffer = buffers.get(shape)
+    if buffer is None or len(buffer) < batch_size:
+        buffer = buffers[shape] = np.empty((batch_size, 3, *shape), dtype=np.float32)
+    return buffer[:batch_size]
+
+
+@dataclass
+class Letterbox:
+    """Where `letterbox` placed an image in the input it was padded to."""
+
+    width: int
+    height: int
+    scale_x: float
+    scale_y: float
+    left: int
+    top: int
+
+    def to_original(self, boxes: NDArray[np.float32]) -> NDArray[np.float32]:
+        """Maps the `xyxy` columns of `xyxy, ...` boxes back to the image, clipped to its bounds."""
+
+        original = boxes.copy()
+        original[:, [0, 2]] = ((boxes[:, [0, 2]] - self.left) / self.scale_x).clip(0, self.width)
+        original[:, [1, 3]] = ((boxes[:, [1, 3]] - self.top) / self.scale_y).clip(0, self.height)
+        return original
+
+
+def letterbox_shape(height: int, width: int, size: int, stride: int | None = None) -> tuple[int, int]:
+    """
+    Height and width of an image after `letterbox`: a `size` square, or if `stride` is given, the image scaled to fit
+    that square and padded to the next multiple of `stride`.
+    """
+
+    if stride is None:
+        return size, size
+    ratio = min(size / height, size / width)
+    resized_width, resized_height = round(width * ratio), round(height * ratio)
+    return resized_height + (size - resized_height) % stride, resized_width + (size - resized_width) % stride
+
+
+def letterbox(
+    image: NDArray[np.uint8], size: int, out: NDArray[np.float32] | None = None, stride: int | None = None
+) -> tuple[NDArray[np.float32], Letterbox]:
+    """
+    Scales a BGR image to fit a `size` square without distorting it and pads the rest with gray, as Ultralytics'
+    `LetterBox` does for YOLO. The RGB pixels are written to `out` in CHW order, scaled to [0, 1]. If `stride` is
+    given, the image is only padded to the shape from `letterbox_shape`, which models with dynamic input sizes take.
+    """
+
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    resized_width, resized_height = round(width * ratio), round(height * ratio)
+    padded_height, padded_width = letterbox_shape(height, width, size, stride)
+    left = round((padded_width - resized_width) / 2 - 0.1)
+    top = round((padded_height - resized_height) / 2 - 0.1)
+    if (resized_width, resized_height) != (width, height):
+        image = cv2.resize(image, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+
+    if out is None:
+        out = np.empty((3, padded_height, padded_width), dtype=np.float32)
+    out.fill(114 / 255)
+    pixels = out[:, top : top + resized_height, left : left + resized_width]
+    np.divide(image[..., ::-1].transpose(2, 0, 1), 255, out=pixels, dtype=np.float32)
+    return out, Letterbox(width, height, resized_width / width, resized_height / height, left, top)
+
+
+def non_max_suppression(
+    prediction: NDArray[np.float32],
+    confidence: float,
+    iou_threshold: float = 0.7,
+    max_detections: int = 300,
+    max_candidates: int = 30000,
+) -> NDArray[np.float32]:
+    """
+    Selects the boxes of one image from the raw `(4 + classes, anchors)` output of a YOLOv8 model, like Ultralytics'
+    `non_max_suppression` with its defaults. Returns `xyxy, conf, class` boxes, highest confidence first.
+    """
+
+    scores = prediction[4:]
+    class_ids = scores.argmax(0)
+    conf = np.take_along_axis(scores, class_ids[None], 0)[0]
+    candidates = np.flatnonzero(conf > confidence)
+    candidates = candidates[conf[candidates].argsort(kind="stable")[::-1][:max_candidates]]
+    if not len(candidates):
+        return np.empty((0, 6), dtype=np.float32)
+
+    boxes = np.empty((len(candidates), 6), dtype=np.float32)
+    center, half_size = prediction[:2, candidates].T, prediction[2:4, candidates].T / 2
+    boxes[:, :2], boxes[:, 2:4] = center - half_size, center + half_size
+    boxes[:, 4], boxes[:, 5] = conf[candidates], class_ids[candidates]
+
+    # boxes of different classes are moved apart so they never overlap, as Ultralytics does
+    shifted = boxes[:, :4] + boxes[:, 5:6] * 7680
+    areas = (shifted[:, 2] - shifted[:, 0]) * (shifted[:, 3] - shifted[:, 1])
+    order = np.arange(len(boxes))
+    keep: list[int] = []
+    while len(order) and len(keep) < max_detections:
+        best, order = order[0], order[1:]
+        keep.append(best)
+        top_left = np.maximum(shifted[best, :2], shifted[order, :2])
+        bottom_right = np.minimum(shifted[best, 2:], shifted[order, 2:])
+        intersection = (bottom_right - top_left).clip(0).prod(1)
+        order = order[intersection / (areas[best] + areas[order] - intersection) <= iou_threshold]
+    selected: NDArray[np.float32] = boxes[keep]
+    return selected
+
+
 def get_pil_resampling(resample: str) -> Image.Resampling:
     return _PIL_RESAMPLING_METHODS[resample.lower()]
+
+
+class BufferReader(RawIOBase):
+    """Reads a buffer such as a memory map as a file without copying it, which `BytesIO` only avoids for `bytes`."""
+
+    def __init__(self, data: bytes | memoryview) -> None:
+        self.data = memoryview(data).cast("B")
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        size = max(min(len(buffer), len(self.data) - self.position), 0)
+        buffer[:size] = self.data[self.position : self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.position, 2: len(self.data)}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+def as_file(data: bytes | memoryview) -> BinaryIO:
+    # BytesIO shares the memory of `bytes`, but copies any other buffer
+    return BytesIO(data) if isinstance(data, bytes) else BufferReader(data)  # type: ignore[return-value]
+
+
+def decode_cv2(data: bytes | memoryview) -> NDArray[np.uint8]:
+    image: NDArray[np.uint8] | None = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+@dataclass
+class DecodedImage:
+    """An image that may have been decoded at a fraction of its original size."""
+
+    image: NDArray[np.uint8]
+    width: int
+    height: int
+
+    @classmethod
+    def full(cls, image: NDArray[np.uint8]) -> "DecodedImage":
+        height, width = image.shape[:2]
+        return cls(image, width, height)
+
+    @property
+    def reduced(self) -> bool:
+        return self.image.shape[:2] != (self.height, self.width)
+
+    def to_original(self, points: NDArray[np.float32]) -> NDArray[np.float32]:
+        """Scales `x, y` coordinate pairs in the last axis from the decoded image to the original image."""
+
+        if not self.reduced:
+            return points
+        decoded_height, decoded_width = self.image.shape[:2]
+        scale = np.array([self.width / decoded_width, self.height / decoded_height], dtype=np.float32)
+        original: NDArray[np.float32] = (points.reshape(*points.shape[:-1], -1, 2) * scale).reshape(points.shape)
+        return original
+
+
+def get_reduction(width: int, height: int, min_size: int) -> int:
+    """Largest factor of 2, 4 or 8 that keeps the longer side of the image at least `min_size`, or 1 if there's none."""
+
+    for factor in _CV2_REDUCED_FLAGS:
+        if max(width, height) // factor >= min_size:
+            return factor
+    return 1
+
+
+def decode_reduced(data: bytes | memoryview, min_size: int | None) -> DecodedImage:
+    """
+    Decodes a JPEG with cv2 at the smallest scale that keeps its longer side at least `min_size`, which skips most of
+    the decoding work and memory. Other formats are decoded at full size, as are all images if `min_size` is None.
+    Use `DecodedImage.to_original` to map coordinates back.
+    """
+
+    if min_size is None or data[:2] != b"\xff\xd8":
+        return DecodedImage.full(decode_cv2(data))
+    try:
+        # only reads the header. Bypasses Image.open, which other libraries may patch to try extra plugins
+        with JpegImagePlugin.JpegImageFile(as_file(data)) as img:
+            width, height = img.size
+            if img.getexif().get(ExifTags.Base.Orientation, 1) in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+    except (SyntaxError, OSError):
+        return DecodedImage.full(decode_cv2(data))
+
+    factor = get_reduction(width, height, min_size)
+    if factor == 1:
+        return DecodedImage.full(decode_cv2(data))
+    image: NDArray[np.uint8] | None = cv2.imdecode(np.frombuffer(data, np.uint8), _CV2_REDUCED_FLAGS[factor])
+    if image is None:
+        raise ValueError("Could not decode image")
+    return DecodedImage(image, width, height)
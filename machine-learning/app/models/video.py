@@ -0,0 +1,473 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Empty, Full, Queue
+from types import TracebackType
+from typing import Any, Callable, Iterator
+
+import cv2
+import numpy as np
+from numpy.typing import NDArray
+
+from app.config import settings
+from app.schemas import WeaponTrack
+
+
+class FrameSampler(ABC):
+    """Decides which video frames to run detection on. Skipped frames reuse the boxes of the last sampled frame."""
+
+    def start(self, fps: float) -> None:
+        pass
+
+    @abstractmethod
+    def should_sample(self, index: int, frame: NDArray[np.uint8]) -> bool:
+        ...
+
+    def __repr__(self) -> str:
+        # identifies the sampling settings before `start` adds the state of a video
+        params = ", ".join(f"{name}={value!r}" for name, value in sorted(vars(self).items()))
+        return f"{type(self).__name__}({params})"
+
+
+class AllFrames(FrameSampler):
+    def should_sample(self, index: int, frame: NDArray[np.uint8]) -> bool:
+        return True
+
+
+class IntervalSampler(FrameSampler):
+    """Samples every Nth frame."""
+
+    def __init__(self, interval: int) -> None:
+        if interval < 1:
+            raise ValueError(f"Sampling interval must be at least 1, but got {interval}")
+        self.interval = interval
+
+    def start(self, fps: float) -> None:
+        self.next_index = 0
+
+    def should_sample(self, index: int, frame: NDArray[np.uint8]) -> bool:
+        # relative to the first frame seen, since a resumed video doesn't start at 0
+        if index >= self.next_index:
+            self.next_index = index + self.interval
+            return True
+        return False
+
+
+class FpsSampler(IntervalSampler):
+    """Samples frames at a fixed rate regardless of the video's frame rate."""
+
+    def __init__(self, target_fps: float) -> None:
+        if target_fps <= 0:
+            raise ValueError(f"Target FPS must be positive, but got {target_fps}")
+        self.target_fps = target_fps
+
+    def start(self, fps: float) -> None:
+        super().start(fps)
+        self.interval = max(round(fps / self.target_fps), 1) if fps > 0 else 1
+
+
+class SceneChangeSampler(FrameSampler):
+    """
+    Samples a frame when it differs enough from the last sampled frame, comparing small grayscale thumbnails.
+    Detection still runs at least every `max_interval` frames so slow changes are not missed.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.01,
+        max_interval: int = 30,
+        pixel_threshold: float = 0.1,
+        thumbnail_size: int = 32,
+    ) -> None:
+        """
+        Args:
+            threshold: Fraction of thumbnail pixels that must change for a frame to count as a scene change.
+            max_interval: Maximum number of frames between two sampled frames.
+            pixel_threshold: Difference in intensity, from 0 to 1, above which a thumbnail pixel counts as changed.
+                This keeps noise and compression artifacts from triggering detection.
+            thumbnail_size: Width and height of the thumbnails that are compared.
+        """
+
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.pixel_threshold = pixel_threshold * 255
+        self.thumbnail_size = thumbnail_size
+
+    def start(self, fps: float) -> None:
+        self.last_thumbnail: NDArray[np.int16] | None = None
+        self.last_index = 0
+
+    def should_sample(self, index: int, frame: NDArray[np.uint8]) -> bool:
+        thumbnail = self._thumbnail(frame)
+        if (
+            self.last_thumbnail is None
+            or index - self.last_index >= self.max_interval
+            or float((np.abs(thumbnail - self.last_thumbnail) > self.pixel_threshold).mean()) > self.threshold
+        ):
+            self.last_thumbnail = thumbnail
+            self.last_index = index
+            return True
+        return False
+
+    def _thumbnail(self, frame: NDArray[np.uint8]) -> NDArray[np.int16]:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        size = (self.thumbnail_size, self.thumbnail_size)
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def get_sampler(options: dict[str, Any] | None = None) -> FrameSampler:
+    """
+    Args:
+        options: The `sampling` request option, e.g. `{"strategy": "fps", "fps": 2}`. Samples every frame if None.
+    """
+
+    options = options or {}
+    match options.get("strategy", "all"):
+        case "all":
+            return AllFrames()
+        case "interval":
+            return IntervalSampler(int(options.get("interval", 5)))
+        case "fps":
+            return FpsSampler(float(options.get("fps", 2.0)))
+        case "scene":
+            return SceneChangeSampler(
+                float(options.get("sceneThreshold", 0.01)),
+                int(options.get("maxInterval", 30)),
+            )
+        case strategy:
+            raise ValueError(f"Unknown frame sampling strategy '{strategy}'")
+
+
+def in_media_folder(path: Path) -> bool:
+    """Whether `path` is inside one of the media folders the server shares with this service."""
+
+    # resolves `..` and symlinks so a request can't reach outside the folders
+    real_path = Path(os.path.realpath(path))
+    folders = [folder.strip() for folder in settings.media_folders.split(",") if folder.strip()]
+    return any(real_path.is_relative_to(os.path.realpath(folder)) for folder in folders)
+
+
+def resolve_video_path(video: str, save_directory: Path) -> Path:
+    """
+    Returns where to read a video sent by the server from. A video in a shared media folder is read in place.
+    Otherwise, the server copied the video into `save_directory` and only its name is used.
+    """
+
+    path = Path(video)
+    if path.is_absolute() and in_media_folder(path) and path.is_file():
+        return path
+    return save_directory / path.name
+
+
+def release_video(path: Path) -> None:
+    """Removes a video once it has been processed, unless it's the original in a shared media folder."""
+
+    if not in_media_folder(path):
+        os.remove(path)
+
+
+@dataclass
+class StageTimings:
+    """Time spent in one stage of a `VideoPipeline`, in seconds."""
+
+    total: float = 0.0
+    waiting: float = 0.0
+
+    @property
+    def busy(self) -> float:
+        return max(self.total - self.waiting, 0.0)
+
+    def __str__(self) -> str:
+        return f"{self.busy:.2f}s busy, {self.waiting:.2f}s waiting"
+
+
+class PipelineStopped(Exception):
+    """Raised inside a pipeline stage when another stage has stopped the pipeline."""
+
+
+_END = object()
+
+
+class VideoPipeline:
+    """
+    Overlaps the decoding and encoding of a video with inference. Batches of frames are decoded on one thread and
+    written on another, while the caller runs inference on the thread that iterates over the pipeline.
+
+    The queues between the stages are bounded, so a slow stage makes the others wait rather than buffering the
+    whole video in memory. If any stage fails, the others stop at their next queue operation and the error is
+    raised in the caller's thread.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(
+        self,
+        read: Callable[[], list[NDArray[np.uint8]]],
+        write: Callable[[NDArray[np.uint8], NDArray[np.float32]], None] | None,
+        queue_size: int = 4,
+        timings: dict[str, StageTimings] | None = None,
+    ) -> None:
+        """
+        Args:
+            read: Returns the next batch of decoded frames, or an empty list at the end of the video.
+            write: Encodes a frame with its detected boxes. Frames are dropped after inference if None.
+            queue_size: Maximum number of batches waiting between two stages.
+            timings: Filled with the time spent in the `decode`, `infer` and `encode` stages if given.
+        """
+
+        if queue_size < 1:
+            raise ValueError(f"Queue size must be at least 1, but got {queue_size}")
+        self.read = read
+        self.write = write
+        self.timings = timings if timings is not None else {}
+        for stage in ("decode", "infer", "encode"):
+            self.timings[stage] = StageTimings()
+        self._decoded: Queue[Any] = Queue(queue_size)
+        self._inferred: Queue[Any] = Queue(queue_size)
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+        self._decoder = threading.Thread(
+            target=self._run_stage, args=("decode", self._decode), name="video-decode", daemon=True
+        )
+        self._encoder = threading.Thread(
+            target=self._run_stage, args=("encode", self._encode), name="video-encode", daemon=True
+        )
+        self._threads = [self._decoder] if write is None else [self._decoder, self._encoder]
+
+    def __enter__(self) -> "VideoPipeline":
+        self._started = time.perf_counter()
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        try:
+            if exc is None and self.write is not None:
+                # let the encoder finish the frames that are still queued
+                self._put(self._inferred, _END, "infer")
+                self.timings["infer"].total = time.perf_counter() - self._started
+                self._encoder.join()
+                if self._error is not None:
+                    raise self._error
+        finally:
+            if not self.timings["infer"].total:
+                self.timings["infer"].total = time.perf_counter() - self._started
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+
+    def __iter__(self) -> Iterator[list[NDArray[np.uint8]]]:
+        while (frames := self._get(self._decoded, "infer")) is not _END:
+            yield frames
+
+    def put(self, frames: list[NDArray[np.uint8]], boxes: list[NDArray[np.float32]]) -> None:
+        """Queues a batch of frames to be encoded with the boxes detected in each of them."""
+
+        if self.write is not None:
+            self._put(self._inferred, list(zip(frames, boxes)), "infer")
+
+    def _check_stopped(self) -> None:
+        if not self._stop.is_set():
+            return
+        # the caller's thread gets the error that stopped the pipeline, while the other stages just exit
+        if self._error is not None and threading.current_thread() not in self._threads:
+            raise self._error
+        raise PipelineStopped
+
+    def _decode(self) -> None:
+        while frames := self.read():
+            self._put(self._decoded, frames, "decode")
+        self._put(self._decoded, _END, "decode")
+
+    def _encode(self) -> None:
+        assert self.write is not None
+        while (batch := self._get(self._inferred, "encode")) is not _END:
+            for frame, boxes in batch:
+                self.write(frame, boxes)
+
+    def _run_stage(self, stage: str, target: Callable[[], None]) -> None:
+        start = time.perf_counter()
+        try:
+            target()
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+        finally:
+            self.timings[stage].total = time.perf_counter() - start
+
+    def _put(self, queue: "Queue[Any]", item: Any, stage: str) -> None:
+        start = time.perf_counter()
+        try:
+            while True:
+                self._check_stopped()
+                try:
+                    queue.put(item, timeout=self.poll_interval)
+                    return
+                except Full:
+                    pass
+        finally:
+            self.timings[stage].waiting += time.perf_counter() - start
+
+    def _get(self, queue: "Queue[Any]", stage: str) -> Any:
+        start = time.perf_counter()
+        try:
+            while True:
+                self._check_stopped()
+                try:
+                    return queue.get(timeout=self.poll_interval)
+                except Empty:
+                    pass
+        finally:
+            self.timings[stage].waiting += time.perf_counter() - start
+
+
+class TimelineBuilder:
+    """Collects the tracked boxes of a video into one entry per track."""
+
+    def __init__(self, fps: float, names: dict[int, str]) -> None:
+        self.fps = fps
+        self.names = names
+        self.tracks: dict[int, WeaponTrack] = {}
+
+    def add(self, index: int, boxes: NDArray[np.float32]) -> None:
+        """
+        Args:
+            index: Index of a frame that detection was run on.
+            boxes: Tracked boxes of the frame in the `xyxy, track id, conf, class` format.
+        """
+
+        timestamp = self.timestamp(index)
+        for x1, y1, x2, y2, track_id, score, class_id in boxes.tolist():
+            track = self.tracks.get(int(track_id))
+            if track is None:
+                track = self.tracks[int(track_id)] = {
+                    "trackId": int(track_id),
+                    "className": self.names.get(int(class_id), str(int(class_id))),
+                    "firstFrame": index,
+                    "lastFrame": index,
+                    "startTime": timestamp,
+                    "endTime": timestamp,
+                    "maxScore": score,
+                    "boxes": [],
+                }
+            track["lastFrame"] = index
+            track["endTime"] = timestamp
+            track["maxScore"] = max(track["maxScore"], score)
+            track["boxes"].append(
+                {
+                    "frame": index,
+                    "timestamp": timestamp,
+                    "boundingBox": {"x1": round(x1), "y1": round(y1), "x2": round(x2), "y2": round(y2)},
+                    "score": score,
+                }
+            )
+
+    def build(self) -> list[WeaponTrack]:
+        return sorted(self.tracks.values(), key=lambda track: (track["firstFrame"], track["trackId"]))
+
+    def timestamp(self, index: int) -> float:
+        return round(index / self.fps, 3) if self.fps > 0 else 0.0
+
+
+class ClipWriter:
+    """
+    Writes annotated clips of only the parts of a video with detections, including up to `padding` frames before
+    and after each one. Detections with at most `2 * padding` frames between them, whose padding overlaps or touches,
+    end up in the same clip.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        name: str,
+        fps: float,
+        frame_size: tuple[int, int],
+        padding: int,
+        plot: Callable[[NDArray[np.uint8], NDArray[np.float32]], NDArray[np.uint8]],
+    ) -> None:
+        """
+        Args:
+            directory: Directory the clips are saved to.
+            name: File name of the video. Clips are named `detected_{stem}_{first frame}.mp4`.
+            fps: Frame rate of the video.
+            frame_size: Width and height of the video.
+            padding: Number of frames to include before and after each detection.
+            plot: Draws boxes on a frame.
+        """
+
+        self.directory = directory
+        self.stem = Path(name).stem
+        self.fps = fps
+        self.frame_size = frame_size
+        self.padding = padding
+        self.plot = plot
+        self.paths: list[Path] = []
+        self._pending: deque[NDArray[np.uint8]] = deque(maxlen=padding)
+        self._writer: cv2.VideoWriter | None = None
+        self._path: Path | None = None
+        self._index = 0
+        self._remaining = 0
+
+    def write(self, frame: NDArray[np.uint8], boxes: NDArray[np.float32]) -> None:
+        if len(boxes):
+            if self._writer is None:
+                self._open(self._index - len(self._pending))
+            assert self._writer is not None
+            # the padding before this detection, which continues the open clip if it's still within reach
+            while self._pending:
+                self._writer.write(self._pending.popleft())
+            self._writer.write(self.plot(frame, boxes))
+            self._remaining = self.padding
+        elif self._writer is not None and self._remaining > 0:
+            self._writer.write(frame)
+            self._remaining -= 1
+        else:
+            if self._writer is not None and len(self._pending) == self.padding:
+                # too far from the last detection for the padding of the next one to reach its clip
+                self._close()
+            self._pending.append(frame)
+        self._index += 1
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._close()
+
+    def discard(self) -> None:
+        """Removes the clips that were written so far."""
+
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        for path in [*self.paths, self._path]:
+            if path is not None:
+                path.with_name(f".{path.name}").unlink(missing_ok=True)
+                path.unlink(missing_ok=True)
+        self.paths = []
+
+    def _open(self, first_frame: int) -> None:
+        self._path = self.directory / f"detected_{self.stem}_{first_frame}.mp4"
+        # written under a hidden name until the clip is complete, like full annotated videos
+        partial_path = self._path.with_name(f".{self._path.name}")
+        self._writer = cv2.VideoWriter(
+            partial_path.as_posix(), cv2.VideoWriter.fourcc(*"mp4v"), self.fps, self.frame_size
+        )
+
+    def _close(self) -> None:
+        assert self._writer is not None and self._path is not None
+        self._writer.release()
+        self._writer = None
+        os.replace(self._path.with_name(f".{self._path.name}"), self._path)
+        self.paths.append(self._path)
+        self._path = None
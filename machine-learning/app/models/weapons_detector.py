@@ -1,275 +1,672 @@
+import hashlib
+import json
+import os
+import shutil
+from functools import partial
 from pathlib import Path
-from typing import Any
+from pickle import UnpicklingError
+from typing import TYPE_CHECKING, Any, Callable, Sequence
 
 import cv2
 import numpy as np
-from insightface.model_zoo import ArcFaceONNX, RetinaFace
-from insightface.utils.face_align import norm_crop
+import onnxruntime as ort
 from numpy.typing import NDArray
-from typing import Any, Literal
-
-from app.config import clean_name
-from app.schemas import Face, ModelType, is_ndarray
 
+from app.config import log, settings
+from app.results import CleanResults, file_digest
+from app.schemas import (
+    DetectedWeapons,
+    ImageWeapons,
+    ModelOptions,
+    ModelType,
+    Weapon,
+    WeaponsDetectionOptions,
+    WeaponTimeline,
+)
+
+from .ann import AnnSession
 from .base import InferenceModel
-import base64
-from app.schemas import ModelType, DetectedWeapons
+from .transforms import (
+    DecodedImage,
+    decode_reduced,
+    get_buffer,
+    letterbox,
+    letterbox_shape,
+    non_max_suppression,
+)
+from .video import (
+    AllFrames,
+    ClipWriter,
+    FrameSampler,
+    StageTimings,
+    TimelineBuilder,
+    VideoPipeline,
+    release_video,
+)
+
+if TYPE_CHECKING:
+    from ultralytics.trackers.bot_sort import BOTSORT
+
+_NO_BOXES = np.empty((0, 6), dtype=np.float32)
+# BGR colors of the first classes in the palette of Ultralytics, which drew the boxes before
+_COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72)]
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
 
-from .base import InferenceModel
-
-from PIL import Image
-from ultralytics import YOLO
-from pathlib import Path
-import os
 
 class WeaponsDetector(InferenceModel):
     _model_type = ModelType.WEAPONS_DETECTION
+    # longer side of the images the model runs on, which images are decoded at when possible
+    input_size = 640
 
     def __init__(
         self,
         model_name: str,
         cache_dir: Path | str | None = None,
-        mode: Literal["image", "video"] | None = None,
+        clean_results: CleanResults | None = None,
         **model_kwargs: Any,
     ) -> None:
-        self.mode = mode
+        # inputs that were already scanned without detections, which are skipped if set
+        self.clean_results = clean_results
+        # set instead of `model` if the model was exported to ONNX with `export/models/yolo.py`
+        self.session: AnnSession | ort.InferenceSession | None = None
+        self.names: dict[int, str] = {}
+        self.dynamic_shapes = False
         super().__init__(model_name, cache_dir, **model_kwargs)
 
-    def _load(self) -> None:
-        if self.mode == "image" or self.mode is None:
-            log.debug(f"Loading model '{self.model_name}'")
-            self.image_model = None
-            log.debug(f"Loaded model '{self.model_name}'")
-
-        if self.mode == "video" or self.mode is None:
-            log.debug(f"Loading model '{self.model_name}'")
-            self.video_model = None
-            log.debug(f"Loaded model '{self.model_name}'")
-
-    def _predict(self, image: NDArray[np.uint8] | str) -> NDArray[np.float32]:
-        if isinstance(image, bytes):
-            decoded_image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    def _download(self) -> None:
+        # the weights aren't published to the model hub, so the installed ones are copied into the cache
+        source = Path(settings.weapons_model_path)
+        if not source.exists():
+            raise FileNotFoundError(f"Weights for weapons detection model '{self.model_name}' not found at '{source}'")
+        # a copy of other weights is removed first, since an ONNX export would be used over `.pt` weights
+        if self.cache_dir.exists():
+            self.clear_cache()
+        if source.is_dir():
+            shutil.copytree(source, self.cache_dir, dirs_exist_ok=True)
         else:
-            decoded_image = image
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, self.model_path)
+        self.source_path.write_text(json.dumps(_fingerprint(source)))
 
-        # Encode image to base64 string
-        _, buffer = cv2.imencode('.jpg', decoded_image)
-        encoded_string = base64.b64encode(buffer).decode('utf-8')
+    def _load(self) -> None:
+        if self.onnx_path.is_file():
+            config: dict[str, Any] = json.load(self.config_path.open())
+            self.names = {int(class_id): name for class_id, name in config["names"].items()}
+            self.input_size = int(config["imgsz"])
+            self.session = self._make_session(self.cache_dir / f"model.{self.preferred_runtime}")
+            # exported models take any height and width unless they were converted to static shapes
+            self.dynamic_shapes = not isinstance(self.session.get_inputs()[0].shape[-1], int)
+            return
+
+        # imported here since PyTorch and Ultralytics take seconds to import and hundreds of MB, and exported models
+        # don't need them
+        from ultralytics import YOLO
+
+        try:
+            self.model = YOLO(self.model_path.as_posix())
+        except (RuntimeError, UnpicklingError) as e:
+            # raised for a truncated or corrupted copy, which is then cleared from the cache and copied again
+            raise OSError(f"Could not load weights from '{self.model_path}'") from e
+        self.estimated_size += self.model_path.stat().st_size
+        self.names = self.model.names
+        imgsz: Any = self.model.overrides.get("imgsz", self.input_size)
+        self.input_size = max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def _get_static_dims(self, graph_io: Any, dim_size: int = 1) -> dict[str, list[int]]:
+        # the height and width are fixed at the input size, which sets the number of boxes in the output
+        dims = super()._get_static_dims(graph_io, dim_size)
+        anchors = sum((self.input_size // stride) ** 2 for stride in (8, 16, 32))
+        return {
+            name: [dim_size, 3, self.input_size, self.input_size] if len(shape) == 4 else [*shape[:2], anchors]
+            for name, shape in dims.items()
+        }
+
+    def _warm_up(self) -> None:
+        self.detect([np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)], 1.0)
+
+    def predict(self, inputs: Any, options: ModelOptions | None = None) -> ImageWeapons:
+        # the options are passed along rather than applied with `configure`, since they include the asset ID and
+        # the model is shared by concurrent requests
+        self.load()
+        return self._predict(inputs, options)
+
+    def predict_batch(self, inputs: list[Any], options: ModelOptions | None = None) -> list[ImageWeapons]:
+        self.load()
+        return [self._predict(image, options) for image in inputs]
+
+    def _predict(
+        self,
+        image: bytes | memoryview | NDArray[np.uint8] | DecodedImage,
+        options: ModelOptions | None = None,
+    ) -> ImageWeapons:
+        options = options or WeaponsDetectionOptions()
+        assert isinstance(options, WeaponsDetectionOptions)
+        return self.run_image_prediction_byte_stream(
+            image,
+            asset_id=options.assetId,
+            save_directory=Path("/ml-results/"),
+            confidence=options.minScore,
+            render=options.render,
+        )
+
+    @property
+    def model_path(self) -> Path:
+        return self.cache_dir / "model.pt"
+
+    @property
+    def onnx_path(self) -> Path:
+        return self.cache_dir / "model.onnx"
+
+    @property
+    def config_path(self) -> Path:
+        return self.cache_dir / "config.json"
+
+    @property
+    def source_path(self) -> Path:
+        """Describes the installed weights the cache was copied from."""
+
+        return self.cache_dir / "source.json"
+
+    @property
+    def cached(self) -> bool:
+        if not (self.model_path.is_file() or self.onnx_path.is_file()):
+            return False
+        # the copy is replaced if the installed weights changed since, e.g. with an upgrade or another model path
+        source = Path(settings.weapons_model_path)
+        if not source.exists():
+            return True
+        try:
+            return bool(json.loads(self.source_path.read_text()) == _fingerprint(source))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+    @property
+    def decode_size(self) -> int:
+        return self.input_size
+
+    def run_image_prediction_byte_stream(
+        self,
+        image: bytes | memoryview | NDArray[np.uint8] | DecodedImage,
+        asset_id: str | None,
+        save_directory: Path,
+        confidence: float,
+        render: bool = True,
+    ) -> ImageWeapons:
+        """
+        Args:
+            image: Encoded image, which is decoded at a reduced size if it's much larger than the model's input.
+                Boxes are returned in the coordinates of the original image either way.
+            render: Saves a copy of the image with the detections drawn on it to `save_directory` if there are any.
+                Clients that draw the returned boxes themselves can skip this.
+        """
 
-        outputs = []
-        weapon: DetectedWeapons = {
-                "image": "data:image/jpeg;base64," + encoded_string,  # Prefix with data URI"
-                "score": 0.7
-            }
-        outputs.append(weapon)
-        # match image_or_text:
-        #     case Image.Image():
-        #         if self.mode == "text":
-        #             raise TypeError("Cannot encode image as text-only model")
-        #         outputs: NDArray[np.float32] = self.vision_model.run(None, self.transform(image_or_text))[0][0]
-        #     case str():
-        #         if self.mode == "vision":
-        #             raise TypeError("Cannot encode text as vision-only model")
-        #         outputs = self.text_model.run(None, self.tokenize(image_or_text))[0][0]
-        #     case _:
-        #         raise TypeError(f"Expected Image or str, but got: {type(image_or_text)}")
-
-        return outputs
-
-    def configure(self, **model_kwargs: Any) -> None:
-        self.det_model.det_thresh = model_kwargs.pop("minScore", self.det_model.det_thresh)
-
-
-class ThreatDetector:
-    def __init__(self, model_path=None):
-        if model_path:
-            self.initialize_model(model_path)
-        else:
-            model_path = './app/models/train9_model_v1.pt'
-            self.initialize_model(model_path)
+        clean = self.clean_results
+        digest = None
+        if clean is not None and isinstance(image, bytes | memoryview):
+            digest = hashlib.sha256(image).digest()
+        if clean is not None and digest is not None:
+            if (info := clean.get(digest, self.version, "image", confidence)) is not None:
+                return {"filePath": "", "imageWidth": info["width"], "imageHeight": info["height"], "weapons": []}
+
+        decoded = self.decode(image)
+        boxes = self.detect([decoded.image], confidence)[0]
+        result = self._image_result(decoded, boxes, asset_id, save_directory, render)
+        if clean is not None and digest is not None and not result["weapons"]:
+            clean.add(digest, self.version, "image", confidence, {"width": decoded.width, "height": decoded.height})
+        return result
+
+    def run_image_batch(
+        self,
+        images: Sequence[NDArray[np.uint8] | DecodedImage],
+        asset_ids: list[str],
+        save_directory: Path,
+        confidence: float,
+        render: bool = True,
+        batch_size: int | None = None,
+    ) -> dict[str, ImageWeapons]:
+        """
+        Runs detection on decoded images in batches of `batch_size`, which defaults to `settings.image_batch_size`.
+        Returns the result of each image keyed by its asset ID.
+        """
 
+        batch_size = batch_size or settings.image_batch_size
+        decoded = [self.decode(image) for image in images]
+        boxes: list[NDArray[np.float32]] = []
+        for i in range(0, len(decoded), batch_size):
+            boxes += self.detect([image.image for image in decoded[i : i + batch_size]], confidence)
 
-    def run_prediction_image(self, image, confidence=0.15):
-        #model(source=1, show=True, conf=0.4, save=True)
-        prediction_result = self.model(image, conf=confidence)
-        return prediction_result 
-    
+        return {
+            asset_id: self._image_result(image, image_boxes, asset_id, save_directory, render)
+            for asset_id, image, image_boxes in zip(asset_ids, decoded, boxes)
+        }
 
-    def run_image_prediction_byte_stream(self, image, asset_id, save_directory, confidence):
-        file_path = save_directory / f"{asset_id}.jpg"
-        detection_made = False
-    
-        if file_path.exists():
-            weapon_detection_res = {
-                "filePath": str(file_path)
-            }
-            
-        else:
-            if isinstance(image, bytes):
-                image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
-                detection_result = self.run_prediction_image(image, confidence)[0]
-                detection_made = bool(len(detection_result))
-                detected_image = detection_result.plot()
-            else:
-                detected_image = image
-
-            if asset_id and detection_made:
-                cv2.imwrite(str(file_path), detected_image)
-            
-                weapon_detection_res = {
-                        "filePath": str(file_path)
-                    }
-            else:
-                weapon_detection_res = {
-                        "filePath": ""
-                    }
-        
-        return weapon_detection_res
+    def reuse_result(self, result: ImageWeapons, asset_id: str | None, save_directory: Path) -> ImageWeapons | None:
+        """
+        Adapts a cached result of the same image, which may have been computed for another asset, to `asset_id`.
+        Copies the rendered image of the other asset. Returns None if that image no longer exists.
+        """
 
+        if not result["filePath"]:
+            return result
+        if not asset_id:
+            return {**result, "filePath": ""}
+
+        rendered_path = save_directory / f"{asset_id}.jpg"
+        if result["filePath"] != str(rendered_path) and not rendered_path.exists():
+            try:
+                shutil.copyfile(result["filePath"], rendered_path)
+            except FileNotFoundError:
+                return None
+        if not rendered_path.exists():
+            return None
+        return {**result, "filePath": str(rendered_path)}
+
+    def decode(self, image: bytes | memoryview | NDArray[np.uint8] | DecodedImage) -> DecodedImage:
+        if isinstance(image, bytes | memoryview):
+            return decode_reduced(image, self.input_size)
+        if isinstance(image, np.ndarray):
+            return DecodedImage.full(image)
+        return image
+
+    def _image_result(
+        self,
+        decoded: DecodedImage,
+        boxes: NDArray[np.float32],
+        asset_id: str | None,
+        save_directory: Path,
+        render: bool,
+    ) -> ImageWeapons:
+        file_path = ""
+        if render and asset_id and len(boxes):
+            rendered_path = save_directory / f"{asset_id}.jpg"
+            if not rendered_path.exists():
+                # drawn on the decoded image, so a reduced one gives a smaller preview
+                cv2.imwrite(str(rendered_path), self.plot(decoded.image, boxes))
+            file_path = str(rendered_path)
+
+        original = boxes.copy()
+        original[:, :4] = decoded.to_original(boxes[:, :4])
+        return {
+            "filePath": file_path,
+            "imageWidth": decoded.width,
+            "imageHeight": decoded.height,
+            "weapons": self.to_weapons(original),
+        }
+
+    def to_weapons(self, boxes: NDArray[np.float32]) -> list[Weapon]:
+        """Converts `xyxy, conf, class` boxes to the response format."""
+
+        return [
+            {
+                "boundingBox": {"x1": round(x1), "y1": round(y1), "x2": round(x2), "y2": round(y2)},
+                "className": self.names.get(int(class_id), str(int(class_id))),
+                "score": score,
+            }
+            for x1, y1, x2, y2, score, class_id in boxes.tolist()
+        ]
 
-    def run_prediction_video(self, video_path, save_directory, confidence=0.2):
+    def run_prediction_video(
+        self,
+        video_path: Path,
+        save_directory: Path,
+        confidence: float = 0.2,
+        on_frame: Callable[[int, int, NDArray[np.float32]], None] | None = None,
+        start_frame: int = 0,
+        checkpoint: dict[int, NDArray[np.float32]] | None = None,
+        sampler: FrameSampler | None = None,
+    ) -> DetectedWeapons:
         video_save_file_path = save_directory / f"detected_{video_path.name}"
-        detection_made = False 
+        detection_made = False
         detected_file_path = ""
 
         if not video_save_file_path.exists():
-            detection_made = self.predict_video(str(video_path), str(video_save_file_path), confidence)
+            clean = self.clean_results
+            digest = file_digest(video_path) if clean is not None else None
+            variant = f"video:{sampler or AllFrames()!r}"
+            if clean is not None and digest is not None:
+                if clean.get(digest, self.version, variant, confidence) is not None:
+                    release_video(video_path)
+                    return {"filePath": ""}
+                info = self._video_info(video_path)
+
+            detection_made = self.predict_video(
+                video_path, video_save_file_path, confidence, on_frame, start_frame, checkpoint, sampler
+            )
 
             if detection_made:
                 detected_file_path = str(video_save_file_path)
+            elif clean is not None and digest is not None:
+                clean.add(digest, self.version, variant, confidence, info)
         else:
             detected_file_path = str(video_save_file_path)
-            
-        weapon_detection_res = {
-            "filePath": detected_file_path
-        }    
-       
+
+        weapon_detection_res: DetectedWeapons = {"filePath": detected_file_path}
+
         return weapon_detection_res
-        
-        
-    def predict_video(self, video_path, output_path, confidence):
+
+    def predict_video(
+        self,
+        video_path: Path,
+        output_path: Path,
+        confidence: float,
+        on_frame: Callable[[int, int, NDArray[np.float32]], None] | None = None,
+        start_frame: int = 0,
+        checkpoint: dict[int, NDArray[np.float32]] | None = None,
+        sampler: FrameSampler | None = None,
+        batch_size: int | None = None,
+        timings: dict[str, StageTimings] | None = None,
+    ) -> bool:
+        """
+        Args:
+            on_frame: Called with the frame index, total frame count and detected boxes after each frame.
+            start_frame: Frames before this index were processed by an interrupted run and are rendered from
+                `checkpoint` instead of running inference again.
+            checkpoint: Boxes of the frames before `start_frame` that had detections, keyed by frame index.
+            sampler: Selects the frames to run detection on. Other frames are drawn with the last detected boxes.
+                Runs detection on every frame if None.
+            batch_size: Number of frames decoded at a time. Their sampled frames are sent to the model as one batch,
+                and then associated with tracks one frame at a time. Defaults to `settings.video_batch_size`.
+            timings: Filled with the time spent decoding, running inference on and encoding the video if given.
+        """
+
         video_cap = cv2.VideoCapture(str(video_path))
         fps = video_cap.get(cv2.CAP_PROP_FPS)
         frame_size = (int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        total_frames = int(video_cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
         detection_made = False
 
-        out = cv2.VideoWriter(output_path, fourcc, fps, frame_size)
-
-        ret = True 
-        while ret:
-            ret, frame = video_cap.read()
-
-            if ret:
-                results = self.model.track(frame, persist=True, conf=confidence)
-                frame_ = results[0].plot()
-                out.write(frame_)
-
-                if detection_made is False:
-                    detection_made = bool(len(results[0]))
-
-        video_cap.release()
-        out.release()
+        # write to a hidden file first so an interrupted run never leaves a truncated result behind
+        partial_path = output_path.with_name(f".{output_path.name}")
+        out = cv2.VideoWriter(str(partial_path), fourcc, fps, frame_size)
+
+        def on_tracked(index: int, boxes: NDArray[np.float32], detected: bool) -> None:
+            nonlocal detection_made
+            if detection_made is False:
+                detection_made = bool(len(boxes))
+            if on_frame is not None:
+                on_frame(index, total_frames, boxes)
+
+        try:
+            self._track_video(
+                video_path.name,
+                video_cap,
+                confidence,
+                on_tracked,
+                lambda frame, boxes: out.write(self.plot(frame, boxes)),
+                sampler,
+                batch_size,
+                timings,
+                start_frame,
+                checkpoint,
+            )
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+        finally:
+            video_cap.release()
+            out.release()
 
         # if no weapons are detected, delete the processed video
         if detection_made is False:
-            os.remove(output_path)
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, output_path)
 
-        # remove the copied resource in ml results volume
-        os.remove(str(video_path))
+        # remove the copied resource in ml results volume, leaving originals in a shared media folder alone
+        release_video(video_path)
 
         return detection_made
 
+    def detect_video(
+        self,
+        video_path: Path,
+        confidence: float,
+        sampler: FrameSampler | None = None,
+        clip_directory: Path | None = None,
+        clip_padding: float = 1.0,
+        batch_size: int | None = None,
+        timings: dict[str, StageTimings] | None = None,
+    ) -> WeaponTimeline:
+        """
+        Detects and tracks weapons in a video without encoding an annotated copy of it.
+
+        Args:
+            sampler: Selects the frames to run detection on. Only these frames are included in the track boxes.
+                Runs detection on every frame if None.
+            clip_directory: If given, annotated clips of only the parts of the video with detections are saved here.
+            clip_padding: Seconds of video to include in the clips before and after each detection.
+            batch_size: Number of frames decoded at a time. Defaults to `settings.video_batch_size`.
+            timings: Filled with the time spent decoding and running inference on the video if given.
+        """
 
-    def run_prediction_bitstream_deprecated(self, byte_image, save_path=None):
-        reconstructed_image = Image.open(byte_image)
-        prediction_result = self.run_prediction_image(reconstructed_image)[0]
+        clean = self.clean_results
+        digest = file_digest(video_path) if clean is not None else None
+        variant = f"video:{sampler or AllFrames()!r}"
+        if clean is not None and digest is not None:
+            if (info := clean.get(digest, self.version, variant, confidence)) is not None:
+                release_video(video_path)
+                return {**info, "tracks": [], "clips": []}  # type: ignore[typeddict-item]
 
-        if save_path:
-            detection_image = self.create_detected_image(prediction_result, save_path)
-            print (f"Detection saved at {save_path}")
+        video_cap = cv2.VideoCapture(str(video_path))
+        fps = video_cap.get(cv2.CAP_PROP_FPS)
+        frame_size = (int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        timeline = TimelineBuilder(fps, self.names)
+        clips = None
+        if clip_directory is not None:
+            padding = round(clip_padding * fps) if fps > 0 else 0
+            clips = ClipWriter(clip_directory, video_path.name, fps, frame_size, padding, self.plot)
+        frame_count = 0
+
+        def on_tracked(index: int, boxes: NDArray[np.float32], detected: bool) -> None:
+            nonlocal frame_count
+            frame_count = index + 1
+            if detected:
+                timeline.add(index, boxes)
+
+        try:
+            self._track_video(
+                video_path.name,
+                video_cap,
+                confidence,
+                on_tracked,
+                clips.write if clips is not None else None,
+                sampler,
+                batch_size,
+                timings,
+            )
+            if clips is not None:
+                clips.close()
+        except BaseException:
+            if clips is not None:
+                clips.discard()
+            raise
+        finally:
+            video_cap.release()
+
+        # remove the copied resource in ml results volume, leaving originals in a shared media folder alone
+        release_video(video_path)
+
+        info = {"fps": fps, "frameCount": frame_count, "videoWidth": frame_size[0], "videoHeight": frame_size[1]}
+        tracks = timeline.build()
+        if clean is not None and digest is not None and not tracks:
+            clean.add(digest, self.version, variant, confidence, info)
+        return {
+            **info,  # type: ignore[typeddict-item]
+            "tracks": tracks,
+            "clips": [str(path) for path in clips.paths] if clips is not None else [],
+        }
+
+    def _video_info(self, video_path: Path) -> dict[str, Any]:
+        video_cap = cv2.VideoCapture(str(video_path))
+        try:
+            return {
+                "fps": video_cap.get(cv2.CAP_PROP_FPS),
+                "frameCount": int(video_cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+                "videoWidth": int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "videoHeight": int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            }
+        finally:
+            video_cap.release()
 
-        return prediction_result, detection_image
+    def _track_video(
+        self,
+        name: str,
+        video_cap: cv2.VideoCapture,
+        confidence: float,
+        on_frame: Callable[[int, NDArray[np.float32], bool], None],
+        write: Callable[[NDArray[np.uint8], NDArray[np.float32]], None] | None,
+        sampler: FrameSampler | None = None,
+        batch_size: int | None = None,
+        timings: dict[str, StageTimings] | None = None,
+        start_frame: int = 0,
+        checkpoint: dict[int, NDArray[np.float32]] | None = None,
+    ) -> None:
+        """
+        Runs detection and tracking over a video, overlapping decoding and encoding with inference.
+        `on_frame` is called with the index and boxes of each frame, and whether detection was run on it.
+        Frames are passed to `write` with their boxes unless it's None.
+        """
 
+        sampler = sampler or AllFrames()
+        sampler.start(video_cap.get(cv2.CAP_PROP_FPS))
+        batch_size = batch_size or settings.video_batch_size
+        tracker = self.make_tracker()
+        timings = timings if timings is not None else {}
+        pipeline = VideoPipeline(
+            read=partial(self._read_frames, video_cap, batch_size),
+            write=write,
+            queue_size=settings.video_queue_size,
+            timings=timings,
+        )
+        boxes = _NO_BOXES
+        with pipeline:
+            index = 0
+            for frames in pipeline:
+                sampled = [
+                    i
+                    for i, frame in enumerate(frames)
+                    if index + i >= start_frame and sampler.should_sample(index + i, frame)
+                ]
+                batch = [frames[i] for i in sampled]
+                detections = dict(zip(sampled, self.detect(batch, confidence))) if batch else {}
+
+                frame_boxes = []
+                for i, frame in enumerate(frames):
+                    if index < start_frame:
+                        boxes = (checkpoint or {}).get(index, _NO_BOXES)
+                    elif i in detections:
+                        boxes = self.associate(tracker, detections[i], frame)
+                    frame_boxes.append(boxes)
+                    on_frame(index, boxes, i in detections)
+                    index += 1
+                pipeline.put(frames, frame_boxes)
+
+        log.info(
+            f"Processed video '{name}' in {timings['infer'].total:.2f}s "
+            f"(decode: {timings['decode']}, inference: {timings['infer']}, encode: {timings['encode']})"
+        )
+
+    def detect(self, frames: list[NDArray[np.uint8]], confidence: float) -> list[NDArray[np.float32]]:
+        """Runs detection on the frames as one batch. Returns the `xyxy, conf, class` boxes of each frame."""
+
+        if self.session is None:
+            import torch
+            from ultralytics.engine.results import Results
+
+            detected = []
+            for result in self.model.predict(frames, conf=confidence, verbose=False):
+                assert isinstance(result, Results) and result.boxes is not None
+                data = result.boxes.data
+                detected.append(data.cpu().numpy() if isinstance(data, torch.Tensor) else data)
+            return detected
+
+        # sessions with static shapes take one square frame at a time
+        batch_size = len(frames) if self.dynamic_batching else 1
+        # like Ultralytics, frames of the same size are only padded to a multiple of the stride if the model allows
+        same_size = all(frame.shape == frames[0].shape for frame in frames)
+        stride = 32 if self.dynamic_shapes and same_size else None
+        height, width = frames[0].shape[:2]
+        shape = letterbox_shape(height, width, self.input_size, stride)
+        boxes = []
+        for i in range(0, len(frames), batch_size):
+            batch = frames[i : i + batch_size]
+            inputs = get_buffer(len(batch), *shape)
+            placements = [letterbox(frame, self.input_size, out, stride)[1] for frame, out in zip(batch, inputs)]
+            outputs = self.session.run(None, {"images": inputs})[0]
+            boxes += [
+                placement.to_original(non_max_suppression(output, confidence))
+                for placement, output in zip(placements, outputs)
+            ]
+        return boxes
+
+    def make_tracker(self) -> "BOTSORT":
+        # tracking is the only part of running exported models that still needs Ultralytics and PyTorch, so images
+        # can be detected without them
+        try:
+            from ultralytics.trackers.bot_sort import BOTSORT
+            from ultralytics.utils import YAML, IterableSimpleNamespace
+            from ultralytics.utils.checks import check_yaml
+        except ImportError as e:
+            raise ImportError("Tracking weapons in videos requires Ultralytics, which isn't installed") from e
+
+        # the default tracker of `YOLO.track`, which compensates for camera motion between frames
+        tracker_cfg = IterableSimpleNamespace(**YAML.load(check_yaml("botsort.yaml")))
+        return BOTSORT(tracker_cfg)
+
+    def associate(
+        self, tracker: "BOTSORT", boxes: NDArray[np.float32], frame: NDArray[np.uint8]
+    ) -> NDArray[np.float32]:
+        """Matches detections to the tracks of previous frames. Returns `xyxy, track id, conf, class` boxes."""
+
+        from ultralytics.engine.results import Boxes
+
+        height, width = frame.shape[:2]
+        tracks = tracker.update(Boxes(boxes, (height, width)), frame)
+        if len(tracks) == 0:
+            return _NO_BOXES
+        tracked: NDArray[np.float32] = tracks[:, :-1].astype(np.float32)
+        return tracked
+
+    def _read_frames(self, video_cap: cv2.VideoCapture, count: int) -> list[NDArray[np.uint8]]:
+        frames: list[NDArray[np.uint8]] = []
+        while len(frames) < count:
+            ret, frame = video_cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        return frames
 
-    def create_detected_image(self, detected_result, save_path):
-        """ Saves the thumbnails of detection
+    def plot(self, frame: NDArray[np.uint8], boxes: NDArray[np.float32]) -> NDArray[np.uint8]:
+        """
+        Returns a copy of the frame with the boxes drawn on it, labeled with their class, score and, for
+        `xyxy, track id, conf, class` boxes, their track ID.
         """
-        return detected_result.plot(save=True, filename=save_path)
-         
-
-    def initialize_model(self, model_path):
-        self.model = YOLO(model_path)
-
-
-    # @abstractmethod
-    # def tokenize(self, text: str) -> dict[str, NDArray[np.int32]]:
-    #     pass
-
-    # @abstractmethod
-    # def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
-    #     pass
-
-    # @property
-    # def textual_dir(self) -> Path:
-    #     return self.cache_dir / "textual"
-
-    # @property
-    # def visual_dir(self) -> Path:
-    #     return self.cache_dir / "visual"
-
-    # @property
-    # def model_cfg_path(self) -> Path:
-    #     return self.cache_dir / "config.json"
-
-    # @property
-    # def textual_path(self) -> Path:
-    #     return self.textual_dir / f"model.{self.preferred_runtime}"
-
-    # @property
-    # def visual_path(self) -> Path:
-    #     return self.visual_dir / f"model.{self.preferred_runtime}"
-
-    # @property
-    # def tokenizer_file_path(self) -> Path:
-    #     return self.textual_dir / "tokenizer.json"
-
-    # @property
-    # def tokenizer_cfg_path(self) -> Path:
-    #     return self.textual_dir / "tokenizer_config.json"
-
-    # @property
-    # def preprocess_cfg_path(self) -> Path:
-    #     return self.visual_dir / "preprocess_cfg.json"
-
-    # @property
-    # def cached(self) -> bool:
-    #     return self.textual_path.is_file() and self.visual_path.is_file()
-
-    # @cached_property
-    # def model_cfg(self) -> dict[str, Any]:
-    #     log.debug(f"Loading model config for CLIP model '{self.model_name}'")
-    #     model_cfg: dict[str, Any] = json.load(self.model_cfg_path.open())
-    #     log.debug(f"Loaded model config for CLIP model '{self.model_name}'")
-    #     return model_cfg
-
-    # @cached_property
-    # def tokenizer_file(self) -> dict[str, Any]:
-    #     log.debug(f"Loading tokenizer file for CLIP model '{self.model_name}'")
-    #     tokenizer_file: dict[str, Any] = json.load(self.tokenizer_file_path.open())
-    #     log.debug(f"Loaded tokenizer file for CLIP model '{self.model_name}'")
-    #     return tokenizer_file
-
-    # @cached_property
-    # def tokenizer_cfg(self) -> dict[str, Any]:
-    #     log.debug(f"Loading tokenizer config for CLIP model '{self.model_name}'")
-    #     tokenizer_cfg: dict[str, Any] = json.load(self.tokenizer_cfg_path.open())
-    #     log.debug(f"Loaded tokenizer config for CLIP model '{self.model_name}'")
-    #     return tokenizer_cfg
-
-    # @cached_property
-    # def preprocess_cfg(self) -> dict[str, Any]:
-    #     log.debug(f"Loading visual preprocessing config for CLIP model '{self.model_name}'")
-    #     preprocess_cfg: dict[str, Any] = json.load(self.preprocess_cfg_path.open())
-    #     log.debug(f"Loaded visual preprocessing config for CLIP model '{self.model_name}'")
-    #     return preprocess_cfg
+
+        plotted = frame.copy()
+        thickness = max(round(sum(frame.shape[:2]) / 2 * 0.003), 2)
+        font_scale, font_thickness = thickness / 3, max(thickness - 1, 1)
+        for box in boxes:
+            x1, y1, x2, y2 = (round(float(coord)) for coord in box[:4])
+            class_id = int(box[-1])
+            label = f"{self.names.get(class_id, str(class_id))} {box[-2]:.2f}"
+            if len(box) == 7:
+                label = f"id:{int(box[4])} {label}"
+            color = _COLORS[class_id % len(_COLORS)]
+            cv2.rectangle(plotted, (x1, y1), (x2, y2), color, thickness, cv2.LINE_AA)
+
+            (width, height), _ = cv2.getTextSize(label, _FONT, font_scale, font_thickness)
+            # above the box if it fits, otherwise inside it
+            above = y1 >= height + 3
+            bottom = y1 if above else y1 + height + 3
+            cv2.rectangle(plotted, (x1, bottom - height - 3), (x1 + width, bottom), color, -1, cv2.LINE_AA)
+            cv2.putText(
+                plotted, label, (x1, bottom - 2), _FONT, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA
+            )
+        return plotted
+
+
+def _fingerprint(source: Path) -> dict[str, Any]:
+    files = sorted(path for path in source.rglob("*") if path.is_file()) if source.is_dir() else [source]
+    stats = [(path.relative_to(source).as_posix(), path.stat()) for path in files]
+    return {"path": source.as_posix(), "files": [[name, stat.st_size, stat.st_mtime_ns] for name, stat in stats]}
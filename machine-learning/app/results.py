@@ -0,0 +1,230 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from .config import log
+from .schemas import CacheStats
+
+
+class ResultCache:
+    """
+    Stores serialized model outputs on disk, keyed by a hash of the input and everything else that affects the output.
+    Entries are written atomically, so the folder can be shared by several workers. When the folder grows past
+    `max_size`, the least recently used entries are removed.
+    """
+
+    def __init__(self, folder: Path | str, max_size: int) -> None:
+        """
+        Args:
+            folder: Directory where results are stored.
+            max_size: Maximum total size of the results in bytes. Once exceeded, the oldest entries are evicted
+                until 90% of this is left.
+        """
+
+        self.folder = Path(folder)
+        self.max_size = max_size
+        self.size: int | None = None
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(data: bytes | memoryview | str, *parts: Any) -> str:
+        """
+        Hashes the input together with `parts`, such as the model name, model version and options.
+        Dicts in `parts` are hashed with sorted keys, so their order doesn't matter.
+        """
+
+        digest = hashlib.sha256(data.encode() if isinstance(data, str) else data)
+        digest.update(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS))
+        return digest.hexdigest()
+
+    def get(self, key: str, category: str = "") -> bytes | None:
+        """
+        Returns the stored result, or None if there's none. `category` groups the hit rate, e.g. by model type.
+        """
+
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+            # the modification time doubles as the last access time for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses[category] += 1
+            return None
+        self.hits[category] += 1
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(value)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(value)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until 90% of `max_size` is left."""
+
+        # other workers add entries too, so the size is counted again before evicting
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        size = sum(entry_size for _, _, entry_size in entries)
+        target = int(self.max_size * 0.9)
+        evicted = 0
+        for path, _, entry_size in entries:
+            if size <= target:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+            evicted += 1
+        self.size = size
+        log.debug(f"Evicted {evicted} results from the cache, leaving {size} bytes.")
+
+    def stats(self) -> dict[str, CacheStats]:
+        """Hits and misses of this worker since it started, by category and in total."""
+
+        categories = sorted(self.hits.keys() | self.misses.keys())
+        stats = {category: _stats(self.hits[category], self.misses[category]) for category in categories}
+        stats["total"] = _stats(self.hits.total(), self.misses.total())
+        return stats
+
+    def _path(self, key: str) -> Path:
+        return self.folder / key[:2] / key
+
+    def _entries(self) -> list[tuple[Path, int, int]]:
+        entries = []
+        for path in self.folder.glob("*/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime_ns, stat.st_size))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(entry_size for _, _, entry_size in self._entries())
+
+
+def _stats(hits: int, misses: int) -> CacheStats:
+    requests = hits + misses
+    return {"hits": hits, "misses": misses, "hitRate": hits / requests if requests else 0.0}
+
+
+class CleanResults:
+    """
+    Remembers inputs that weapons detection found nothing in, so they aren't scanned again. Only a hash of the input
+    is kept, with a little information to rebuild the response. The database can be shared by several workers.
+    If it can't be opened or written, lookups miss and nothing is recorded, so inputs are scanned as usual.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # opened on first use, so the service starts even if the cache folder isn't writable yet
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS clean (
+                        digest BLOB NOT NULL,
+                        model TEXT NOT NULL,
+                        variant TEXT NOT NULL,
+                        min_score REAL NOT NULL,
+                        info TEXT NOT NULL,
+                        PRIMARY KEY (digest, model, variant)
+                    ) WITHOUT ROWID
+                    """
+                )
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    def get(self, digest: bytes, model: str, variant: str, min_score: float) -> dict[str, Any] | None:
+        """
+        Returns the information stored with the input if it was found clean by `model`, or None otherwise. Since a
+        scan that found nothing would find nothing at a higher threshold either, a record at a lower `min_score`
+        counts too.
+
+        Args:
+            digest: Hash of the input's content.
+            model: Version of the model.
+            variant: Other settings that affect the outcome, such as how video frames are sampled.
+            min_score: Detection threshold of the request.
+        """
+
+        try:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT info FROM clean WHERE digest = ? AND model = ? AND variant = ? AND min_score <= ?",
+                    (digest, model, variant, min_score),
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            # the cache only saves work, so the input is scanned as usual if it can't be read
+            log.warning(f"Failed to look up clean weapons detection results in {self.path}: {e}")
+            return None
+        if row is None:
+            return None
+        info: dict[str, Any] = orjson.loads(row[0])
+        return info
+
+    def add(self, digest: bytes, model: str, variant: str, min_score: float, info: dict[str, Any]) -> None:
+        try:
+            with self.lock:
+                self.connection.execute(
+                    """
+                    INSERT INTO clean VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (digest, model, variant) DO UPDATE SET min_score = min(min_score, excluded.min_score)
+                    """,
+                    (digest, model, variant, min_score, orjson.dumps(info).decode()),
+                )
+        except (sqlite3.Error, OSError) as e:
+            log.warning(f"Failed to record clean weapons detection result in {self.path}: {e}")
+
+    def invalidate(self, model: str | None = None, keep: str | None = None) -> int:
+        """
+        Removes the records of `model`, or of every model except `keep`, or all of them if neither is given.
+        Returns the number of records removed.
+        """
+
+        query = "DELETE FROM clean"
+        params: tuple[str, ...] = ()
+        if model is not None:
+            query, params = "DELETE FROM clean WHERE model = ?", (model,)
+        elif keep is not None:
+            query, params = "DELETE FROM clean WHERE model != ?", (keep,)
+        with self.lock:
+            removed: int = self.connection.execute(query, params).rowcount
+        log.info(f"Removed {removed} clean weapons detection results.")
+        return removed
+
+
+def file_digest(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(2**20):
+            digest.update(chunk)
+    return digest.digest()
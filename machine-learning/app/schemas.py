@@ -1,8 +1,10 @@
 from enum import Enum
-from typing import Any, Protocol, TypedDict, TypeGuard
+from functools import lru_cache, partial
+from typing import Any, Literal, Protocol, TypedDict, TypeGuard
 
 import numpy as np
 import numpy.typing as npt
+import orjson
 from pydantic import BaseModel
 
 
@@ -34,6 +36,73 @@ class ModelType(StrEnum):
     WEAPONS_DETECTION = "weapons-detection"
 
 
+class ModelOptions(BaseModel):
+    """Options of a request, which configure the model. Options a model doesn't know about are ignored."""
+
+    class Config:
+        # parsed options are cached and shared between requests
+        frozen = True
+
+
+class CLIPOptions(ModelOptions):
+    mode: Literal["text", "vision"] | None = None
+
+
+class FacialRecognitionOptions(ModelOptions):
+    minScore: float | None = None
+
+
+class SamplingOptions(BaseModel):
+    """Which frames of a video to run detection on. Options that aren't set use the defaults of `get_sampler`."""
+
+    strategy: str = "all"
+    interval: int | None = None
+    fps: float | None = None
+    sceneThreshold: float | None = None
+    maxInterval: int | None = None
+
+    class Config:
+        # part of the request options, which are hashed to batch requests with the same ones
+        frozen = True
+
+
+class WeaponsDetectionOptions(ModelOptions):
+    mode: Literal["image", "video"] | None = None
+    minScore: float = 0.2
+    assetId: str | None = None
+    render: bool = True
+    output: Literal["video", "timeline"] = "video"
+    sampling: SamplingOptions | None = None
+    clips: bool = False
+    clipPadding: float = 1.0
+
+
+OPTIONS: dict[ModelType, type[ModelOptions]] = {
+    ModelType.CLIP: CLIPOptions,
+    ModelType.FACIAL_RECOGNITION: FacialRecognitionOptions,
+    ModelType.WEAPONS_DETECTION: WeaponsDetectionOptions,
+}
+
+
+def parse_options(model_type: ModelType, options: str) -> ModelOptions:
+    """
+    Parses and validates the `options` JSON of a request. Clients send the same few options over and over, so they're
+    only parsed the first time. Raises `orjson.JSONDecodeError` or `pydantic.ValidationError` if they're invalid.
+    """
+
+    return _PARSERS[model_type](options)
+
+
+def _parse(options_type: type[ModelOptions], options: str) -> ModelOptions:
+    return options_type.parse_obj(orjson.loads(options))
+
+
+# one cache for each model type, so options that are unique to each request of one type don't evict those of others
+_PARSERS = {
+    model_type: lru_cache(maxsize=256)(partial(_parse, options_type)) for model_type, options_type in OPTIONS.items()
+}
+
+
 class ModelRuntime(StrEnum):
     ONNX = "onnx"
     ARMNN = "armnn"
@@ -50,13 +119,115 @@ class Face(TypedDict):
     imageHeight: int
     score: float
 
+
 # class DetectedWeapons(TypedDict):
 #     image: str
 #     score: float
 
+
 class DetectedWeapons(TypedDict):
     filePath: str
 
+
+class Weapon(TypedDict):
+    boundingBox: BoundingBox
+    className: str
+    score: float
+
+
+class ImageWeapons(DetectedWeapons):
+    imageWidth: int
+    imageHeight: int
+    weapons: list[Weapon]
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    hitRate: float
+
+
+class CachedModel(TypedDict):
+    modelName: str
+    modelType: ModelType
+    loaded: bool
+    size: int
+
+
+class ModelCacheStats(CacheStats):
+    evictions: int
+    size: int
+    maxSize: int
+    models: list[CachedModel]
+
+
+class TrackedBox(TypedDict):
+    frame: int
+    timestamp: float
+    boundingBox: BoundingBox
+    score: float
+
+
+class WeaponTrack(TypedDict):
+    trackId: int
+    className: str
+    firstFrame: int
+    lastFrame: int
+    startTime: float
+    endTime: float
+    maxScore: float
+    boxes: list[TrackedBox]
+
+
+class WeaponTimeline(TypedDict):
+    fps: float
+    frameCount: int
+    videoWidth: int
+    videoHeight: int
+    tracks: list[WeaponTrack]
+    clips: list[str]
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class ModelStatus(StrEnum):
+    LOADING = "loading"
+    WARM = "warm"
+    FAILED = "failed"
+
+
+class PreloadedModel(BaseModel):
+    modelType: ModelType
+    modelName: str
+    mode: str | None = None
+    status: ModelStatus = ModelStatus.LOADING
+
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    models: list[PreloadedModel]
+
+
+class VideoJob(BaseModel):
+    id: str
+    modelName: str
+    videoFilePath: str
+    saveDirectory: str
+    minScore: float
+    sampling: dict[str, Any] | None = None
+    status: JobStatus = JobStatus.QUEUED
+    framesProcessed: int = 0
+    framesTotal: int | None = None
+    eta: float | None = None
+    filePath: str | None = None
+    error: str | None = None
+
+
 def has_profiling(obj: Any) -> TypeGuard[HasProfiling]:
     return hasattr(obj, "profiling") and isinstance(obj.profiling, dict)
 
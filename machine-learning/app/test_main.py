@@ -1,27 +1,104 @@
+import asyncio
+import gc
+import itertools
 import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
-from random import randint
+from random import randbytes, randint
+from tempfile import SpooledTemporaryFile
 from types import SimpleNamespace
-from typing import Any, Callable
+from typing import Any, Callable, Iterator
 from unittest import mock
 
 import cv2
+import httpx
 import numpy as np
+import onnx
 import onnxruntime as ort
 import pytest
+import torch
+from fastapi import UploadFile
 from fastapi.testclient import TestClient
-from PIL import Image
+from numpy.typing import NDArray
+from PIL import ExifTags, Image
+from pydantic import ValidationError
 from pytest_mock import MockerFixture
+from starlette.formparsers import MultiPartParser
+from ultralytics.data.augment import LetterBox
+from ultralytics.engine.results import Results
+from ultralytics.trackers.bot_sort import BOTSORT
+from ultralytics.utils.nms import non_max_suppression as ultralytics_nms
+from ultralytics.utils.ops import scale_boxes
+
+from app.main import (
+    get_batcher,
+    get_preloaded_models,
+    load,
+    preload_models,
+    read_upload,
+    result_key,
+    share_models,
+)
 
-from app.main import load
-
-from .config import log, settings
+from .batching import MicroBatcher
+from .config import PreloadModelData, Settings, log, settings
+from .jobs import VideoJobQueue
+from .models import from_model_type
 from .models.base import InferenceModel
 from .models.cache import ModelCache
 from .models.clip import MCLIPEncoder, OpenCLIPEncoder
 from .models.facial_recognition import FaceRecognizer
-from .schemas import ModelRuntime, ModelType
+from .models.transforms import (
+    BufferReader,
+    DecodedImage,
+    as_file,
+    crop,
+    decode_reduced,
+    get_buffer,
+    get_reduction,
+    letterbox,
+    letterbox_shape,
+    non_max_suppression,
+    normalize,
+    preprocess,
+    resize,
+    to_numpy,
+)
+from .models.video import (
+    FpsSampler,
+    IntervalSampler,
+    SceneChangeSampler,
+    StageTimings,
+    VideoPipeline,
+    get_sampler,
+    resolve_video_path,
+)
+from .models.weapons_detector import WeaponsDetector
+from .results import CleanResults, ResultCache
+from .schemas import (
+    CLIPOptions,
+    FacialRecognitionOptions,
+    JobStatus,
+    ModelOptions,
+    ModelRuntime,
+    ModelStatus,
+    ModelType,
+    VideoJob,
+    WeaponsDetectionOptions,
+    parse_options,
+)
 
 
 class TestBase:
@@ -111,6 +188,7 @@ class TestBase:
 
     def test_sets_default_sess_options_sets_threads_if_non_cpu_and_set_threads(self, mocker: MockerFixture) -> None:
         mock_settings = mocker.patch("app.models.base.settings", autospec=True)
+        mock_settings.share_models = False
         mock_settings.model_inter_op_threads = 2
         mock_settings.model_intra_op_threads = 4
 
@@ -238,6 +316,7 @@ class TestBase:
         mock_model_path.suffix = ".armnn"
         mock_model_path.with_suffix.return_value = mock_model_path
         mock_session = mocker.patch("app.models.base.AnnSession")
+        mocker.patch.object(OpenCLIPEncoder, "_weights_size", return_value=0)
 
         encoder = OpenCLIPEncoder("ViT-B-32__openai")
         encoder._make_session(mock_model_path)
@@ -256,6 +335,7 @@ class TestBase:
 
         mock_ann = mocker.patch("app.models.base.AnnSession")
         mock_ort = mocker.patch("app.models.base.ort.InferenceSession")
+        mocker.patch.object(OpenCLIPEncoder, "_weights_size", return_value=0)
 
         encoder = OpenCLIPEncoder("ViT-B-32__openai")
         encoder._make_session(mock_armnn_path)
@@ -278,6 +358,44 @@ class TestBase:
         mock_ann.assert_not_called()
         mock_ort.assert_not_called()
 
+    @pytest.mark.parametrize(
+        ("quantized", "has_int8", "expected"),
+        [(True, True, "model_int8.onnx"), (True, False, "model.onnx"), (False, True, "model.onnx")],
+    )
+    def test_make_session_uses_quantized_model_if_enabled(
+        self, quantized: bool, has_int8: bool, expected: str, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        (tmp_path / "model.onnx").touch()
+        if has_int8:
+            (tmp_path / "model_int8.onnx").touch()
+        mocker.patch.object(settings, "quantized", quantized)
+        mock_ort = mocker.patch("app.models.base.ort.InferenceSession")
+
+        encoder = OpenCLIPEncoder("ViT-B-32__openai", providers=["CPUExecutionProvider"])
+        encoder._make_session(tmp_path / "model.armnn")
+
+        mock_ort.assert_called_once()
+        assert mock_ort.call_args.args[0] == (tmp_path / expected).as_posix()
+
+    def test_make_session_estimates_size_from_weights(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        weights = onnx.numpy_helper.from_array(np.ones((512, 1024), dtype=np.float32), "weights")
+        node = onnx.helper.make_node("MatMul", ["input", "weights"], ["output"])
+        graph = onnx.helper.make_graph(
+            [node],
+            "graph",
+            [onnx.helper.make_tensor_value_info("input", onnx.TensorProto.FLOAT, [1, 512])],
+            [onnx.helper.make_tensor_value_info("output", onnx.TensorProto.FLOAT, [1, 1024])],
+            [weights],
+        )
+        onnx.save(onnx.helper.make_model(graph), tmp_path / "model.onnx", save_as_external_data=True)
+        (tmp_path / "tokenizer.json").write_bytes(bytes(10**6))
+        mocker.patch("app.models.base.ort.InferenceSession")
+
+        encoder = OpenCLIPEncoder("ViT-B-32__openai", providers=["CPUExecutionProvider"])
+        encoder._make_session(tmp_path / "model.onnx")
+
+        assert encoder.estimated_size == (tmp_path / "model.onnx").stat().st_size + 512 * 1024 * 4
+
     def test_download(self, mocker: MockerFixture) -> None:
         mock_snapshot_download = mocker.patch("app.models.base.snapshot_download")
 
@@ -362,6 +480,87 @@ class TestCLIP:
         assert embedding.dtype == np.float32
         mocked.run.assert_called_once()
 
+    def test_quantized_embeddings_match(
+        self,
+        clip_visual_export: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenCLIPEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch("app.models.clip.Tokenizer.from_file", autospec=True)
+        rng = np.random.default_rng(5)
+        images = [Image.fromarray(rng.integers(0, 256, (256, 320, 3), dtype=np.uint8)) for _ in range(16)]
+
+        embeddings = {}
+        for quantized in [False, True]:
+            mocker.patch.object(settings, "quantized", quantized)
+            encoder = OpenCLIPEncoder("ViT-B-32__openai", cache_dir=clip_visual_export, mode="vision")
+            encoder.providers = ["CPUExecutionProvider"]
+            embeddings[quantized] = np.stack(encoder.predict_batch(images))
+            embeddings[quantized] /= np.linalg.norm(embeddings[quantized], axis=1, keepdims=True)
+
+        similarity = embeddings[True] @ embeddings[False].T
+        assert not np.array_equal(embeddings[True], embeddings[False])
+        assert np.diag(similarity).min() > 0.99
+        # every quantized embedding finds the full precision embedding of the same image first
+        np.testing.assert_array_equal(similarity.argmax(axis=1), np.arange(len(images)))
+
+    def test_batch_runs_session_once_per_modality(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenCLIPEncoder, "download")
+        mocker.patch.object(OpenCLIPEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.side_effect = lambda _, batch: [np.arange(len(next(iter(batch.values()))))[:, None] * self.embedding]
+        mock_tokenizer = mocker.patch("app.models.clip.Tokenizer.from_file", autospec=True).return_value
+        mock_tokenizer.encode_batch.side_effect = lambda texts: [SimpleNamespace(ids=[0] * 77) for _ in texts]
+
+        clip_encoder = OpenCLIPEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embeddings = clip_encoder.predict_batch([pil_image, "a query", pil_image, "another query"])
+
+        mock_tokenizer.encode_batch.assert_called_once_with(["a query", "another query"])
+        mock_tokenizer.encode.assert_not_called()
+        assert mocked.run.call_count == 2
+        image_batch, text_batch = (call.args[1] for call in mocked.run.call_args_list)
+        assert image_batch["image"].shape == (2, 3, 224, 224)
+        assert len(text_batch["text"]) == 2
+        for embedding, expected in zip(embeddings, [0, 0, 1, 1]):
+            assert np.array_equal(embedding, expected * self.embedding)
+
+    def test_batch_falls_back_to_single_inputs_without_dynamic_batching(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenCLIPEncoder, "download")
+        mocker.patch.object(OpenCLIPEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("app.models.clip.Tokenizer.from_file", autospec=True)
+
+        clip_encoder = OpenCLIPEncoder("ViT-B-32__openai", cache_dir="test_cache", preferred_runtime=ModelRuntime.ARMNN)
+        embeddings = clip_encoder.predict_batch([pil_image, pil_image, pil_image])
+
+        assert mocked.run.call_count == 3
+        assert all(call.args[1]["image"].shape[0] == 1 for call in mocked.run.call_args_list)
+        assert len(embeddings) == 3
+
     def test_openclip_tokenizer(
         self,
         mocker: MockerFixture,
@@ -416,6 +615,274 @@ class TestCLIP:
         assert np.allclose(tokens["input_ids"], np.array([mock_ids], dtype=np.int32), atol=0)
         assert np.allclose(tokens["attention_mask"], np.array([mock_attention_mask], dtype=np.int32), atol=0)
 
+    def test_mclip_batch_tokenizer(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenCLIPEncoder, "download")
+        mocker.patch.object(OpenCLIPEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mock_tokenizer = mocker.patch("app.models.clip.Tokenizer.from_file", autospec=True).return_value
+        encodings = [
+            SimpleNamespace(
+                ids=[randint(0, 50000) for _ in range(77)], attention_mask=[randint(0, 1) for _ in range(77)]
+            )
+            for _ in range(3)
+        ]
+        mock_tokenizer.encode_batch.return_value = encodings
+
+        clip_encoder = MCLIPEncoder("ViT-B-32__openai", cache_dir="test_cache", mode="text")
+        clip_encoder._load_tokenizer()
+        tokens = clip_encoder.tokenize_batch(["a", "b", "c"])
+
+        mock_tokenizer.encode_batch.assert_called_once_with(["a", "b", "c"])
+        assert tokens["input_ids"].shape == (3, 77)
+        assert tokens["attention_mask"].shape == (3, 77)
+        assert np.array_equal(tokens["input_ids"], np.array([e.ids for e in encodings], dtype=np.int32))
+        assert np.array_equal(tokens["attention_mask"], np.array([e.attention_mask for e in encodings], dtype=np.int32))
+
+    def test_batch_endpoint(self, deployed_app: TestClient, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "image_batch_size", 2)
+        mock_model = mock.Mock(spec=InferenceModel, loaded=True)
+        mock_model.predict_batch.side_effect = lambda inputs, **_: [[len(inputs)] for _ in inputs]
+        mocker.patch.object(ModelCache, "get", autospec=True, return_value=mock_model)
+
+        response = deployed_app.post(
+            "/predict/batch",
+            data={"modelName": "ViT-B-32__openai", "modelType": "clip", "texts": ["a", "b", "c"]},
+            files=[("images", b"image")],
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [[2], [2], [2], [2]]
+        batches = [call.args[0] for call in mock_model.predict_batch.call_args_list]
+        assert batches == [[b"image", "a"], ["b", "c"]]
+
+    def test_batch_endpoint_requires_inputs(self, deployed_app: TestClient) -> None:
+        response = deployed_app.post("/predict/batch", data={"modelName": "ViT-B-32__openai", "modelType": "clip"})
+
+        assert response.status_code == 400
+
+
+class TestPreprocess:
+    mean = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+    std = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+    @pytest.fixture
+    def textured_image(self) -> Image.Image:
+        rng = np.random.default_rng(0)
+        coarse = Image.fromarray(rng.integers(0, 256, (40, 60, 3), dtype=np.uint8))
+        pixels = np.asarray(coarse.resize((1200, 800), resample=Image.Resampling.BICUBIC)).astype(np.float32)
+        return Image.fromarray(np.clip(pixels + rng.normal(0, 8, pixels.shape), 0, 255).astype(np.uint8))
+
+    def transform(self, image: Image.Image, size: int) -> NDArray[np.float32]:
+        image = crop(resize(image, size), size)
+        return normalize(to_numpy(image), self.mean, self.std).transpose(2, 0, 1)
+
+    @pytest.mark.parametrize("size", [(1200, 800), (300, 900), (224, 224)])
+    def test_matches_transform_chain(self, textured_image: Image.Image, size: tuple[int, int]) -> None:
+        image = textured_image.resize(size)
+
+        out = preprocess(image, 224, self.mean, self.std)
+
+        assert out.shape == (3, 224, 224)
+        assert out.dtype == np.float32
+        # within about one pixel value
+        assert np.allclose(out, self.transform(image, 224), atol=0.02)
+
+    def test_reduced_jpeg_decoding_is_close_to_full_decoding(self, textured_image: Image.Image) -> None:
+        data = BytesIO()
+        textured_image.resize((2400, 1600), resample=Image.Resampling.BICUBIC).save(data, format="JPEG", quality=90)
+
+        image = Image.open(data)
+        out = preprocess(image, 224, self.mean, self.std)
+        expected = self.transform(Image.open(data), 224)
+
+        assert image.size == (1200, 800)
+        assert np.abs(out - expected).mean() < 0.02
+        assert np.abs(out - expected).max() < 0.15
+
+    def test_writes_into_out(self, pil_image: Image.Image) -> None:
+        out = np.empty((3, 224, 224), dtype=np.float32)
+
+        assert preprocess(pil_image, 224, self.mean, self.std, out=out) is out
+
+    def test_buffer_is_reused_within_thread(self) -> None:
+        batch = get_buffer(4, 224)
+        single = get_buffer(1, 224)
+        with ThreadPoolExecutor(1) as pool:
+            other_thread = pool.submit(get_buffer, 1, 224).result()
+
+        assert batch.shape == (4, 3, 224, 224)
+        assert batch.flags.c_contiguous
+        assert np.shares_memory(batch, single)
+        assert not np.shares_memory(single, other_thread)
+
+
+class TestReducedDecoding:
+    def encode(self, width: int, height: int, orientation: int | None = None) -> bytes:
+        image = Image.new("RGB", (width, height))
+        exif = image.getexif()
+        if orientation is not None:
+            exif[0x0112] = orientation
+        data = BytesIO()
+        image.save(data, format="JPEG", exif=exif.tobytes())
+        return data.getvalue()
+
+    @pytest.mark.parametrize(
+        "size, expected", [((8000, 6000), 8), ((2560, 1440), 4), ((1280, 1920), 2), ((1000, 800), 1), ((320, 240), 1)]
+    )
+    def test_reduction_keeps_longer_side_above_min_size(self, size: tuple[int, int], expected: int) -> None:
+        assert get_reduction(*size, min_size=640) == expected
+
+    def test_decodes_jpeg_at_reduced_size(self) -> None:
+        decoded = decode_reduced(self.encode(2000, 1000), 640)
+
+        assert decoded.image.shape == (500, 1000, 3)
+        assert (decoded.width, decoded.height) == (2000, 1000)
+        assert decoded.reduced
+
+    def test_maps_coordinates_to_original(self) -> None:
+        decoded = decode_reduced(self.encode(2000, 1000), 640)
+        boxes = np.array([[10, 20, 30, 40], [0, 0, 1000, 500]], dtype=np.float32)
+
+        assert np.array_equal(decoded.to_original(boxes), [[20, 40, 60, 80], [0, 0, 2000, 1000]])
+        assert np.array_equal(decoded.to_original(np.zeros((2, 5, 2), dtype=np.float32) + 1), np.full((2, 5, 2), 2))
+
+    def test_accounts_for_exif_rotation(self) -> None:
+        decoded = decode_reduced(self.encode(2000, 1000, orientation=6), 640)
+
+        assert decoded.image.shape == (1000, 500, 3)
+        assert (decoded.width, decoded.height) == (1000, 2000)
+
+    def test_small_and_non_jpeg_images_are_decoded_at_full_size(self) -> None:
+        png = cv2.imencode(".png", np.zeros((1000, 2000, 3), dtype=np.uint8))[1].tobytes()
+
+        small = decode_reduced(self.encode(800, 600), 640)
+        other = decode_reduced(png, 640)
+
+        assert small.image.shape == (600, 800, 3)
+        assert other.image.shape == (1000, 2000, 3)
+        assert not small.reduced and not other.reduced
+
+    def test_rejects_invalid_data(self) -> None:
+        with pytest.raises(ValueError):
+            decode_reduced(b"\xff\xd8 not a jpeg", 640)
+
+    def test_weapons_are_reported_in_original_coordinates(
+        self, weapons_detector: WeaponsDetector, tmp_path: Path
+    ) -> None:
+        boxes = np.array([[10.0, 20.0, 30.0, 40.0, 0.9, 0.0]], dtype=np.float32)
+        detect = mock.Mock(return_value=[boxes])
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+
+        result = weapons_detector.run_image_prediction_byte_stream(
+            self.encode(2560, 1920), "asset", tmp_path, 0.5, render=False
+        )
+
+        assert detect.call_args.args[0][0].shape == (480, 640, 3)
+        assert (result["imageWidth"], result["imageHeight"]) == (2560, 1920)
+        assert result["weapons"][0]["boundingBox"] == {"x1": 40, "y1": 80, "x2": 120, "y2": 160}
+
+    def test_faces_are_reported_in_original_coordinates(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceRecognizer, "load")
+        face_recognizer = FaceRecognizer("buffalo_s", min_score=0.0, cache_dir="test_cache")
+        face_recognizer.det_model = mock.Mock()
+        face_recognizer.det_model.detect.return_value = (
+            np.array([[10, 20, 30, 40, 0.9]], dtype=np.float32),
+            np.random.rand(1, 5, 2).astype(np.float32),
+        )
+        face_recognizer.rec_model = mock.Mock()
+        face_recognizer.rec_model.get_feat.return_value = np.random.rand(1, 512).astype(np.float32)
+
+        faces = face_recognizer.predict(self.encode(5120, 3840))
+
+        assert face_recognizer.det_model.detect.call_args.args[0].shape == (960, 1280, 3)
+        assert (faces[0]["imageWidth"], faces[0]["imageHeight"]) == (5120, 3840)
+        assert faces[0]["boundingBox"] == {"x1": 40, "y1": 80, "x2": 120, "y2": 160}
+
+
+class TestUploads:
+    def upload(self, data: bytes, max_size: int) -> UploadFile:
+        file = SpooledTemporaryFile(max_size=max_size)
+        for i in range(0, len(data), 1000):
+            file.write(data[i : i + 1000])
+        file.seek(0)
+        return UploadFile(file)  # type: ignore[arg-type]
+
+    def test_shares_buffer_of_uploads_in_memory(self) -> None:
+        data = randbytes(10_000)
+        upload = self.upload(data, max_size=2**20)
+
+        content = read_upload(upload)
+
+        assert content == data
+        assert read_upload(upload) is content
+
+    def test_maps_spooled_uploads(self) -> None:
+        data = randbytes(10_000)
+
+        content = read_upload(self.upload(data, max_size=100))
+
+        assert isinstance(content, memoryview)
+        assert content == data
+        assert content.readonly
+
+    def test_empty_spooled_upload(self) -> None:
+        upload = UploadFile(SpooledTemporaryFile(max_size=0))  # type: ignore[arg-type]
+        upload.file.rollover()  # type: ignore[attr-defined]
+
+        assert read_upload(upload) == b""
+
+    def test_buffer_reader(self) -> None:
+        reader = BufferReader(memoryview(b"0123456789"))
+
+        assert reader.read(4) == b"0123"
+        assert reader.seek(-2, 2) == 8
+        assert reader.read() == b"89"
+        assert reader.read(1) == b""
+        assert reader.seek(3) == 3
+        assert reader.tell() == 3
+
+    def test_decodes_memoryviews(self, cv_image: NDArray[np.uint8], pil_image: Image.Image) -> None:
+        jpeg = cv2.imencode(".jpg", cv_image)[1].tobytes()
+
+        decoded = decode_reduced(memoryview(jpeg), 640)
+        opened = Image.open(as_file(memoryview(jpeg)))
+
+        assert np.array_equal(decoded.image, decode_reduced(jpeg, 640).image)
+        assert opened.size == pil_image.size
+
+    def test_spooled_image_reaches_detector_without_copy(
+        self,
+        deployed_app: TestClient,
+        deployed_detector: WeaponsDetector,
+        mocker: MockerFixture,
+        cv_image: NDArray[np.uint8],
+    ) -> None:
+        result = {"filePath": "", "imageWidth": 1, "imageHeight": 1, "weapons": []}
+        run = mocker.patch.object(deployed_detector, "run_image_prediction_byte_stream", return_value=result)
+        mocker.patch.object(MultiPartParser, "max_file_size", 100)
+        jpeg = cv2.imencode(".jpg", cv_image)[1].tobytes()
+
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "options": json.dumps({"mode": "image", "render": False}),
+            },
+            files={"image": jpeg},
+        )
+
+        assert response.status_code == 200
+        assert isinstance(run.call_args.args[0], memoryview)
+        assert run.call_args.args[0] == jpeg
+
 
 class TestFaceRecognition:
     def test_set_min_score(self, mocker: MockerFixture) -> None:
@@ -455,6 +922,259 @@ class TestFaceRecognition:
         assert rec_model.get_feat.call_count == num_faces
 
 
+class TestWeaponsDetector:
+    @pytest.fixture
+    def weights(self, tmp_path: Path, mocker: MockerFixture) -> Path:
+        path = tmp_path / "weights.pt"
+        path.write_bytes(b"weights")
+        mocker.patch.object(settings, "weapons_model_path", path.as_posix())
+        return path
+
+    def test_importing_app_does_not_import_torch(self) -> None:
+        # PyTorch and Ultralytics are only needed for `.pt` weights and tracking, and take seconds and hundreds of MB
+        # to import. Rendering detections doesn't need them either
+        code = (
+            "import sys, numpy as np, app.main; from app.models.weapons_detector import WeaponsDetector;"
+            "WeaponsDetector('yoloV8').plot(np.zeros((48, 64, 3), np.uint8), np.array([[1, 2, 30, 40, 0.9, 0]]));"
+            "print(sorted({'torch', 'ultralytics'} & set(sys.modules)))"
+        )
+
+        process = subprocess.run(
+            [sys.executable, "-c", code], cwd=Path(__file__).parent.parent, capture_output=True, check=True, text=True
+        )
+
+        assert process.stdout.strip() == "[]"
+
+    def test_copies_weights_into_cache_on_load(self, weights: Path, tmp_path: Path, mocker: MockerFixture) -> None:
+        yolo = mocker.patch("ultralytics.YOLO")
+        yolo.return_value.overrides = {"imgsz": [320, 320]}
+        detector = from_model_type(ModelType.WEAPONS_DETECTION, "yoloV8", cache_dir=tmp_path / "cache")
+
+        assert isinstance(detector, WeaponsDetector)
+        assert not detector.cached
+        yolo.assert_not_called()
+
+        detector.load()
+
+        assert (tmp_path / "cache" / "model.pt").read_bytes() == b"weights"
+        yolo.assert_called_once_with((tmp_path / "cache" / "model.pt").as_posix())
+        assert detector.decode_size == 320
+
+    @pytest.mark.asyncio
+    async def test_clears_corrupt_cache_and_retries(self, weights: Path, tmp_path: Path, mocker: MockerFixture) -> None:
+        yolo = mocker.patch(
+            "ultralytics.YOLO",
+            side_effect=[RuntimeError("PytorchStreamReader failed reading zip archive"), mock.Mock(overrides={})],
+        )
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "cache")
+        detector.download()
+        (tmp_path / "cache" / "model.pt").write_bytes(b"trunc")
+
+        await load(detector)
+
+        assert detector.loaded
+        assert yolo.call_count == 2
+        assert (tmp_path / "cache" / "model.pt").read_bytes() == b"weights"
+
+    def test_copies_weights_again_if_installed_weights_change(
+        self, weights: Path, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        mocker.patch("ultralytics.YOLO").return_value.overrides = {}
+        old = WeaponsDetector("yoloV8", cache_dir=tmp_path / "cache")
+        old.load()
+        old_version = old.version
+
+        weights.write_bytes(b"new weights")
+        new = WeaponsDetector("yoloV8", cache_dir=tmp_path / "cache")
+        assert not new.cached
+        new.load()
+
+        assert (tmp_path / "cache" / "model.pt").read_bytes() == b"new weights"
+        assert new.cached
+        assert new.version != old_version
+
+    def test_switching_from_onnx_export_to_pt_weights_removes_export(
+        self, yolo_export: Path, weights: Path, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(settings, "weapons_model_path", yolo_export.as_posix())
+        exported = WeaponsDetector("yoloV8", cache_dir=tmp_path / "cache", providers=["CPUExecutionProvider"])
+        exported.load()
+        assert exported.session is not None
+
+        mocker.patch.object(settings, "weapons_model_path", weights.as_posix())
+        yolo = mocker.patch("ultralytics.YOLO")
+        yolo.return_value.overrides = {}
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "cache")
+        detector.load()
+
+        assert not (tmp_path / "cache" / "model.onnx").exists()
+        assert detector.session is None
+        yolo.assert_called_once_with((tmp_path / "cache" / "model.pt").as_posix())
+
+    def test_endpoint_loads_model_on_first_request(
+        self, deployed_app: TestClient, weights: Path, tmp_path: Path, mocker: MockerFixture, pil_image: Image.Image
+    ) -> None:
+        mocker.patch.object(settings, "cache_folder", (tmp_path / "cache").as_posix())
+        mocker.patch("app.main.model_cache", ModelCache())
+        mocker.patch("app.main.clean_results", None)
+        yolo = mocker.patch("ultralytics.YOLO")
+        yolo.return_value.overrides = {}
+        result = mock.Mock(spec=Results)
+        result.boxes = mock.Mock(data=torch.empty((0, 6)))
+        yolo.return_value.predict.return_value = [result]
+        byte_image = BytesIO()
+        pil_image.save(byte_image, format="jpeg")
+        data = {"modelName": "yoloV8", "modelType": "weapons-detection", "options": json.dumps({"mode": "image"})}
+
+        responses = [deployed_app.post("/predict", data=data, files={"image": byte_image.getvalue()}) for _ in range(2)]
+
+        assert [response.status_code for response in responses] == [200, 200]
+        assert responses[0].json() == {"filePath": "", "imageWidth": 600, "imageHeight": 800, "weapons": []}
+        yolo.assert_called_once()
+        assert (tmp_path / "cache" / "weapons-detection" / "yoloV8" / "model.pt").is_file()
+
+    @pytest.mark.parametrize("size", [(320, 320), (400, 300)])
+    def test_onnx_matches_pytorch(
+        self, size: tuple[int, int], yolo_checkpoint: Path, yolo_export: Path, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        image = cv2.resize(np.random.default_rng(1).integers(0, 256, (40, 40, 3), dtype=np.uint8), size)
+        mocker.patch.object(settings, "weapons_model_path", yolo_checkpoint.as_posix())
+        torch_detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "torch")
+        torch_detector.load()
+        mocker.patch.object(settings, "weapons_model_path", yolo_export.as_posix())
+        onnx_detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "onnx", providers=["CPUExecutionProvider"])
+        onnx_detector.load()
+
+        expected = torch_detector.detect([image], 0.8)[0]
+        boxes = onnx_detector.detect([image], 0.8)[0]
+
+        assert isinstance(onnx_detector.session, ort.InferenceSession)
+        assert onnx_detector.dynamic_shapes
+        assert onnx_detector.names == torch_detector.names
+        assert onnx_detector.decode_size == 320
+        assert 0 < len(expected) < 300
+        assert boxes.shape == expected.shape
+        np.testing.assert_allclose(boxes[:, :4], expected[:, :4], atol=0.05)
+        np.testing.assert_allclose(boxes[:, 4], expected[:, 4], atol=1e-4)
+        np.testing.assert_array_equal(boxes[:, 5], expected[:, 5])
+
+    def test_onnx_runs_square_frames_one_at_a_time_with_static_shapes(
+        self, yolo_export: Path, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        rng = np.random.default_rng(2)
+        frames = [cv2.resize(rng.integers(0, 256, (40, 40, 3), dtype=np.uint8), (320, 320)) for _ in range(3)]
+        mocker.patch.object(settings, "weapons_model_path", yolo_export.as_posix())
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "dynamic", providers=["CPUExecutionProvider"])
+        detector.load()
+        static_detector = WeaponsDetector(
+            "yoloV8",
+            cache_dir=tmp_path / "static",
+            providers=["OpenVINOExecutionProvider", "CPUExecutionProvider"],
+            provider_options=[{}, {}],
+        )
+        static_detector.load()
+        assert static_detector.session is not None
+        run = mocker.spy(static_detector.session, "run")
+
+        expected = detector.detect(frames, 0.8)
+        boxes = static_detector.detect([*frames, cv2.resize(frames[0], (400, 300))], 0.8)
+
+        assert (tmp_path / "static" / "static_1" / "model.onnx").is_file()
+        assert static_detector.session.get_inputs()[0].shape == [1, 3, 320, 320]
+        assert not static_detector.dynamic_shapes
+        assert run.call_count == 4
+        assert any(len(frame_boxes) for frame_boxes in expected)
+        for frame_boxes, expected_boxes in zip(boxes, expected):
+            np.testing.assert_allclose(frame_boxes, expected_boxes, atol=1e-3)
+        assert (boxes[3][:, [0, 2]] <= 400).all() and (boxes[3][:, [1, 3]] <= 300).all()
+
+    def test_warm_up_loads_and_runs_dummy_frame(self, yolo_export: Path, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "weapons_model_path", yolo_export.as_posix())
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path, providers=["CPUExecutionProvider"])
+        detect = mocker.spy(detector, "detect")
+
+        detector.warm_up()
+
+        assert detector.loaded
+        detect.assert_called_once()
+        assert [frame.shape for frame in detect.call_args.args[0]] == [(320, 320, 3)]
+
+    def test_estimates_size_of_loaded_weights(self, yolo_export: Path, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "weapons_model_path", yolo_export.as_posix())
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path, providers=["CPUExecutionProvider"])
+
+        detector.load()
+
+        assert detector.estimated_size == (yolo_export / "model.onnx").stat().st_size
+
+    def test_tracks_with_bot_sort(self, tmp_path: Path) -> None:
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path)
+        tracker = detector.make_tracker()
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+
+        tracked = [
+            detector.associate(tracker, np.array([[10 + i, 10, 30 + i, 30, 0.9, 0]], dtype=np.float32), frame)
+            for i in range(3)
+        ]
+
+        # the default tracker of `YOLO.track`, which the weapons detector used before running its own sessions
+        assert isinstance(tracker, BOTSORT)
+        assert [boxes[:, 4].tolist() for boxes in tracked] == [[1], [1], [1]]
+        np.testing.assert_allclose(tracked[-1][0, :4], [12, 10, 32, 30], atol=1)
+
+    def test_quantized_model_runs_with_static_shapes(
+        self, yolo_int8_export: Path, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        image = cv2.resize(np.random.default_rng(6).integers(0, 256, (40, 40, 3), dtype=np.uint8), (400, 300))
+        mocker.patch.object(settings, "weapons_model_path", yolo_int8_export.as_posix())
+        mocker.patch.object(settings, "quantized", True)
+        detector = WeaponsDetector(
+            "yoloV8",
+            cache_dir=tmp_path,
+            providers=["OpenVINOExecutionProvider", "CPUExecutionProvider"],
+            provider_options=[{}, {}],
+        )
+        detector.load()
+
+        boxes = detector.detect([image], 0.01)[0]
+
+        assert (tmp_path / "static_1" / "model_int8.onnx").is_file()
+        assert not (tmp_path / "static_1" / "model.onnx").exists()
+        assert detector.session is not None
+        assert detector.session.get_outputs()[0].shape == [1, 4 + len(detector.names), 2100]
+        assert boxes.shape[1] == 6
+        assert (boxes[:, [0, 2]] <= 400).all() and (boxes[:, [1, 3]] <= 300).all()
+
+    @pytest.mark.parametrize("stride", [None, 32])
+    def test_letterbox_matches_ultralytics(self, stride: int | None) -> None:
+        image = np.random.default_rng(3).integers(0, 256, (150, 400, 3), dtype=np.uint8)
+
+        pixels, placement = letterbox(image, 320, stride=stride)
+
+        expected = LetterBox((320, 320), auto=stride is not None, stride=stride or 32)(image=image)
+        assert isinstance(expected, np.ndarray)
+        expected_shape = (expected.shape[0], expected.shape[1])
+        assert pixels.shape[1:] == expected_shape == letterbox_shape(150, 400, 320, stride)
+        np.testing.assert_allclose(pixels, expected[..., ::-1].transpose(2, 0, 1) / 255, atol=1e-6)
+        boxes = np.array([[10, 50, 300, 100, 0.9, 0]], dtype=np.float32)
+        scaled = scale_boxes(expected_shape, torch.from_numpy(boxes[:, :4].copy()), (150, 400))
+        assert isinstance(scaled, torch.Tensor)
+        np.testing.assert_allclose(placement.to_original(boxes)[:, :4], scaled.numpy(), atol=1e-4)
+        np.testing.assert_array_equal(placement.to_original(boxes)[:, 4:], boxes[:, 4:])
+
+    def test_non_max_suppression_matches_ultralytics(self) -> None:
+        rng = np.random.default_rng(4)
+        prediction = np.empty((4 + 3, 2100), dtype=np.float32)
+        prediction[:2] = rng.uniform(0, 320, (2, 2100))
+        prediction[2:4] = rng.uniform(5, 100, (2, 2100))
+        prediction[4:] = rng.permutation(3 * 2100).reshape(3, 2100) / (3 * 2100)
+
+        boxes = non_max_suppression(prediction, 0.5)
+
+        expected = ultralytics_nms(torch.from_numpy(prediction[None].copy()), 0.5, 0.7, max_time_img=60)[0].numpy()
+        np.testing.assert_allclose(boxes, expected)
+
+
 @pytest.mark.asyncio
 class TestCache:
     async def test_caches(self, mock_get_model: mock.Mock) -> None:
@@ -501,6 +1221,93 @@ class TestCache:
         assert isinstance(profiling, dict)
         assert profiling == model_cache.cache.profiling
 
+    async def test_load_lock_is_shared_by_instances_of_the_same_model(self) -> None:
+        model_cache = ModelCache()
+        vision = OpenCLIPEncoder("ViT-B-32__openai", mode="vision")
+
+        lock = model_cache.load_lock(vision)
+
+        assert model_cache.load_lock(OpenCLIPEncoder("ViT-B-32__openai", mode="vision")) is lock
+        assert model_cache.load_lock(OpenCLIPEncoder("ViT-B-32__openai", mode="text")) is not lock
+        assert model_cache.load_lock(FaceRecognizer("buffalo_l")) is not lock
+        assert not model_cache.loading
+        with lock:
+            assert model_cache.loading
+
+    async def test_evicts_least_recently_used_models_over_budget(self, mock_get_model: mock.Mock) -> None:
+        mock_get_model.side_effect = self.make_model
+        model_cache = ModelCache(max_size=100)
+        first = await model_cache.get("first", ModelType.CLIP)
+        second = await model_cache.get("second", ModelType.CLIP)
+        await model_cache.get("first", ModelType.CLIP)
+        third = await model_cache.get("third", ModelType.CLIP)
+
+        await model_cache.evict(keep=third)
+
+        assert list(model_cache.cache._cache.values()) == [first, third]
+        assert await model_cache.get("second", ModelType.CLIP) is not second
+        stats = model_cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 4, 1)
+        assert (stats["size"], stats["maxSize"]) == (120, 100)
+        assert [model["modelName"] for model in stats["models"]] == ["first", "third", "second"]
+
+    async def test_keeps_loaded_model_and_models_being_loaded(self, mock_get_model: mock.Mock) -> None:
+        mock_get_model.side_effect = self.make_model
+        model_cache = ModelCache(max_size=30)
+        loading = await model_cache.get("loading", ModelType.CLIP)
+        loading.loaded = False
+        loaded = await model_cache.get("loaded", ModelType.CLIP)
+
+        await model_cache.evict(keep=loaded)
+
+        assert list(model_cache.cache._cache.values()) == [loading, loaded]
+        assert model_cache.stats()["evictions"] == 0
+
+    async def test_pinned_models_neither_expire_nor_get_evicted(self, mock_get_model: mock.Mock) -> None:
+        mock_get_model.side_effect = self.make_model
+        model_cache = ModelCache(ttl=100, max_size=50)
+        pinned = await model_cache.get("pinned", ModelType.CLIP)
+        model_cache.pin()
+        other = await model_cache.get("other", ModelType.CLIP)
+
+        await model_cache.evict(keep=other)
+
+        assert list(model_cache.cache._cache.values()) == [pinned, other]
+        assert list(model_cache.cache._handlers) == [model_cache._key("other", ModelType.CLIP, None)]
+
+    async def test_does_not_evict_without_budget(self, mock_get_model: mock.Mock) -> None:
+        mock_get_model.side_effect = self.make_model
+        model_cache = ModelCache()
+        for model_name in ["first", "second", "third"]:
+            await model_cache.get(model_name, ModelType.CLIP)
+
+        await model_cache.evict()
+
+        assert len(model_cache.cache._cache) == 3
+
+    async def test_stats_endpoint(self, deployed_app: TestClient, mocker: MockerFixture) -> None:
+        model_cache = ModelCache(max_size=2**20)
+        model_cache.hits, model_cache.misses = 3, 1
+        mocker.patch("app.main.model_cache", model_cache)
+
+        response = deployed_app.get("/cache/models")
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "hits": 3,
+            "misses": 1,
+            "hitRate": 0.75,
+            "evictions": 0,
+            "size": 0,
+            "maxSize": 2**20,
+            "models": [],
+        }
+
+    def make_model(self, model_type: ModelType, model_name: str, **model_kwargs: Any) -> mock.Mock:
+        model = mock.Mock(spec=InferenceModel, model_type=model_type, loaded=True, estimated_size=40)
+        model.model_name = model_name
+        return model
+
     async def test_loads_mclip(self) -> None:
         model_cache = ModelCache()
 
@@ -523,10 +1330,70 @@ class TestCache:
             await model_cache.get("test_model_name", ModelType.CLIP, mode="text")
 
 
+class TestOptions:
+    def test_parses_once(self) -> None:
+        options = parse_options(ModelType.FACIAL_RECOGNITION, '{"minScore": 0.4}')
+
+        assert options == FacialRecognitionOptions(minScore=0.4)
+        assert parse_options(ModelType.FACIAL_RECOGNITION, '{"minScore": 0.4}') is options
+
+    def test_fills_defaults_and_ignores_unknown_options(self) -> None:
+        options = parse_options(ModelType.WEAPONS_DETECTION, '{"mode": "image", "maxDistance": 0.6}')
+
+        assert isinstance(options, WeaponsDetectionOptions)
+        assert (options.minScore, options.render, options.output) == (0.2, True, "video")
+        assert options.dict(exclude_unset=True) == {"mode": "image"}
+
+    def test_rejects_invalid_options(self) -> None:
+        with pytest.raises(ValidationError):
+            parse_options(ModelType.CLIP, '{"mode": "audio"}')
+        with pytest.raises(ValidationError):
+            parse_options(ModelType.WEAPONS_DETECTION, '{"minScore": "high"}')
+
+    def test_options_are_immutable(self) -> None:
+        options = CLIPOptions(mode="text")
+
+        with pytest.raises(TypeError):
+            options.mode = "vision"  # type: ignore[misc]
+
+    def test_configure_applies_options(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceRecognizer, "load")
+        face_recognizer = FaceRecognizer("buffalo_s", min_score=0.7, cache_dir="test_cache")
+        face_recognizer.det_model = mock.Mock(det_thresh=0.7)
+
+        face_recognizer.configure(FacialRecognitionOptions())
+        unchanged = face_recognizer.det_model.det_thresh
+        face_recognizer.configure(FacialRecognitionOptions(minScore=0.3))
+
+        assert unchanged == 0.7
+        assert face_recognizer.det_model.det_thresh == 0.3
+
+    def test_result_key_ignores_asset_id_and_explicit_defaults(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch("app.main.result_cache", ResultCache(tmp_path, 2**20))
+
+        def key(options: str) -> str | None:
+            return result_key(
+                b"image", ModelType.WEAPONS_DETECTION, "yolov8", "v1", WeaponsDetectionOptions.parse_raw(options)
+            )
+
+        assert key('{"mode": "image"}') == key('{"mode": "image", "minScore": 0.2, "assetId": "a"}')
+        assert key('{"mode": "image"}') != key('{"mode": "image", "minScore": 0.3}')
+
+    @pytest.mark.parametrize("options", ['{"minScore": "high"}', '{"output": "gif"}', "not json"])
+    def test_endpoint_rejects_invalid_options(self, deployed_app: TestClient, options: str) -> None:
+        response = deployed_app.post(
+            "/predict",
+            data={"modelName": "yoloV8", "modelType": "weapons-detection", "text": "", "options": options},
+        )
+
+        assert response.status_code == 400
+
+
 @pytest.mark.asyncio
 class TestLoad:
     async def test_load(self) -> None:
         mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.model_name = "test_model_name"
         mock_model.loaded = False
 
         res = await load(mock_model)
@@ -557,6 +1424,1558 @@ class TestLoad:
         mock_model.clear_cache.assert_called_once()
         assert mock_model.load.call_count == 2
 
+    async def test_load_evicts_least_recently_used_models_over_budget(
+        self, mock_get_model: mock.Mock, mocker: MockerFixture
+    ) -> None:
+        model_cache = ModelCache(max_size=100)
+        mocker.patch("app.main.model_cache", model_cache)
+        mock_get_model.side_effect = lambda model_type, model_name: SlowModel(model_name, 0, size=60)
+
+        await load(await model_cache.get("buffalo_l", ModelType.FACIAL_RECOGNITION))
+        second = await load(await model_cache.get("antelopev2", ModelType.FACIAL_RECOGNITION))
+
+        assert list(model_cache.cache._cache.values()) == [second]
+        assert model_cache.stats()["evictions"] == 1
+
+
+class SlowModel(InferenceModel):
+    _model_type = ModelType.FACIAL_RECOGNITION
+
+    def __init__(self, model_name: str, delay: float, size: int = 0) -> None:
+        super().__init__(model_name, providers=["CPUExecutionProvider"])
+        self.delay = delay
+        self.size = size
+        self.loads = 0
+
+    def _download(self) -> None:
+        pass
+
+    def _load(self) -> None:
+        time.sleep(self.delay)
+        self.estimated_size = self.size
+        self.loads += 1
+
+    def _predict(self, inputs: Any) -> Any:
+        return inputs
+
+
+@pytest.mark.asyncio
+class TestLoadLocks:
+    async def test_different_models_load_in_parallel(self, mocker: MockerFixture) -> None:
+        model_cache = ModelCache()
+        mocker.patch("app.main.model_cache", model_cache)
+        mocker.patch("app.main.thread_pool", ThreadPoolExecutor(4))
+        models = [SlowModel("buffalo_l", 0.5), SlowModel("antelopev2", 0.3)]
+
+        start = time.perf_counter()
+        loading = asyncio.gather(*[load(model) for model in models])
+        await asyncio.sleep(0.1)
+        was_loading = model_cache.loading
+        await loading
+        elapsed = time.perf_counter() - start
+
+        # the longer load rather than the sum of both
+        assert 0.5 <= elapsed < 0.75
+        assert [model.loads for model in models] == [1, 1]
+        assert was_loading
+        assert not model_cache.loading
+
+    async def test_same_model_loads_once(self, mocker: MockerFixture) -> None:
+        mocker.patch("app.main.model_cache", ModelCache())
+        mocker.patch("app.main.thread_pool", ThreadPoolExecutor(4))
+        model = SlowModel("buffalo_l", 0.2)
+
+        results = await asyncio.gather(*[load(model) for _ in range(3)])
+
+        assert results == [model] * 3
+        assert model.loads == 1
+
+    async def test_loaded_model_does_not_wait_for_other_loads(self, mocker: MockerFixture) -> None:
+        mocker.patch("app.main.model_cache", ModelCache())
+        mocker.patch("app.main.thread_pool", ThreadPoolExecutor(4))
+        loaded, slow = SlowModel("antelopev2", 0), SlowModel("buffalo_l", 0.5)
+        await load(loaded)
+
+        loading = asyncio.ensure_future(load(slow))
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        await load(loaded)
+        elapsed = time.perf_counter() - start
+        await loading
+
+        assert elapsed < 0.05
+        assert not loading.exception()
+
+
+@pytest.mark.asyncio
+class TestPreload:
+    def make_model(self, model_type: ModelType, model_name: str, **model_kwargs: Any) -> mock.Mock:
+        model = mock.Mock(spec=WeaponsDetector if model_type == ModelType.WEAPONS_DETECTION else InferenceModel)
+        model.model_name = model_name
+        model.loaded = False
+        return model
+
+    async def test_settings_from_env(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setenv("MACHINE_LEARNING_PRELOAD__CLIP", "ViT-B-32__openai")
+        monkeypatch.setenv("MACHINE_LEARNING_PRELOAD__WEAPONS_DETECTION", "yoloV8")
+
+        preload = Settings().preload
+
+        assert preload == PreloadModelData(clip="ViT-B-32__openai", weapons_detection="yoloV8")
+
+    async def test_preload_models_warms_up_each_model(self, mock_get_model: mock.Mock, mocker: MockerFixture) -> None:
+        mocker.patch("app.main.model_cache", ModelCache())
+        mocker.patch("app.main.clean_results", None)
+        created: list[mock.Mock] = []
+
+        def make_model(model_type: ModelType, model_name: str, **model_kwargs: Any) -> mock.Mock:
+            created.append(self.make_model(model_type, model_name, **model_kwargs))
+            return created[-1]
+
+        mock_get_model.side_effect = make_model
+        models = get_preloaded_models(PreloadModelData(clip="ViT-B-32__openai", weapons_detection="yoloV8"))
+
+        await preload_models(models)
+
+        assert [(model.modelType, model.mode, model.status) for model in models] == [
+            (ModelType.CLIP, "vision", ModelStatus.WARM),
+            (ModelType.CLIP, "text", ModelStatus.WARM),
+            (ModelType.WEAPONS_DETECTION, None, ModelStatus.WARM),
+        ]
+        # the models are the ones requests with these options get from the cache
+        assert mock_get_model.call_args_list == [
+            mock.call(ModelType.CLIP, "ViT-B-32__openai", mode="vision"),
+            mock.call(ModelType.CLIP, "ViT-B-32__openai", mode="text"),
+            mock.call(ModelType.WEAPONS_DETECTION, "yoloV8", clean_results=None),
+        ]
+        for model in created:
+            model._warm_up.assert_called_once()
+
+    async def test_preload_failure_is_reported(self, mock_get_model: mock.Mock, mocker: MockerFixture) -> None:
+        mocker.patch("app.main.model_cache", ModelCache())
+        mocker.patch("app.main.clean_results", None)
+        face_model = self.make_model(ModelType.FACIAL_RECOGNITION, "buffalo_l")
+        face_model.load.side_effect = RuntimeError("Could not download model")
+        mock_get_model.side_effect = [face_model, self.make_model(ModelType.WEAPONS_DETECTION, "yoloV8")]
+        models = get_preloaded_models(PreloadModelData(facial_recognition="buffalo_l", weapons_detection="yoloV8"))
+
+        await preload_models(models)
+
+        assert [model.status for model in models] == [ModelStatus.FAILED, ModelStatus.WARM]
+
+    async def test_ready_endpoint(self, deployed_app: TestClient, mocker: MockerFixture) -> None:
+        models = get_preloaded_models(PreloadModelData(facial_recognition="buffalo_l", weapons_detection="yoloV8"))
+        models[1].status = ModelStatus.WARM
+        mocker.patch("app.main.preloaded", models)
+
+        loading = deployed_app.get("/ready")
+        models[0].status = ModelStatus.WARM
+        warm = deployed_app.get("/ready")
+
+        assert loading.status_code == 503
+        assert loading.json() == {
+            "ready": False,
+            "models": [
+                {"modelType": "facial-recognition", "modelName": "buffalo_l", "mode": None, "status": "loading"},
+                {"modelType": "weapons-detection", "modelName": "yoloV8", "mode": None, "status": "warm"},
+            ],
+        }
+        assert warm.status_code == 200
+        assert warm.json()["ready"]
+
+    async def test_ready_without_preload(self, deployed_app: TestClient) -> None:
+        response = deployed_app.get("/ready")
+
+        assert response.status_code == 200
+        assert response.json() == {"ready": True, "models": []}
+
+
+def process_memory(pid: int) -> dict[str, int]:
+    """The RSS, PSS and private memory of a process in MiB."""
+
+    fields = {}
+    # the first line is the address range the totals cover
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()[1:]:
+        name, value = line.split(":")
+        fields[name] = int(value.split()[0]) // 1024
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "private": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def child_pids(pid: int) -> list[int]:
+    return [int(child) for child in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+
+
+@contextmanager
+def start_workers(workers: int, shared: bool, cache_folder: Path) -> Iterator[list[int]]:
+    """Runs `start.sh` with a preloaded weapons detector and yields the PIDs of the workers once they're ready."""
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {
+        **os.environ,
+        "MACHINE_LEARNING_HOST": "127.0.0.1",
+        "MACHINE_LEARNING_PORT": str(port),
+        "MACHINE_LEARNING_WORKERS": str(workers),
+        "MACHINE_LEARNING_SHARE_MODELS": str(shared).lower(),
+        "MACHINE_LEARNING_CACHE_FOLDER": cache_folder.as_posix(),
+        "MACHINE_LEARNING_PRELOAD__WEAPONS_DETECTION": "yoloV8",
+        "MACHINE_LEARNING_MODEL_TTL": "0",
+        "MACHINE_LEARNING_VIDEO_JOBS_FOLDER": (cache_folder / "jobs").as_posix(),
+        "MACHINE_LEARNING_CLEAN_RESULTS_PATH": "",
+    }
+    process = subprocess.Popen(
+        ["sh", "start.sh"],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        # requests go to any worker, so every worker is likely warm once enough of them in a row were ready
+        ready = 0
+        deadline = time.monotonic() + 300
+        while ready < 5 * workers:
+            assert process.poll() is None, "The service exited"
+            assert time.monotonic() < deadline, "The workers didn't get ready in time"
+            try:
+                ready = ready + 1 if httpx.get(f"http://127.0.0.1:{port}/ready").status_code == 200 else 0
+            except httpx.TransportError:
+                ready = 0
+            if not ready:
+                time.sleep(0.5)
+        (master,) = child_pids(process.pid)
+        yield child_pids(master)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+
+class TestSharedModels:
+    def test_share_models_preloads_and_pins_models(self, mock_get_model: mock.Mock, mocker: MockerFixture) -> None:
+        model_cache = ModelCache(ttl=100)
+        mocker.patch("app.main.model_cache", model_cache)
+        mocker.patch.object(settings, "preload", PreloadModelData(facial_recognition="buffalo_l"))
+        mock_get_model.side_effect = lambda model_type, model_name, **model_kwargs: SlowModel(model_name, 0)
+
+        share_models()
+
+        (model,) = model_cache.cache._cache.values()
+        assert model.loaded
+        assert model_cache.pinned == {model_cache._key("buffalo_l", ModelType.FACIAL_RECOGNITION, None)}
+        assert not model_cache.cache._handlers
+
+    def test_shared_models_run_on_one_thread(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "share_models", True)
+        mocker.patch.object(settings, "model_intra_op_threads", 4)
+
+        encoder = OpenCLIPEncoder("ViT-B-32__openai", providers=["CPUExecutionProvider"])
+
+        assert encoder.sess_options.intra_op_num_threads == 1
+        assert encoder.sess_options.inter_op_num_threads == 1
+
+    @pytest.mark.skipif(
+        not settings.test_full,
+        reason="More time-consuming since it starts the service with several workers.",
+    )
+    @pytest.mark.parametrize("workers", [1, 2, 4])
+    def test_workers_share_model_memory(
+        self, workers: int, yolo_export: Path, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        # copied beforehand, since workers that load the model themselves would all copy it at once
+        shutil.copytree(yolo_export, tmp_path / ModelType.WEAPONS_DETECTION / "yoloV8")
+        usage: dict[bool, list[dict[str, int]]] = {}
+        for shared in [False, True]:
+            with start_workers(workers, shared, tmp_path) as pids:
+                usage[shared] = [process_memory(pid) for pid in pids]
+
+        with capsys.disabled():
+            print(f"\n{'workers':>7} {'shared':<6} {'worker':>6} {'RSS MiB':>8} {'PSS MiB':>8} {'private MiB':>11}")
+            for shared, processes in usage.items():
+                for i, memory in enumerate(processes):
+                    row = f"{memory['rss']:>8} {memory['pss']:>8} {memory['private']:>11}"
+                    print(f"{workers:>7} {str(shared):<6} {i:>6} {row}")
+
+        assert len(usage[False]) == len(usage[True]) == workers
+        # each worker that loads the model itself has a private copy of its weights and more
+        model_size = (yolo_export / "model.onnx").stat().st_size // 2**20
+        assert max(memory["private"] for memory in usage[True]) + model_size < min(
+            memory["private"] for memory in usage[False]
+        )
+
+
+@pytest.mark.asyncio
+class TestMicroBatching:
+    async def test_coalesces_calls_while_busy(self) -> None:
+        func = mock.Mock(side_effect=lambda inputs: [item * 2 for item in inputs])
+        batcher = MicroBatcher(func, max_size=4, max_wait=1.0)
+
+        outputs = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+
+        assert outputs == [i * 2 for i in range(10)]
+        # the first input runs right away since nothing else is running
+        assert [call.args[0] for call in func.call_args_list] == [[0], [1, 2, 3, 4], [5, 6, 7, 8], [9]]
+
+    async def test_runs_partial_batch_after_max_wait(self) -> None:
+        func = mock.Mock(side_effect=lambda inputs: inputs)
+        batcher = MicroBatcher(func, max_size=8, max_wait=0.01)
+
+        start = time.perf_counter()
+        outputs = await asyncio.gather(*[batcher.submit(item) for item in "abc"])
+
+        assert outputs == ["a", "b", "c"]
+        assert time.perf_counter() - start < 0.5
+        assert [call.args[0] for call in func.call_args_list] == [["a"], ["b", "c"]]
+
+    async def test_does_not_wait_when_idle(self) -> None:
+        batcher = MicroBatcher(lambda inputs: inputs, max_size=8, max_wait=10.0)
+
+        outputs = await asyncio.wait_for(asyncio.gather(*[batcher.submit(i) for i in range(3)]), 1.0)
+        assert outputs == [0, 1, 2]
+        assert await asyncio.wait_for(batcher.submit(3), 1.0) == 3
+
+    async def test_runs_batches_in_executor(self) -> None:
+        threads: list[int] = []
+
+        def func(inputs: list[int]) -> list[int]:
+            threads.append(threading.get_ident())
+            return inputs
+
+        with ThreadPoolExecutor(1) as pool:
+            batcher = MicroBatcher(func, max_size=2, max_wait=0.01, executor=pool)
+            assert await asyncio.gather(batcher.submit(1), batcher.submit(2)) == [1, 2]
+
+        assert threading.get_ident() not in threads
+
+    async def test_raises_error_for_every_caller(self) -> None:
+        batcher = MicroBatcher(mock.Mock(side_effect=RuntimeError("bad batch")), max_size=2, max_wait=0.01)
+
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def test_only_fails_caller_of_bad_input(self) -> None:
+        def predict(inputs: list[int]) -> list[int]:
+            if 2 in inputs:
+                raise RuntimeError("bad input")
+            return inputs
+
+        func = mock.Mock(side_effect=predict)
+        batcher = MicroBatcher(func, max_size=4, max_wait=0.01)
+
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(4)], return_exceptions=True)
+
+        assert results[:2] + results[3:] == [0, 1, 3]
+        assert isinstance(results[2], RuntimeError)
+        assert [call.args[0] for call in func.call_args_list] == [[0], [1, 2, 3], [1], [2], [3]]
+
+    async def test_cancels_callers_when_cancelled(self) -> None:
+        release = threading.Event()
+
+        def func(inputs: list[int]) -> list[int]:
+            release.wait()
+            return inputs
+
+        with ThreadPoolExecutor(1) as pool:
+            batcher = MicroBatcher(func, max_size=2, max_wait=0.01, executor=pool)
+            caller = asyncio.create_task(batcher.submit(1))
+            await asyncio.sleep(0.01)
+
+            for task in list(batcher.tasks):
+                task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(caller, 1.0)
+            release.set()
+
+    async def test_raises_error_on_missing_outputs(self) -> None:
+        batcher = MicroBatcher(mock.Mock(return_value=[]), max_size=2, max_wait=0.01)
+
+        with pytest.raises(ValueError):
+            await batcher.submit(1)
+
+    async def test_batches_requests_by_model_and_options(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "request_batch_size", 4)
+        model = mock.Mock(spec=InferenceModel)
+
+        batcher = get_batcher(model, FacialRecognitionOptions())
+
+        assert get_batcher(model, FacialRecognitionOptions()) is batcher
+        assert get_batcher(model, FacialRecognitionOptions(minScore=0.5)) is not batcher
+        assert get_batcher(mock.Mock(spec=InferenceModel), FacialRecognitionOptions()) is not batcher
+
+    async def test_batches_requests_with_sampling_options(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "request_batch_size", 4)
+        model = mock.Mock(spec=InferenceModel)
+
+        def options(sampling: str) -> ModelOptions:
+            return parse_options(ModelType.WEAPONS_DETECTION, f'{{"sampling": {sampling}}}')
+
+        batcher = get_batcher(model, options('{"strategy": "fps", "fps": 2}'))
+
+        assert get_batcher(model, options('{"fps": 2, "strategy": "fps"}')) is batcher
+        assert get_batcher(model, options('{"strategy": "fps"}')) is not batcher
+
+    async def test_does_not_keep_unloaded_models_alive(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "request_batch_size", 4)
+        model = mock.Mock(spec=InferenceModel)
+        get_batcher(model, FacialRecognitionOptions())
+        model_ref = weakref.ref(model)
+
+        del model
+        gc.collect()
+
+        assert model_ref() is None
+
+    async def test_predict_endpoint_batches_requests(self, deployed_app: TestClient, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "request_batch_size", 4)
+        mocker.patch.object(settings, "request_batch_wait_ms", 500)
+        mock_model = mock.Mock(spec=InferenceModel, loaded=True)
+
+        def predict_batch(inputs: list[Any], options: ModelOptions | None = None) -> list[Any]:
+            time.sleep(0.2)  # keeps the first batch running while the other requests arrive
+            return [[len(inputs)] for _ in inputs]
+
+        mock_model.predict_batch.side_effect = predict_batch
+        mocker.patch.object(ModelCache, "get", autospec=True, return_value=mock_model)
+        data = {"modelName": "ViT-B-32__openai", "modelType": "clip", "text": "test search query"}
+
+        with ThreadPoolExecutor(4) as pool:
+            responses = list(pool.map(lambda _: deployed_app.post("/predict", data=data), range(4)))
+
+        assert sorted(response.json()[0] for response in responses) == [1, 3, 3, 3]
+        assert mock_model.predict_batch.call_count == 2
+        mock_model.predict.assert_not_called()
+
+    async def test_predict_endpoint_batches_requests_with_sampling_options(
+        self, deployed_app: TestClient, mocker: MockerFixture, pil_image: Image.Image
+    ) -> None:
+        mocker.patch.object(settings, "request_batch_size", 4)
+        mock_model = mock.Mock(spec=WeaponsDetector, loaded=True)
+        mock_model.predict_batch.side_effect = lambda inputs, options: [{"weapons": []} for _ in inputs]
+        mocker.patch("app.main.get_weapons_detector", autospec=True, return_value=mock_model)
+        image = BytesIO()
+        pil_image.save(image, format="jpeg")
+
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "options": json.dumps({"sampling": {"strategy": "interval", "interval": 2}}),
+            },
+            files={"image": image.getvalue()},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"weapons": []}
+        mock_model.predict_batch.assert_called_once()
+
+
+class TestImageDetection:
+    boxes = np.array([[10.4, 20.0, 30.6, 40.0, 0.9, 0.0]], dtype=np.float32)
+
+    def test_returns_detections(self, weapons_detector: WeaponsDetector, cv_image: cv2.Mat, tmp_path: Path) -> None:
+        weapons_detector.detect = mock.Mock(return_value=[self.boxes])  # type: ignore[method-assign]
+        plot = mock.Mock(return_value=cv_image)
+        weapons_detector.plot = plot  # type: ignore[method-assign]
+        image = cv2.imencode(".jpg", cv_image)[1].tobytes()
+
+        result = weapons_detector.run_image_prediction_byte_stream(image, "asset", tmp_path, 0.5, render=False)
+
+        plot.assert_not_called()
+        assert list(tmp_path.iterdir()) == []
+        assert result["filePath"] == ""
+        assert (result["imageHeight"], result["imageWidth"]) == cv_image.shape[:2]
+        assert result["weapons"] == [
+            {
+                "boundingBox": {"x1": 10, "y1": 20, "x2": 31, "y2": 40},
+                "className": "weapon",
+                "score": pytest.approx(0.9),
+            }
+        ]
+
+    def test_renders_detections(self, weapons_detector: WeaponsDetector, cv_image: cv2.Mat, tmp_path: Path) -> None:
+        weapons_detector.detect = mock.Mock(return_value=[self.boxes])  # type: ignore[method-assign]
+
+        result = weapons_detector.run_image_prediction_byte_stream(cv_image, "asset", tmp_path, 0.5)
+
+        assert result["filePath"] == str(tmp_path / "asset.jpg")
+        assert (tmp_path / "asset.jpg").is_file()
+        assert len(result["weapons"]) == 1
+
+    def test_plots_labeled_boxes(self, weapons_detector: WeaponsDetector) -> None:
+        frame = np.zeros((300, 400, 3), dtype=np.uint8)
+        boxes = np.array([[20, 100, 200, 250, 0.9, 0]], dtype=np.float32)
+
+        plotted = weapons_detector.plot(frame, boxes)
+
+        assert not frame.any()
+        # the box edges in the color of the first class, and the label in white above the box
+        assert tuple(plotted[175, 20]) == tuple(plotted[250, 100]) == (56, 56, 255)
+        assert not plotted[175, 100].any()
+        label = (plotted.min(axis=-1) > 200).nonzero()
+        assert label[0].min() > 80 and label[0].max() < 105
+        assert label[1].min() >= 20
+
+    def test_plots_track_ids(self, weapons_detector: WeaponsDetector) -> None:
+        frame = np.zeros((300, 400, 3), dtype=np.uint8)
+        boxes = np.array([[20, 100, 200, 250, 0.9, 0]], dtype=np.float32)
+        tracked = np.array([[20, 100, 200, 250, 3, 0.9, 0]], dtype=np.float32)
+
+        label_ends = [
+            (weapons_detector.plot(frame, plotted).min(axis=-1) > 200).nonzero()[1].max()
+            for plotted in [boxes, tracked]
+        ]
+
+        # the label is longer with the track ID
+        assert label_ends[1] > label_ends[0]
+
+    def test_does_not_render_without_detections(
+        self, weapons_detector: WeaponsDetector, cv_image: cv2.Mat, tmp_path: Path
+    ) -> None:
+        weapons_detector.detect = mock.Mock(return_value=[np.empty((0, 6), dtype=np.float32)])  # type: ignore[method-assign]
+
+        result = weapons_detector.run_image_prediction_byte_stream(cv_image, "asset", tmp_path, 0.5)
+
+        assert result["filePath"] == ""
+        assert result["weapons"] == []
+        assert list(tmp_path.iterdir()) == []
+
+    def test_image_endpoint(
+        self,
+        deployed_app: TestClient,
+        deployed_detector: WeaponsDetector,
+        mocker: MockerFixture,
+        pil_image: Image.Image,
+    ) -> None:
+        result = {"filePath": "", "imageWidth": 1, "imageHeight": 1, "weapons": []}
+        run = mocker.patch.object(deployed_detector, "run_image_prediction_byte_stream", return_value=result)
+        byte_image = BytesIO()
+        pil_image.save(byte_image, format="jpeg")
+
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "options": json.dumps({"mode": "image", "assetId": "asset", "minScore": 0.3, "render": False}),
+            },
+            files={"image": byte_image.getvalue()},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == result
+        assert run.call_args.kwargs == {
+            "asset_id": "asset",
+            "save_directory": Path("/ml-results/"),
+            "confidence": 0.3,
+            "render": False,
+        }
+
+
+class TestAnalyze:
+    def test_decodes_once_for_all_models(
+        self, deployed_app: TestClient, weapons_detector: WeaponsDetector, mocker: MockerFixture, pil_image: Image.Image
+    ) -> None:
+        clip = mock.Mock(spec=InferenceModel, loaded=True, decode_size=448)
+        clip.predict.return_value = [0.5, 0.25]
+        faces = mock.Mock(spec=InferenceModel, loaded=True, decode_size=1280)
+        faces.predict.return_value = []
+        models = {
+            ModelType.CLIP: clip,
+            ModelType.FACIAL_RECOGNITION: faces,
+            ModelType.WEAPONS_DETECTION: weapons_detector,
+        }
+        get = mocker.patch.object(
+            ModelCache, "get", autospec=True, side_effect=lambda _, name, model_type, **kwargs: models[model_type]
+        )
+        weapons = {"filePath": "", "imageWidth": 600, "imageHeight": 800, "weapons": []}
+        detect = mocker.patch.object(weapons_detector, "run_image_prediction_byte_stream", return_value=weapons)
+        decode = mocker.patch("app.main.decode_reduced", wraps=decode_reduced)
+        byte_image = BytesIO()
+        pil_image.save(byte_image, format="jpeg")
+
+        response = deployed_app.post(
+            "/predict/analyze",
+            data={
+                "models": json.dumps(
+                    {
+                        "clip": {"modelName": "ViT-B-32__openai"},
+                        "facial-recognition": {"modelName": "buffalo_l", "options": {"minScore": 0.5}},
+                        "weapons-detection": {"modelName": "yoloV8", "options": {"assetId": "asset", "minScore": 0.3}},
+                    }
+                )
+            },
+            files={"image": byte_image.getvalue()},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"clip": [0.5, 0.25], "facial-recognition": [], "weapons-detection": weapons}
+        decode.assert_called_once()
+        assert decode.call_args.kwargs == {"min_size": 1280}
+        assert get.call_count == 3
+        decoded = detect.call_args.args[0]
+        assert isinstance(decoded, DecodedImage)
+        assert detect.call_args.kwargs["confidence"] == 0.3
+        assert faces.predict.call_args == mock.call(decoded, options=FacialRecognitionOptions(minScore=0.5))
+        assert bytes(clip.predict.call_args.args[0]) == byte_image.getvalue()
+
+    def test_clip_decodes_like_predict(
+        self,
+        deployed_app: TestClient,
+        mocker: MockerFixture,
+        clip_visual_export: Path,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenCLIPEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenCLIPEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch("app.models.clip.Tokenizer.from_file", autospec=True)
+        encoder = OpenCLIPEncoder("ViT-B-32__openai", cache_dir=clip_visual_export, mode="vision")
+        encoder.providers = ["CPUExecutionProvider"]
+        mocker.patch.object(ModelCache, "get", autospec=True, return_value=encoder)
+        image = Image.fromarray(np.random.default_rng(6).integers(0, 256, (480, 640, 3), dtype=np.uint8))
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6  # rotated by 90 degrees, which cv2 applies and Pillow doesn't
+        byte_image = BytesIO()
+        image.save(byte_image, format="jpeg", exif=exif)
+
+        analyzed = deployed_app.post(
+            "/predict/analyze",
+            data={"models": json.dumps({"clip": {"modelName": "ViT-B-32__openai", "options": {"mode": "vision"}}})},
+            files={"image": byte_image.getvalue()},
+        )
+        predicted = deployed_app.post(
+            "/predict",
+            data={"modelName": "ViT-B-32__openai", "modelType": "clip", "options": json.dumps({"mode": "vision"})},
+            files={"image": byte_image.getvalue()},
+        )
+
+        assert analyzed.status_code == predicted.status_code == 200
+        assert analyzed.json() == {"clip": predicted.json()}
+
+    def test_rejects_invalid_input(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(deployed_detector, "run_image_prediction_byte_stream", return_value={})
+
+        def post(models: str, image: bytes = b"x") -> int:
+            response = deployed_app.post("/predict/analyze", data={"models": models}, files={"image": image})
+            return response.status_code
+
+        assert post("not json") == 400
+        assert post("{}") == 400
+        assert post(json.dumps({"unknown": {"modelName": "model"}})) == 400
+        assert post(json.dumps({"weapons-detection": {}})) == 400
+        assert post(json.dumps({"weapons-detection": {"modelName": "yoloV8"}})) == 400
+
+
+class TestResultCache:
+    def test_key_depends_on_content_and_options(self) -> None:
+        key = ResultCache.key(b"image", "weapons-detection", "model", "v1", {"minScore": 0.2, "mode": "image"})
+
+        assert key == ResultCache.key(b"image", "weapons-detection", "model", "v1", {"mode": "image", "minScore": 0.2})
+        assert key != ResultCache.key(b"image", "weapons-detection", "model", "v1", {"minScore": 0.3, "mode": "image"})
+        assert key != ResultCache.key(b"image", "weapons-detection", "model", "v2", {"minScore": 0.2, "mode": "image"})
+        assert key != ResultCache.key(b"other", "weapons-detection", "model", "v1", {"minScore": 0.2, "mode": "image"})
+
+    def test_stores_results_and_counts_hits(self, tmp_path: Path) -> None:
+        cache = ResultCache(tmp_path, 2**20)
+
+        assert cache.get("a" * 64, "clip") is None
+        cache.put("a" * 64, b"result")
+
+        assert cache.get("a" * 64, "clip") == b"result"
+        assert cache.get("b" * 64, "facial-recognition") is None
+        assert [path.name for path in tmp_path.rglob("*")] == ["aa", "a" * 64]
+        assert cache.stats() == {
+            "clip": {"hits": 1, "misses": 1, "hitRate": 0.5},
+            "facial-recognition": {"hits": 0, "misses": 1, "hitRate": 0.0},
+            "total": {"hits": 1, "misses": 2, "hitRate": pytest.approx(1 / 3)},
+        }
+
+    def test_is_shared_between_instances(self, tmp_path: Path) -> None:
+        ResultCache(tmp_path, 2**20).put("a" * 64, b"result")
+
+        assert ResultCache(tmp_path, 2**20).get("a" * 64) == b"result"
+
+    def test_evicts_least_recently_used(self, tmp_path: Path) -> None:
+        cache = ResultCache(tmp_path, 350)
+        keys = [c * 64 for c in "abcd"]
+        for i, key in enumerate(keys[:3]):
+            cache.put(key, bytes(100))
+            os.utime(cache._path(key), ns=(i * 10**9, i * 10**9))
+
+        cache.get(keys[0])
+        cache.put(keys[3], bytes(100))
+
+        assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+        assert cache.size == 300
+
+    def test_predict_endpoint_reuses_results(
+        self, deployed_app: TestClient, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        mocker.patch("app.main.result_cache", ResultCache(tmp_path, 2**20))
+        mock_model = mock.Mock(spec=InferenceModel, loaded=True, version="v1")
+        mock_model.predict.return_value = [0.5, 0.25]
+        mocker.patch.object(ModelCache, "get", autospec=True, return_value=mock_model)
+        data = {"modelName": "ViT-B-32__openai", "modelType": "clip", "text": "test search query"}
+
+        first = deployed_app.post("/predict", data=data)
+        second = deployed_app.post("/predict", data=data)
+        other = deployed_app.post("/predict", data={**data, "text": "another query"})
+        stats = deployed_app.get("/cache/results")
+
+        assert first.json() == second.json() == [0.5, 0.25]
+        assert mock_model.predict.call_count == 2
+        assert other.status_code == 200
+        assert stats.json()["clip"] == {"hits": 1, "misses": 2, "hitRate": pytest.approx(1 / 3)}
+
+    def test_weapons_without_detections_are_cached(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        mocker.patch("app.main.result_cache", ResultCache(tmp_path, 2**20))
+        result = {"filePath": "", "imageWidth": 1, "imageHeight": 1, "weapons": []}
+        run = mocker.patch.object(deployed_detector, "run_image_prediction_byte_stream", return_value=result)
+
+        for asset_id in ["a", "b"]:
+            options = json.dumps({"mode": "image", "assetId": asset_id, "minScore": 0.3})
+            response = deployed_app.post(
+                "/predict",
+                data={"modelName": "yoloV8", "modelType": "weapons-detection", "options": options},
+                files={"image": b"image"},
+            )
+            assert response.json() == result
+
+        run.assert_called_once()
+
+    def test_reused_weapons_result_gets_its_own_rendering(
+        self, weapons_detector: WeaponsDetector, tmp_path: Path
+    ) -> None:
+        (tmp_path / "a.jpg").write_bytes(b"rendered")
+        result = {"filePath": str(tmp_path / "a.jpg"), "imageWidth": 1, "imageHeight": 1, "weapons": []}
+
+        reused = weapons_detector.reuse_result(result, "b", tmp_path)  # type: ignore[arg-type]
+
+        assert reused is not None
+        assert reused["filePath"] == str(tmp_path / "b.jpg")
+        assert (tmp_path / "b.jpg").read_bytes() == b"rendered"
+        assert weapons_detector.reuse_result(result, None, tmp_path)["filePath"] == ""  # type: ignore[arg-type,index]
+        (tmp_path / "a.jpg").unlink()
+        assert weapons_detector.reuse_result(result, "c", tmp_path) is None  # type: ignore[arg-type]
+
+
+class TestCleanResults:
+    digest = bytes(32)
+
+    def no_detections(self) -> mock.Mock:
+        return mock.Mock(side_effect=lambda frames, confidence: [np.empty((0, 6), dtype=np.float32)] * len(frames))
+
+    def frames(self, detect: mock.Mock) -> int:
+        return sum(len(call.args[0]) for call in detect.call_args_list)
+
+    def test_clean_at_lower_threshold_counts(self, tmp_path: Path) -> None:
+        clean = CleanResults(tmp_path / "clean.db")
+        clean.add(self.digest, "v1", "image", 0.3, {"width": 1})
+        clean.add(self.digest, "v1", "image", 0.2, {"width": 1})
+        clean.add(self.digest, "v1", "image", 0.5, {"width": 1})
+
+        assert clean.get(self.digest, "v1", "image", 0.2) == {"width": 1}
+        assert clean.get(self.digest, "v1", "image", 0.9) == {"width": 1}
+        assert clean.get(self.digest, "v1", "image", 0.1) is None
+        assert clean.get(self.digest, "v2", "image", 0.5) is None
+        assert clean.get(self.digest, "v1", "video", 0.5) is None
+        assert clean.get(bytes([1] * 32), "v1", "image", 0.5) is None
+
+    def test_is_shared_between_instances(self, tmp_path: Path) -> None:
+        CleanResults(tmp_path / "clean.db").add(self.digest, "v1", "image", 0.2, {})
+
+        assert CleanResults(tmp_path / "clean.db").get(self.digest, "v1", "image", 0.2) == {}
+
+    def test_invalidates_in_bulk(self, tmp_path: Path) -> None:
+        clean = CleanResults(tmp_path / "clean.db")
+        for model in ["v1", "v2", "v3"]:
+            for i in range(3):
+                clean.add(bytes([i] * 32), model, "image", 0.2, {})
+
+        assert clean.invalidate(model="v1") == 3
+        assert clean.invalidate(keep="v3") == 3
+        assert clean.get(self.digest, "v3", "image", 0.2) == {}
+        assert clean.invalidate() == 3
+        assert clean.get(self.digest, "v3", "image", 0.2) is None
+
+    def test_unwritable_database_is_skipped(self, weapons_detector: WeaponsDetector, tmp_path: Path) -> None:
+        (tmp_path / "cache").write_bytes(b"")
+        weapons_detector.clean_results = CleanResults(tmp_path / "cache" / "clean.db")
+        weapons_detector.detect = self.no_detections()  # type: ignore[method-assign]
+        image = cv2.imencode(".jpg", np.zeros((16, 32, 3), dtype=np.uint8))[1].tobytes()
+
+        for _ in range(2):
+            result = weapons_detector.run_image_prediction_byte_stream(image, "a", tmp_path, 0.5)
+
+        assert result == {"filePath": "", "imageWidth": 32, "imageHeight": 16, "weapons": []}
+        assert weapons_detector.detect.call_count == 2
+
+    def test_corrupt_database_is_skipped(self, tmp_path: Path) -> None:
+        (tmp_path / "clean.db").write_bytes(b"not a database" * 100)
+        clean = CleanResults(tmp_path / "clean.db")
+
+        clean.add(self.digest, "v1", "image", 0.2, {})
+
+        assert clean.get(self.digest, "v1", "image", 0.2) is None
+
+    def test_skips_clean_images(self, weapons_detector: WeaponsDetector, tmp_path: Path) -> None:
+        weapons_detector.clean_results = CleanResults(tmp_path / "clean.db")
+        weapons_detector.detect = self.no_detections()  # type: ignore[method-assign]
+        image = cv2.imencode(".jpg", np.zeros((16, 32, 3), dtype=np.uint8))[1].tobytes()
+
+        first = weapons_detector.run_image_prediction_byte_stream(image, "a", tmp_path, 0.5)
+        second = weapons_detector.run_image_prediction_byte_stream(image, "b", tmp_path, 0.6)
+        lower = weapons_detector.run_image_prediction_byte_stream(image, "c", tmp_path, 0.4)
+
+        assert first == second == lower == {"filePath": "", "imageWidth": 32, "imageHeight": 16, "weapons": []}
+        assert weapons_detector.detect.call_count == 2
+
+    def test_does_not_record_detections(self, weapons_detector: WeaponsDetector, tmp_path: Path) -> None:
+        weapons_detector.clean_results = CleanResults(tmp_path / "clean.db")
+        boxes = np.array([[1.0, 2.0, 3.0, 4.0, 0.9, 0.0]], dtype=np.float32)
+        weapons_detector.detect = mock.Mock(return_value=[boxes])  # type: ignore[method-assign]
+        image = cv2.imencode(".jpg", np.zeros((16, 32, 3), dtype=np.uint8))[1].tobytes()
+
+        for _ in range(2):
+            weapons_detector.run_image_prediction_byte_stream(image, "a", tmp_path, 0.5, render=False)
+
+        assert weapons_detector.detect.call_count == 2
+
+    def test_skips_clean_videos(self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path) -> None:
+        weapons_detector.clean_results = CleanResults(tmp_path / "clean.db")
+        weapons_detector.detect = self.no_detections()  # type: ignore[method-assign]
+        data = video_file.read_bytes()
+        output_dir = tmp_path / "output"
+        output_dir.mkdir()
+
+        results = []
+        for _ in range(2):
+            video_file.write_bytes(data)
+            results.append(weapons_detector.run_prediction_video(video_file, output_dir, 0.5))
+        video_file.write_bytes(data)
+        timeline = weapons_detector.detect_video(video_file, 0.5)
+
+        assert results == [{"filePath": ""}, {"filePath": ""}]
+        assert not video_file.exists()
+        assert list(output_dir.iterdir()) == []
+        assert self.frames(weapons_detector.detect) == 20
+        assert timeline == {
+            "fps": 10,
+            "frameCount": 20,
+            "videoWidth": 64,
+            "videoHeight": 48,
+            "tracks": [],
+            "clips": [],
+        }
+
+    def test_video_sampling_is_part_of_the_key(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        weapons_detector.clean_results = CleanResults(tmp_path / "clean.db")
+        weapons_detector.detect = self.no_detections()  # type: ignore[method-assign]
+        data = video_file.read_bytes()
+
+        for sampler in [IntervalSampler(2), IntervalSampler(5), IntervalSampler(2)]:
+            video_file.write_bytes(data)
+            weapons_detector.detect_video(video_file, 0.5, sampler=sampler)
+
+        assert self.frames(weapons_detector.detect) == 10 + 4
+
+    def test_invalidate_endpoint(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        clean = CleanResults(tmp_path / "clean.db")
+        for model in ["old", "current"]:
+            clean.add(self.digest, model, "image", 0.2, {})
+        mocker.patch("app.main.clean_results", clean)
+        deployed_detector.version = "current"
+
+        stale = deployed_app.delete("/cache/clean", params={"stale": True})
+        remaining = deployed_app.delete("/cache/clean")
+
+        assert stale.json() == {"removed": 1}
+        assert remaining.json() == {"removed": 1}
+
+
+class TestSharedMedia:
+    @pytest.fixture
+    def media_folder(self, tmp_path: Path, video_file: Path, mocker: MockerFixture) -> Path:
+        folder = tmp_path / "upload"
+        (folder / "library").mkdir(parents=True)
+        video_file.rename(folder / "library" / "video.mp4")
+        mocker.patch.object(settings, "media_folders", f"/nonexistent, {folder}")
+        return folder
+
+    def test_reads_videos_in_media_folders_in_place(self, media_folder: Path, tmp_path: Path) -> None:
+        video = media_folder / "library" / "video.mp4"
+
+        assert resolve_video_path(str(video), tmp_path / "ml-results") == video
+
+    def test_uses_copy_outside_media_folders(self, media_folder: Path, tmp_path: Path) -> None:
+        outside = tmp_path / "video.mp4"
+        outside.write_bytes(b"video")
+        missing = media_folder / "library" / "missing.mp4"
+        escaped = media_folder / "library" / ".." / ".." / "video.mp4"
+        link = media_folder / "link.mp4"
+        link.symlink_to(outside)
+
+        for path in [outside, missing, escaped, link]:
+            assert resolve_video_path(str(path), tmp_path / "ml-results") == tmp_path / "ml-results" / path.name
+        assert resolve_video_path("video.mp4", tmp_path / "ml-results") == tmp_path / "ml-results" / "video.mp4"
+
+    def test_keeps_originals(self, weapons_detector: WeaponsDetector, media_folder: Path, tmp_path: Path) -> None:
+        weapons_detector.detect = mock.Mock(  # type: ignore[method-assign]
+            side_effect=lambda frames, confidence: [np.empty((0, 6), dtype=np.float32)] * len(frames)
+        )
+        video = media_folder / "library" / "video.mp4"
+        content = video.read_bytes()
+        output_dir = tmp_path / "output"
+        output_dir.mkdir()
+
+        weapons_detector.run_prediction_video(video, output_dir, 0.5)
+        weapons_detector.detect_video(video, 0.5)
+
+        assert video.read_bytes() == content
+        assert list(output_dir.iterdir()) == []
+
+    def test_removes_copies(self, weapons_detector: WeaponsDetector, media_folder: Path, video_file: Path) -> None:
+        weapons_detector.detect = mock.Mock(  # type: ignore[method-assign]
+            side_effect=lambda frames, confidence: [np.empty((0, 6), dtype=np.float32)] * len(frames)
+        )
+        shutil.copyfile(media_folder / "library" / "video.mp4", video_file)
+
+        weapons_detector.detect_video(video_file, 0.5)
+
+        assert not video_file.exists()
+
+    def test_endpoint_reads_in_place(
+        self,
+        deployed_app: TestClient,
+        deployed_detector: WeaponsDetector,
+        media_folder: Path,
+        mocker: MockerFixture,
+    ) -> None:
+        timeline = {"fps": 10.0, "frameCount": 20, "videoWidth": 64, "videoHeight": 48, "tracks": [], "clips": []}
+        detect_video = mocker.patch.object(deployed_detector, "detect_video", return_value=timeline)
+
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "videoFilePath": str(media_folder / "library" / "video.mp4"),
+                "options": json.dumps({"mode": "video", "output": "timeline"}),
+            },
+        )
+
+        assert response.status_code == 200
+        assert detect_video.call_args.args == (media_folder / "library" / "video.mp4",)
+
+
+class TestImageBatch:
+    def encode(self, width: int, height: int) -> bytes:
+        return cv2.imencode(".jpg", np.zeros((height, width, 3), dtype=np.uint8))[1].tobytes()
+
+    def test_runs_fixed_size_batches(self, weapons_detector: WeaponsDetector, tmp_path: Path) -> None:
+        images = [np.full((8, 8, 3), i, dtype=np.uint8) for i in range(10)]
+        boxes = np.array([[1.0, 2.0, 3.0, 4.0, 0.9, 0.0]], dtype=np.float32)
+        detect = mock.Mock(side_effect=lambda frames, confidence: [boxes] * len(frames))
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+
+        results = weapons_detector.run_image_batch(
+            images, [f"asset{i}" for i in range(10)], tmp_path, 0.5, render=False, batch_size=4
+        )
+
+        assert [len(call.args[0]) for call in detect.call_args_list] == [4, 4, 2]
+        assert list(results) == [f"asset{i}" for i in range(10)]
+        assert all(len(result["weapons"]) == 1 for result in results.values())
+
+    def test_batch_endpoint(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        run_image_batch = mocker.patch.object(deployed_detector, "run_image_batch", return_value={})
+
+        response = deployed_app.post(
+            "/predict/weapons",
+            data={"assetIds": ["a", "b"], "options": json.dumps({"minScore": 0.3, "render": False})},
+            files=[("images", self.encode(32, 16)), ("images", self.encode(16, 32))],
+        )
+
+        assert response.status_code == 200
+        images = run_image_batch.call_args.args[0]
+        assert [image.image.shape for image in images] == [(16, 32, 3), (32, 16, 3)]
+        assert run_image_batch.call_args.kwargs == {
+            "asset_ids": ["a", "b"],
+            "save_directory": Path("/ml-results/"),
+            "confidence": 0.3,
+            "render": False,
+        }
+
+    def test_batch_endpoint_accepts_tar_archive(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        run_image_batch = mocker.patch.object(deployed_detector, "run_image_batch", return_value={})
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for asset_id, width in [("a", 32), ("b", 16)]:
+                data = self.encode(width, 16)
+                info = tarfile.TarInfo(f"{asset_id}.jpg")
+                info.size = len(data)
+                tar.addfile(info, BytesIO(data))
+
+        response = deployed_app.post("/predict/weapons", files={"archive": archive.getvalue()})
+
+        assert response.status_code == 200
+        assert [image.image.shape for image in run_image_batch.call_args.args[0]] == [(16, 32, 3), (16, 16, 3)]
+        assert run_image_batch.call_args.kwargs["asset_ids"] == ["a", "b"]
+
+    def test_batch_endpoint_rejects_invalid_input(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(deployed_detector, "run_image_batch", return_value={})
+
+        mismatched = deployed_app.post("/predict/weapons", data={"assetIds": ["a", "b"]}, files={"images": b"x"})
+        undecodable = deployed_app.post("/predict/weapons", data={"assetIds": ["a"]}, files={"images": b"x"})
+        empty = deployed_app.post("/predict/weapons", data={"options": "{}"})
+
+        assert mismatched.status_code == 400
+        assert undecodable.status_code == 400
+        assert undecodable.json()["detail"] == "Could not decode image for asset 'a'"
+        assert empty.status_code == 400
+
+
+class TestFrameSampling:
+    frame = np.zeros((48, 64, 3), dtype=np.uint8)
+
+    def test_interval_sampler(self) -> None:
+        sampler = IntervalSampler(3)
+        sampler.start(30.0)
+
+        sampled = [i for i in range(10) if sampler.should_sample(i, self.frame)]
+
+        assert sampled == [0, 3, 6, 9]
+
+    def test_interval_sampler_is_relative_to_first_frame(self) -> None:
+        sampler = IntervalSampler(3)
+        sampler.start(30.0)
+
+        sampled = [i for i in range(5, 12) if sampler.should_sample(i, self.frame)]
+
+        assert sampled == [5, 8, 11]
+
+    def test_fps_sampler(self) -> None:
+        sampler = FpsSampler(2.0)
+        sampler.start(30.0)
+
+        sampled = [i for i in range(60) if sampler.should_sample(i, self.frame)]
+
+        assert sampled == [0, 15, 30, 45]
+
+    def test_scene_change_sampler(self) -> None:
+        sampler = SceneChangeSampler(threshold=0.1, max_interval=100)
+        sampler.start(30.0)
+        frames = [self.frame] * 5 + [np.full_like(self.frame, 255)] * 5
+
+        sampled = [i for i, frame in enumerate(frames) if sampler.should_sample(i, frame)]
+
+        assert sampled == [0, 5]
+
+    def test_scene_change_sampler_max_interval(self) -> None:
+        sampler = SceneChangeSampler(threshold=0.1, max_interval=4)
+        sampler.start(30.0)
+
+        sampled = [i for i in range(10) if sampler.should_sample(i, self.frame)]
+
+        assert sampled == [0, 4, 8]
+
+    def test_get_sampler(self) -> None:
+        assert isinstance(get_sampler({"strategy": "interval", "interval": 2}), IntervalSampler)
+        assert isinstance(get_sampler({"strategy": "fps", "fps": 1}), FpsSampler)
+        assert isinstance(get_sampler({"strategy": "scene"}), SceneChangeSampler)
+        with pytest.raises(ValueError):
+            get_sampler({"strategy": "invalid"})
+
+    def test_skipped_frames_reuse_last_boxes(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        box = np.array([[1.0, 2.0, 30.0, 40.0, 0.9, 0.0]], dtype=np.float32)
+        detect = mock.Mock(side_effect=lambda frames, confidence: [box] * len(frames))
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+        on_frame = mock.Mock()
+
+        detection_made = weapons_detector.predict_video(
+            video_file, tmp_path / "out.mp4", 0.5, on_frame=on_frame, sampler=IntervalSampler(5)
+        )
+
+        assert detection_made
+        assert sum(len(call.args[0]) for call in detect.call_args_list) == 4
+        assert on_frame.call_count == 20
+        for call in on_frame.call_args_list:
+            assert np.array_equal(call.args[2], box)
+
+
+def detect_in(frame_indices: set[int], box: NDArray[np.float32]) -> mock.Mock:
+    """Mocks `WeaponsDetector.detect`, finding `box` in the given frames in the order frames are passed to it."""
+
+    seen = itertools.count()
+    no_boxes = np.empty((0, 6), dtype=np.float32)
+    return mock.Mock(
+        side_effect=lambda frames, confidence: [box if next(seen) in frame_indices else no_boxes for _ in frames]
+    )
+
+
+class TestVideoBatching:
+    def moving_box(self, index: int) -> NDArray[np.float32]:
+        return np.array([[index, index, index + 20, index + 20, 0.9, 0]], dtype=np.float32)
+
+    def test_sends_frames_in_batches(self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path) -> None:
+        detect = detect_in(set(), np.empty((0, 6), dtype=np.float32))
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+
+        weapons_detector.predict_video(video_file, tmp_path / "out.mp4", 0.5, batch_size=8)
+
+        assert [len(call.args[0]) for call in detect.call_args_list] == [8, 8, 4]
+
+    @pytest.mark.parametrize("batch_size", [4, 7, 16])
+    def test_batched_results_match_unbatched(
+        self, batch_size: int, mocker: MockerFixture, video_file: Path, tmp_path: Path
+    ) -> None:
+        detector = WeaponsDetector("yoloV8", cache_dir=tmp_path / "model")
+        detector.names = {0: "weapon"}
+
+        def run(batch_size: int) -> list[NDArray[np.float32]]:
+            seen = itertools.count()
+            detector.detect = mock.Mock(  # type: ignore[method-assign]
+                side_effect=lambda frames, confidence: [self.moving_box(next(seen)) for _ in frames]
+            )
+            boxes: list[NDArray[np.float32]] = []
+            input_path = tmp_path / f"input_{batch_size}.mp4"
+            input_path.write_bytes(video_file.read_bytes())
+            detector.predict_video(
+                input_path,
+                tmp_path / f"out_{batch_size}.mp4",
+                0.5,
+                on_frame=lambda index, total, frame_boxes: boxes.append(frame_boxes),
+                batch_size=batch_size,
+            )
+            return boxes
+
+        unbatched = run(1)
+        batched = run(batch_size)
+
+        assert len(unbatched) == len(batched) == 20
+        assert all(boxes.shape == (1, 7) for boxes in unbatched)
+        for expected, actual in zip(unbatched, batched):
+            assert np.array_equal(expected, actual)
+
+
+class TestVideoPipeline:
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    no_boxes = np.empty((0, 6), dtype=np.float32)
+
+    def endless_read(self) -> list[NDArray[np.uint8]]:
+        return [self.frame]
+
+    def test_passes_frames_through_in_order(self) -> None:
+        frames = iter([[np.full((4, 4, 3), i, dtype=np.uint8)] for i in range(10)])
+        written: list[int] = []
+
+        with VideoPipeline(lambda: next(frames, []), lambda frame, boxes: written.append(int(frame[0, 0, 0]))) as pipe:
+            for batch in pipe:
+                pipe.put(batch, [self.no_boxes] * len(batch))
+
+        assert written == list(range(10))
+
+    def test_bounds_frames_in_flight(self) -> None:
+        read = itertools.count(1)
+        frames = iter(range(100))
+        written = 0
+        in_flight: list[int] = []
+
+        def slow_write(frame: NDArray[np.uint8], boxes: NDArray[np.float32]) -> None:
+            nonlocal written
+            time.sleep(0.001)
+            written += 1
+
+        def read_frame() -> list[NDArray[np.uint8]]:
+            if next(frames, None) is None:
+                return []
+            in_flight.append(next(read) - written)
+            return [self.frame]
+
+        with VideoPipeline(read_frame, slow_write, queue_size=2) as pipe:
+            for batch in pipe:
+                pipe.put(batch, [self.no_boxes])
+
+        assert written == 100
+        # two full queues, plus one batch held by each stage
+        assert max(in_flight) <= 2 * 2 + 3
+
+    def test_raises_decode_error(self) -> None:
+        def read() -> list[NDArray[np.uint8]]:
+            raise ValueError("bad frame")
+
+        with pytest.raises(ValueError, match="bad frame"):
+            with VideoPipeline(read, mock.Mock()) as pipe:
+                for batch in pipe:
+                    pipe.put(batch, [self.no_boxes])
+
+        assert not any(thread.is_alive() for thread in pipe._threads)
+
+    def test_raises_encode_error_and_stops_decoding(self) -> None:
+        write = mock.Mock(side_effect=OSError("disk full"))
+
+        with pytest.raises(OSError, match="disk full"):
+            with VideoPipeline(self.endless_read, write) as pipe:
+                for batch in pipe:
+                    pipe.put(batch, [self.no_boxes])
+
+        assert write.call_count == 1
+        assert not any(thread.is_alive() for thread in pipe._threads)
+
+    def test_stops_stages_on_inference_error(self) -> None:
+        write = mock.Mock()
+
+        with pytest.raises(RuntimeError):
+            with VideoPipeline(self.endless_read, write) as pipe:
+                for _ in pipe:
+                    raise RuntimeError
+
+        write.assert_not_called()
+        assert not any(thread.is_alive() for thread in pipe._threads)
+
+    def test_reports_stage_timings(self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path) -> None:
+        def slow_detect(frames: list[NDArray[np.uint8]], confidence: float) -> list[NDArray[np.float32]]:
+            time.sleep(0.01 * len(frames))
+            return [self.no_boxes] * len(frames)
+
+        weapons_detector.detect = slow_detect  # type: ignore[method-assign]
+        timings: dict[str, StageTimings] = {}
+
+        weapons_detector.predict_video(video_file, tmp_path / "out.mp4", 0.5, timings=timings)
+
+        assert set(timings) == {"decode", "infer", "encode"}
+        assert timings["infer"].busy >= 0.2
+        # the other stages spend most of their time waiting on inference
+        assert timings["encode"].waiting > timings["encode"].busy
+
+    def test_removes_partial_output_on_error(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        weapons_detector.plot = mock.Mock(side_effect=ValueError)  # type: ignore[method-assign]
+        weapons_detector.detect = detect_in(set(), self.no_boxes)  # type: ignore[method-assign]
+
+        with pytest.raises(ValueError):
+            weapons_detector.predict_video(video_file, tmp_path / "out.mp4", 0.5)
+
+        assert not (tmp_path / ".out.mp4").exists()
+        assert not (tmp_path / "out.mp4").exists()
+        assert video_file.exists()
+
+
+class TestVideoTimeline:
+    def detect_at(self, frame_indices: set[int], score: float = 0.8) -> mock.Mock:
+        """Mocks `WeaponsDetector.detect`, finding a tracked weapon in the given frames of the `video_file` fixture."""
+
+        def detect(frames: list[NDArray[np.uint8]], confidence: float) -> list[NDArray[np.float32]]:
+            boxes = []
+            for frame in frames:
+                # each frame of the fixture is filled with 10 times its index
+                index = round(float(frame.mean()) / 10)
+                box = [[index, 2.0, index + 20.0, 30.0, 3.0, score + index / 100, 0.0]]
+                boxes.append(np.array(box if index in frame_indices else [], dtype=np.float32).reshape(-1, 7))
+            return boxes
+
+        return mock.Mock(side_effect=detect)
+
+    def test_returns_tracks_without_encoding(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        weapons_detector.detect = self.detect_at({5, 6, 7, 8, 9})  # type: ignore[method-assign]
+        plot = mock.Mock()
+        weapons_detector.plot = plot  # type: ignore[method-assign]
+
+        timeline = weapons_detector.detect_video(video_file, 0.5, sampler=IntervalSampler(2))
+
+        plot.assert_not_called()
+        assert not video_file.exists()
+        assert list(tmp_path.iterdir()) == []
+        assert timeline["fps"] == 10
+        assert timeline["frameCount"] == 20
+        assert (timeline["videoWidth"], timeline["videoHeight"]) == (64, 48)
+        assert timeline["clips"] == []
+        assert len(timeline["tracks"]) == 1
+        track = timeline["tracks"][0]
+        assert track["trackId"] == 3
+        assert track["className"] == "weapon"
+        assert (track["firstFrame"], track["lastFrame"]) == (6, 8)
+        assert (track["startTime"], track["endTime"]) == (0.6, 0.8)
+        assert track["maxScore"] == pytest.approx(0.88)
+        assert [box["frame"] for box in track["boxes"]] == [6, 8]
+        assert track["boxes"][0]["boundingBox"] == {"x1": 6, "y1": 2, "x2": 26, "y2": 30}
+
+    def test_writes_clips_around_detections(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        weapons_detector.detect = self.detect_at({5, 15})  # type: ignore[method-assign]
+        clip_dir = tmp_path / "clips"
+        clip_dir.mkdir()
+
+        timeline = weapons_detector.detect_video(video_file, 0.5, clip_directory=clip_dir, clip_padding=0.2)
+
+        assert timeline["clips"] == [str(clip_dir / "detected_video_3.mp4"), str(clip_dir / "detected_video_13.mp4")]
+        assert sorted(path.name for path in clip_dir.iterdir()) == ["detected_video_13.mp4", "detected_video_3.mp4"]
+        for clip in timeline["clips"]:
+            capture = cv2.VideoCapture(clip)
+            assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 5
+            capture.release()
+
+    @pytest.mark.parametrize(
+        "frames, clips",
+        [
+            # 4 frames between the detections, which the 2 frames of padding after one and before the other cover
+            ({5, 10}, {"detected_video_3.mp4": 10}),
+            ({5, 11}, {"detected_video_3.mp4": 5, "detected_video_9.mp4": 5}),
+        ],
+    )
+    def test_merges_clips_whose_padding_touches(
+        self,
+        weapons_detector: WeaponsDetector,
+        video_file: Path,
+        tmp_path: Path,
+        frames: set[int],
+        clips: dict[str, int],
+    ) -> None:
+        weapons_detector.detect = self.detect_at(frames)  # type: ignore[method-assign]
+        clip_dir = tmp_path / "clips"
+        clip_dir.mkdir()
+
+        timeline = weapons_detector.detect_video(video_file, 0.5, clip_directory=clip_dir, clip_padding=0.2)
+
+        assert timeline["clips"] == [str(clip_dir / name) for name in clips]
+        for name, frame_count in clips.items():
+            capture = cv2.VideoCapture((clip_dir / name).as_posix())
+            assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == frame_count
+            capture.release()
+
+    def test_discards_clips_on_error(self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path) -> None:
+        detections = self.detect_at({5})
+
+        def fail_later(frames: list[NDArray[np.uint8]], confidence: float) -> list[NDArray[np.float32]]:
+            if detections.call_count >= 2:
+                raise ValueError
+            result: list[NDArray[np.float32]] = detections(frames, confidence)
+            return result
+
+        weapons_detector.detect = fail_later  # type: ignore[method-assign]
+        clip_dir = tmp_path / "clips"
+        clip_dir.mkdir()
+
+        with pytest.raises(ValueError):
+            weapons_detector.detect_video(video_file, 0.5, clip_directory=clip_dir, batch_size=8)
+
+        assert list(clip_dir.iterdir()) == []
+
+    def test_timeline_endpoint(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        timeline = {"fps": 10.0, "frameCount": 20, "videoWidth": 64, "videoHeight": 48, "tracks": [], "clips": []}
+        detect_video = mocker.patch.object(deployed_detector, "detect_video", return_value=timeline)
+        run_prediction_video = mocker.patch.object(deployed_detector, "run_prediction_video")
+
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "videoFilePath": "/some/video.mp4",
+                "options": json.dumps({"mode": "video", "output": "timeline", "minScore": 0.4, "clips": True}),
+            },
+        )
+
+        assert response.status_code == 200
+        assert response.json() == timeline
+        run_prediction_video.assert_not_called()
+        assert detect_video.call_args.args == (Path("/ml-results/video.mp4"),)
+        assert detect_video.call_args.kwargs["confidence"] == 0.4
+        assert detect_video.call_args.kwargs["clip_directory"] == Path("/ml-results/")
+
+    def test_timeline_endpoint_rejects_unknown_output(self, deployed_app: TestClient) -> None:
+        response = deployed_app.post(
+            "/predict",
+            data={
+                "modelName": "yoloV8",
+                "modelType": "weapons-detection",
+                "videoFilePath": "/some/video.mp4",
+                "options": json.dumps({"mode": "video", "output": "gif"}),
+            },
+        )
+
+        assert response.status_code == 400
+
+
+class TestVideoJobs:
+    box = np.array([[1.0, 2.0, 30.0, 40.0, 0.9, 0.0]], dtype=np.float32)
+
+    def test_job_reports_progress_and_result(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        detect = detect_in({5}, self.box)
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+        queue = VideoJobQueue(tmp_path / "jobs")
+
+        job = queue.submit(weapons_detector, video_file, tmp_path, 0.5)
+        finished = queue.get(job.id)
+
+        assert finished is not None
+        assert finished.status == JobStatus.COMPLETED
+        assert finished.framesProcessed == finished.framesTotal == 20
+        assert finished.eta == 0.0
+        assert finished.filePath == str(tmp_path / "detected_video.mp4")
+        assert Path(finished.filePath).is_file()
+        assert not video_file.exists()
+        assert sum(len(call.args[0]) for call in detect.call_args_list) == 20
+        assert not queue.busy
+
+    def test_job_resumes_from_checkpoint(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        detect = detect_in(set(), self.box)
+        weapons_detector.detect = detect  # type: ignore[method-assign]
+        jobs_dir = tmp_path / "jobs"
+        jobs_dir.mkdir()
+        job = VideoJob(
+            id="0" * 32,
+            modelName="yoloV8",
+            videoFilePath=str(video_file),
+            saveDirectory=str(tmp_path),
+            minScore=0.5,
+            status=JobStatus.RUNNING,
+            framesProcessed=10,
+        )
+        (jobs_dir / f"{job.id}.json").write_text(job.json())
+        (jobs_dir / f"{job.id}.checkpoint.jsonl").write_text(
+            json.dumps({"frame": 3, "boxes": self.box.tolist()}) + "\n" + '{"frame": 12, "bo'
+        )
+        queue = VideoJobQueue(jobs_dir)
+
+        resumed = queue.resume({"yoloV8": weapons_detector})
+        finished = queue.get(job.id)
+
+        assert [resumed_job.id for resumed_job in resumed] == [job.id]
+        assert finished is not None
+        assert finished.status == JobStatus.COMPLETED
+        assert finished.framesProcessed == 20
+        assert sum(len(call.args[0]) for call in detect.call_args_list) == 10
+        # the only detection comes from the checkpoint, so the output is kept
+        assert finished.filePath == str(tmp_path / "detected_video.mp4")
+        assert not (jobs_dir / f"{job.id}.checkpoint.jsonl").exists()
+
+    def test_job_is_marked_failed_on_error(
+        self, weapons_detector: WeaponsDetector, video_file: Path, tmp_path: Path
+    ) -> None:
+        weapons_detector.detect = mock.Mock(side_effect=RuntimeError("bad frame"))  # type: ignore[method-assign]
+        queue = VideoJobQueue(tmp_path / "jobs")
+
+        job = queue.submit(weapons_detector, video_file, tmp_path, 0.5)
+        failed = queue.get(job.id)
+
+        assert failed is not None
+        assert failed.status == JobStatus.FAILED
+        assert failed.error == "bad frame"
+
+    def test_job_endpoints(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        run_prediction_video = mocker.patch.object(
+            deployed_detector, "run_prediction_video", return_value={"filePath": "/ml-results/detected_video.mp4"}
+        )
+        mocker.patch("app.main.video_jobs", VideoJobQueue(tmp_path))
+
+        submitted = deployed_app.post(
+            "/jobs/video", data={"videoFilePath": "/some/video.mp4", "options": json.dumps({"minScore": 0.5})}
+        )
+        job_id = submitted.json()["id"]
+        status = deployed_app.get(f"/jobs/video/{job_id}")
+        result = deployed_app.get(f"/jobs/video/{job_id}/result")
+
+        assert submitted.status_code == 200
+        assert status.json()["status"] == "completed"
+        assert status.json()["modelName"] == "yoloV8"
+        assert result.json() == {"filePath": "/ml-results/detected_video.mp4"}
+        args = run_prediction_video.call_args
+        assert args.args == (Path("/ml-results/video.mp4"), Path("/ml-results/"), 0.5)
+        assert deployed_app.get("/jobs/video/unknown").status_code == 404
+
+    def test_job_result_conflicts_until_completed(
+        self, deployed_app: TestClient, deployed_detector: WeaponsDetector, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        queue = VideoJobQueue(tmp_path, executor=mock.Mock())
+        mocker.patch("app.main.video_jobs", queue)
+
+        job_id = deployed_app.post("/jobs/video", data={"videoFilePath": "/some/video.mp4"}).json()["id"]
+
+        assert deployed_app.get(f"/jobs/video/{job_id}").json()["status"] == "queued"
+        assert deployed_app.get(f"/jobs/video/{job_id}/result").status_code == 409
+
+
+class TestConcurrency:
+    def test_video_detection_does_not_block_other_requests(
+        self, deployed_app: TestClient, weapons_detector: WeaponsDetector, mocker: MockerFixture
+    ) -> None:
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_video(*args: Any, **kwargs: Any) -> dict[str, str]:
+            started.set()
+            release.wait(10)
+            return {"filePath": ""}
+
+        mocker.patch.object(weapons_detector, "run_prediction_video", side_effect=slow_video)
+        mock_model = mock.Mock(spec=InferenceModel, loaded=True)
+        mock_model.predict.return_value = [0.0]
+        models = {ModelType.CLIP: mock_model, ModelType.WEAPONS_DETECTION: weapons_detector}
+        mocker.patch.object(
+            ModelCache, "get", autospec=True, side_effect=lambda _, name, model_type, **kwargs: models[model_type]
+        )
+
+        clip_data = {"modelName": "ViT-B-32__openai", "modelType": "clip", "text": "test search query"}
+        video_data = {
+            "modelName": "yoloV8",
+            "modelType": "weapons-detection",
+            "videoFilePath": "/ml-results/test.mp4",
+            "options": json.dumps({"mode": "video"}),
+        }
+
+        def timed(method: Callable[..., Any], *args: Any, **kwargs: Any) -> float:
+            start = time.perf_counter()
+            assert method(*args, **kwargs).status_code == 200
+            return time.perf_counter() - start
+
+        idle_latency = max(timed(deployed_app.get, "/ping"), timed(deployed_app.post, "/predict", data=clip_data))
+
+        with ThreadPoolExecutor(2) as pool:
+            video = pool.submit(deployed_app.post, "/predict", data=video_data)
+            try:
+                assert started.wait(5)
+                ping = pool.submit(timed, deployed_app.get, "/ping")
+                clip = pool.submit(timed, deployed_app.post, "/predict", data=clip_data)
+                busy_latency = max(ping.result(timeout=5), clip.result(timeout=5))
+                assert not video.done()
+            finally:
+                release.set()
+
+        assert video.result().status_code == 200
+        assert busy_latency < idle_latency + 0.5
+
 
 @pytest.mark.skipif(
     not settings.test_full,
@@ -0,0 +1,77 @@
+"""
+Compares the upload size and decoding CPU time per asset of sending an image to each model separately against
+the decode-once `/predict/analyze` endpoint.
+
+Separate requests decode the image once per model: CLIP with Pillow, facial recognition and weapons detection with
+cv2, each at the reduced size it needs. The shared path decodes once with cv2 at the larger size of the last two, while
+CLIP still decodes with Pillow so its embeddings match those of `/predict`. Model inference isn't included, since it's
+the same either way.
+
+Usage: python -m benchmarks.analyze_decode [--sizes 1920x1080 4032x3024 8000x6000] [--iterations 10]
+"""
+
+import time
+from argparse import ArgumentParser
+from io import BytesIO
+from typing import Callable
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.models.transforms import decode_reduced
+
+CLIP_SIZE = 448  # twice the input size of most CLIP models
+FACE_SIZE = 1280
+WEAPONS_SIZE = 640
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    rng = np.random.default_rng(0)
+    coarse = rng.integers(0, 256, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def decode_clip(data: bytes) -> None:
+    image = Image.open(BytesIO(data))
+    image.draft("RGB", (CLIP_SIZE, CLIP_SIZE))
+    image.load()
+
+
+def separate(data: bytes) -> None:
+    decode_clip(data)
+    decode_reduced(data, FACE_SIZE)
+    decode_reduced(data, WEAPONS_SIZE)
+
+
+def shared(data: bytes) -> None:
+    decode_clip(data)
+    decode_reduced(data, max(FACE_SIZE, WEAPONS_SIZE))
+
+
+def cpu_time(func: Callable[[bytes], None], data: bytes, iterations: int) -> float:
+    func(data)  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        func(data)
+    return (time.process_time() - start) / iterations * 1000
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=["1920x1080", "4032x3024", "8000x6000"])
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'image':<10} {'mode':<9} {'uploaded (MB)':>14} {'decode cpu (ms)':>16}")
+    for size in args.sizes:
+        width, height = (int(dim) for dim in size.split("x"))
+        data = make_jpeg(width, height)
+        for mode, func, uploads in [("separate", separate, 3), ("shared", shared, 1)]:
+            elapsed = cpu_time(func, data, args.iterations)
+            print(f"{size:<10} {mode:<9} {uploads * len(data) / 2**20:>14.2f} {elapsed:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
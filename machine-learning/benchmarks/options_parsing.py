@@ -0,0 +1,78 @@
+"""
+Compares the per-request overhead of parsing the `options` of a request:
+
+- `eval`: `orjson.loads` plus the `eval` the weapons branch of `/predict` used to read `minScore` with.
+- `dict`: `orjson.loads` and reading each option with `dict.get` and a default.
+- `typed`: `parse_options`, which validates the options into a typed model once and then returns it from its cache.
+- `typed, uncached`: the same without the cache, such as for the unique `assetId` of every weapons detection request.
+
+The options are the ones the server sends for each model type.
+
+Usage: python -m benchmarks.options_parsing [--iterations 100000]
+"""
+
+import time
+from argparse import ArgumentParser
+from typing import Any, Callable
+from uuid import uuid4
+
+import orjson
+
+from app.schemas import OPTIONS, ModelType, parse_options
+
+REQUESTS = {
+    ModelType.CLIP: '{"mode": "vision"}',
+    ModelType.FACIAL_RECOGNITION: '{"minScore": 0.7, "maxDistance": 0.6, "minFaces": 3}',
+    ModelType.WEAPONS_DETECTION: '{"mode": "image", "minScore": 0.5, "assetId": "%s"}',
+}
+DEFAULTS: dict[ModelType, dict[str, Any]] = {
+    ModelType.CLIP: {"mode": None},
+    ModelType.FACIAL_RECOGNITION: {"minScore": None},
+    ModelType.WEAPONS_DETECTION: {"mode": None, "minScore": 0.2, "assetId": None, "render": True},
+}
+
+
+def with_eval(model_type: ModelType, options: str) -> Any:
+    kwargs = orjson.loads(options)
+    eval(options).get("minScore", 0.2)
+    return [kwargs.get(name, default) for name, default in DEFAULTS[model_type].items()]
+
+
+def with_dict(model_type: ModelType, options: str) -> Any:
+    kwargs = orjson.loads(options)
+    return [kwargs.get(name, default) for name, default in DEFAULTS[model_type].items()]
+
+
+def typed(model_type: ModelType, options: str) -> Any:
+    return parse_options(model_type, options)
+
+
+def typed_uncached(model_type: ModelType, options: str) -> Any:
+    return OPTIONS[model_type].parse_obj(orjson.loads(options))
+
+
+def measure(func: Callable[[ModelType, str], Any], model_type: ModelType, options: list[str]) -> float:
+    func(model_type, options[0])  # warm up
+    start = time.perf_counter()
+    for item in options:
+        func(model_type, item)
+    return (time.perf_counter() - start) / len(options) * 1e6
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    modes = [("eval", with_eval), ("dict", with_dict), ("typed", typed), ("typed, uncached", typed_uncached)]
+    print(f"{'model type':<19} {'options':<17} {'us/request':>10}")
+    for model_type, template in REQUESTS.items():
+        # weapons detection requests differ in their asset ID, so each one is new to the cache
+        unique = "%s" in template
+        options = [template % uuid4() if unique else template for _ in range(args.iterations)]
+        for mode, func in modes:
+            print(f"{model_type:<19} {mode:<17} {measure(func, model_type, options):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Compares the CPU latency and accuracy of FP32 models against their INT8 copies (`MACHINE_LEARNING_QUANTIZED`):
+
+- `clip`: a CLIP image encoder, quantized without calibration data. Accuracy is the lowest cosine similarity between
+  the two embeddings of a frame, and how often the INT8 embedding of a frame is closest to the FP32 embedding of the
+  same frame among those of all frames (recall@1).
+- `weapons`: the weapons detector, with its convolutions quantized and calibrated on other frames of the clip.
+  Accuracy is the share of FP32 detections the INT8 model finds too, with the same class and an IoU of at least 0.5.
+
+Models are quantized by `quantize` in `export/models/optimize.py`, unless the CLIP folder already has a
+`model_int8.onnx`. By default, randomly initialized models the size of ViT-B-32 and YOLOv8n are used. Their latency is
+representative, but their accuracy isn't, since the activations of random weights aren't distributed like those of
+trained ones.
+Pass a CLIP model folder from the model cache and the weapons detection checkpoint to measure accuracy.
+
+Usage: python -m benchmarks.quantization [--clip-dir /cache/clip/ViT-B-32__openai] [--weapons-path model.pt]
+"""
+
+import os
+import shutil
+import statistics
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable
+from unittest import mock
+
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+import torch
+from numpy.typing import NDArray
+from onnxruntime.quantization import CalibrationDataReader
+from ultralytics import YOLO
+
+from app.config import settings
+from app.models.transforms import letterbox
+from app.models.weapons_detector import WeaponsDetector
+from export.models.optimize import quantize
+
+from .util import iou, make_clip
+from .yolo_runtime import export_detector
+
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+MODEL_FILES = {"fp32": "model.onnx", "int8": "model_int8.onnx"}
+HEADER = f"{'model':<8} {'batch size':>10} {'type':<5} {'ms/image':>9}"
+
+
+class RandomVisualEncoder(torch.nn.Module):
+    """A randomly initialized image encoder with the shape of the one of ViT-B-32."""
+
+    def __init__(self, width: int = 768, layers: int = 12, heads: int = 12, embed_dim: int = 512) -> None:
+        super().__init__()
+        self.patches = torch.nn.Conv2d(3, width, kernel_size=32, stride=32)
+        self.transformer = torch.nn.Sequential(
+            *[torch.nn.TransformerEncoderLayer(width, heads, width * 4, batch_first=True) for _ in range(layers)]
+        )
+        self.proj = torch.nn.Linear(width, embed_dim)
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        tokens = self.patches(image).flatten(2).transpose(1, 2)
+        embedding: torch.Tensor = self.proj(self.transformer(tokens).mean(1))
+        return embedding
+
+
+class ListCalibrationReader(CalibrationDataReader):  # type: ignore[misc]
+    def __init__(self, inputs: list[dict[str, NDArray[np.float32]]]) -> None:
+        self.inputs = iter(inputs)
+
+    def get_next(self) -> dict[str, NDArray[np.float32]] | None:
+        return next(self.inputs, None)
+
+
+def measure(
+    func: Callable[[list[NDArray[np.uint8]]], object], frames: list[NDArray[np.uint8]], batch_size: int
+) -> float:
+    func(frames[:batch_size])  # warm up
+    latencies = []
+    for i in range(0, len(frames) - batch_size + 1, batch_size):
+        start = time.perf_counter()
+        func(frames[i : i + batch_size])
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000 / batch_size
+
+
+def clip_encoder(model_path: Path, size: int, threads: int) -> Callable[[list[NDArray[np.uint8]]], NDArray[np.float32]]:
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = threads
+    session = ort.InferenceSession(model_path.as_posix(), sess_options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def encode(frames: list[NDArray[np.uint8]]) -> NDArray[np.float32]:
+        images = [cv2.resize(frame, (size, size))[..., ::-1].astype(np.float32) / 255 for frame in frames]
+        batch = np.stack([((image - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1) for image in images])
+        embeddings: NDArray[np.float32] = session.run(None, {input_name: batch})[0]
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    return encode
+
+
+def compare_clip(
+    clip_dir: Path | None, tmpdir: Path, frames: list[NDArray[np.uint8]], batch_sizes: list[int], threads: int
+) -> None:
+    visual_dir = tmpdir / "visual"
+    size = 224
+    if clip_dir is None:
+        visual_dir.mkdir()
+        torch.onnx.export(
+            RandomVisualEncoder().eval(),
+            (torch.randn(1, 3, size, size),),
+            (visual_dir / "model.onnx").as_posix(),
+            input_names=["image"],
+            output_names=["embedding"],
+            dynamic_axes={"image": {0: "batch_size"}, "embedding": {0: "batch_size"}},
+            dynamo=False,
+        )
+    else:
+        shutil.copytree(clip_dir / "visual", visual_dir)
+        size = ort.InferenceSession((visual_dir / "model.onnx").as_posix()).get_inputs()[0].shape[-1]
+    if not (visual_dir / "model_int8.onnx").is_file():
+        quantize(visual_dir / "model.onnx")
+
+    encoders = {dtype: clip_encoder(visual_dir / name, size, threads) for dtype, name in MODEL_FILES.items()}
+    fp32, int8 = (encoders[dtype](frames) for dtype in MODEL_FILES)
+    similarity = int8 @ fp32.T
+    recall = (similarity.argmax(axis=1) == np.arange(len(frames))).mean()
+    print(f"clip: min cosine similarity {np.diag(similarity).min():.4f}, recall@1 {recall:.1%}")
+
+    print(HEADER)
+    for batch_size in batch_sizes:
+        for dtype, encode in encoders.items():
+            print(f"{'clip':<8} {batch_size:>10} {dtype:<5} {measure(encode, frames, batch_size):>9.1f}")
+
+
+def compare_weapons(
+    weapons_path: str, tmpdir: Path, frames: list[NDArray[np.uint8]], batch_sizes: list[int], threads: int
+) -> None:
+    model_dir = tmpdir / "weapons"
+    model_dir.mkdir()
+    export_detector(weapons_path, model_dir, 640)
+    network = YOLO(weapons_path).model
+    assert isinstance(network, torch.nn.Module)
+    dfl = f"/model.{len(network.model) - 1}/dfl/"
+    # calibrated on every other frame and evaluated on all of them
+    calibration = ListCalibrationReader([{"images": letterbox(frame, 640)[0][None]} for frame in frames[::2]])
+    model_path = model_dir / "model.onnx"
+    nodes = [node.name for node in onnx.load(model_path).graph.node if node.name.startswith(dfl)]
+    quantize(model_path, calibration, nodes_to_exclude=nodes)
+
+    detectors: dict[str, WeaponsDetector] = {}
+    for dtype in MODEL_FILES:
+        with mock.patch.object(settings, "quantized", dtype == "int8"):
+            detectors[dtype] = WeaponsDetector("yoloV8", cache_dir=model_dir, providers=["CPUExecutionProvider"])
+            detectors[dtype].sess_options.intra_op_num_threads = threads
+            detectors[dtype].load()
+
+    found, total = 0, 0
+    for expected, boxes in zip(detectors["fp32"].detect(frames, 0.25), detectors["int8"].detect(frames, 0.25)):
+        total += len(expected)
+        found += sum(any(box[5] == other[5] and iou(box[:4], other[:4]) >= 0.5 for other in boxes) for box in expected)
+    print(f"weapons: {found} of {total} FP32 detections found by INT8 ({found / max(total, 1):.1%})")
+
+    print(HEADER)
+    for batch_size in batch_sizes:
+        for dtype, detector in detectors.items():
+            latency = measure(lambda batch: detector.detect(batch, 0.25), frames, batch_size)
+            print(f"{'weapons':<8} {batch_size:>10} {dtype:<5} {latency:>9.1f}")
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--clip-dir", type=Path, default=None, help="CLIP model folder with a `visual` subfolder")
+    parser.add_argument("--weapons-path", type=str, default="yolov8n.yaml", help="YOLO checkpoint or config")
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--threads", type=int, default=min(2, os.cpu_count() or 1), help="ONNX Runtime CPU threads")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    with TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        capture = cv2.VideoCapture(make_clip(tmpdir / "clip.mp4", frames=args.frames).as_posix())
+        frames = [frame for ret, frame in iter(capture.read, (False, None)) if ret]
+        capture.release()
+
+        compare_clip(args.clip_dir, tmpdir, frames, args.batch_sizes, args.threads)
+        compare_weapons(args.weapons_path, tmpdir, frames, args.batch_sizes, args.threads)
+
+
+if __name__ == "__main__":
+    main()
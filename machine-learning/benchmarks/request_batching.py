@@ -0,0 +1,123 @@
+"""
+Measures request latency and throughput with and without micro-batching at different concurrencies.
+
+Each simulated client sends requests one after the other to an ONNX model with a dynamic batch axis, by default a
+small convolutional network. Pass `--model-path` to use an exported model instead, such as a CLIP visual model.
+Requests run on a thread pool like in the service, either one session call per request or coalesced by
+`MicroBatcher`.
+
+Usage: python -m benchmarks.request_batching [--model-path visual/model.onnx] [--concurrency 1 4 16 64]
+    [--batch-size 16] [--wait-ms 5] [--provider CPUExecutionProvider]
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from numpy.typing import NDArray
+from onnx import TensorProto, helper, numpy_helper
+
+from app.batching import MicroBatcher
+
+
+def make_model(size: int) -> bytes:
+    rng = np.random.default_rng(0)
+    weights = [
+        numpy_helper.from_array(rng.standard_normal((32, 3, 3, 3), dtype=np.float32), "w1"),
+        numpy_helper.from_array(rng.standard_normal((64, 32, 3, 3), dtype=np.float32), "w2"),
+        numpy_helper.from_array(rng.standard_normal((64, 512), dtype=np.float32), "w3"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["image", "w1"], ["c1"], strides=[2, 2]),
+        helper.make_node("Relu", ["c1"], ["r1"]),
+        helper.make_node("Conv", ["r1", "w2"], ["c2"], strides=[2, 2]),
+        helper.make_node("GlobalAveragePool", ["c2"], ["pooled"]),
+        helper.make_node("Flatten", ["pooled"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "w3"], ["embedding"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "benchmark",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["batch_size", 3, size, size])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, ["batch_size", 512])],
+        weights,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+    onnx.checker.check_model(model)
+    serialized: bytes = model.SerializeToString()
+    return serialized
+
+
+async def load_test(
+    predict: Callable[[NDArray[np.float32]], Awaitable[Any]],
+    inputs: NDArray[np.float32],
+    concurrency: int,
+    requests: int,
+) -> tuple[list[float], float]:
+    latencies: list[float] = []
+
+    async def client() -> None:
+        for _ in range(requests):
+            start = time.perf_counter()
+            await predict(inputs)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=0, help="Requests per client (default: 256 in total)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    parser.add_argument("--threads", type=int, default=4, help="Size of the request thread pool")
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--model-path", type=str, default=None)
+    parser.add_argument("--provider", type=str, default="CPUExecutionProvider")
+    args = parser.parse_args()
+
+    # same defaults as InferenceModel on CPU
+    sess_options = ort.SessionOptions()
+    sess_options.enable_cpu_mem_arena = False
+    sess_options.inter_op_num_threads = 1
+    sess_options.intra_op_num_threads = 2
+    session = ort.InferenceSession(
+        args.model_path or make_model(args.image_size), sess_options, providers=[args.provider]
+    )
+    input_name = session.get_inputs()[0].name
+    inputs = np.random.default_rng(1).random((1, 3, args.image_size, args.image_size), dtype=np.float32)
+    loop = asyncio.get_running_loop()
+
+    def run_single(image: NDArray[np.float32]) -> NDArray[np.float32]:
+        embedding: NDArray[np.float32] = session.run(None, {input_name: image})[0][0]
+        return embedding
+
+    def run_batch(images: list[NDArray[np.float32]]) -> list[NDArray[np.float32]]:
+        return list(session.run(None, {input_name: np.concatenate(images)})[0])
+
+    print(f"{'mode':<9} {'clients':>7} {'p50 (ms)':>9} {'p99 (ms)':>9} {'req/s':>8}")
+    with ThreadPoolExecutor(args.threads) as pool:
+        run_single(inputs)  # warm up
+
+        async def single(image: NDArray[np.float32]) -> NDArray[np.float32]:
+            return await loop.run_in_executor(pool, run_single, image)
+
+        batcher = MicroBatcher(run_batch, args.batch_size, args.wait_ms / 1000, pool)
+        for concurrency in args.concurrency:
+            requests = args.requests or max(256 // concurrency, 1)
+            for mode, predict in [("single", single), ("batched", batcher.submit)]:
+                latencies, elapsed = await load_test(predict, inputs, concurrency, requests)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print(f"{mode:<9} {concurrency:>7} {p50:>9.1f} {p99:>9.1f} {len(latencies) / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
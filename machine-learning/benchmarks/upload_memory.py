@@ -0,0 +1,118 @@
+"""
+Compares the peak memory of receiving an image upload with `UploadFile.read` against `read_upload`, which shares the
+buffer of uploads held in memory and memory-maps uploads spooled to disk.
+
+The request body is fed to the multipart parser in 64 KiB chunks, as the server would receive it, and the content is
+then hashed, which reads every byte like a decoder does. Uploads of `MultiPartParser.max_file_size` or more are
+spooled to disk. Decoding itself isn't included, since its memory depends on the image rather than the upload.
+
+Peak memory is the increase in resident memory while receiving one upload, measured as in `clip_preprocessing`.
+Pages of a memory-mapped upload count as resident while they're read, but they're backed by the spooled file, so the
+kernel can drop them under memory pressure instead of swapping them. To tell the two apart, the increase in anonymous
+and file-backed resident memory is also reported while the content is held, after it has been read.
+
+Usage: python -m benchmarks.upload_memory [--sizes 20 60 120] [--iterations 3]
+"""
+
+import asyncio
+import ctypes
+import hashlib
+import os
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartParser
+from starlette.requests import Request
+
+from app.main import read_upload
+
+BOUNDARY = "benchmark-boundary"
+CHUNK_SIZE = 2**16
+M_MMAP_THRESHOLD = -3
+libc = ctypes.CDLL("libc.so.6")
+
+
+def make_body(size: int) -> bytes:
+    head = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="image.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+    # random bytes, since a decoder reads them the same way as a JPEG of the same size
+    return head + b"\xff\xd8" + os.urandom(size - 2) + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def read(upload: UploadFile) -> Any:
+    return await upload.read()
+
+
+async def mapped(upload: UploadFile) -> Any:
+    return read_upload(upload)  # type: ignore[arg-type]
+
+
+async def receive_upload(body: bytes, func: Callable[[UploadFile], Awaitable[Any]]) -> tuple[float, float]:
+    chunks = iter(range(0, len(body), CHUNK_SIZE))
+
+    async def receive() -> dict[str, Any]:
+        start = next(chunks, None)
+        if start is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": body[start : start + CHUNK_SIZE], "more_body": True}
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    request = Request({"type": "http", "method": "POST", "headers": headers}, receive)
+    form = await request.form()
+    upload = form["image"]
+    assert isinstance(upload, UploadFile)
+    data = await func(upload)
+    hashlib.sha256(data).digest()
+    held = rss_mb("RssAnon"), rss_mb("RssFile") + rss_mb("RssShmem")
+    del data
+    await form.close()
+    return held
+
+
+def rss_mb(key: str) -> float:
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(f"{key}:"):
+            return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{key} not found in /proc/self/status")
+
+
+def measure(
+    body: bytes, func: Callable[[UploadFile], Awaitable[Any]], iterations: int
+) -> tuple[float, float, float, float]:
+    peaks, anon, file, elapsed = [], [], [], 0.0
+    for _ in range(iterations):
+        libc.malloc_trim(0)
+        Path("/proc/self/clear_refs").write_text("5")  # resets the peak to the current RSS
+        baseline = rss_mb("VmRSS"), rss_mb("RssAnon"), rss_mb("RssFile") + rss_mb("RssShmem")
+        start = time.perf_counter()
+        held_anon, held_file = asyncio.run(receive_upload(body, func))
+        elapsed += time.perf_counter() - start
+        peaks.append(rss_mb("VmHWM") - baseline[0])
+        anon.append(held_anon - baseline[1])
+        file.append(held_file - baseline[2])
+    return elapsed / iterations * 1000, min(peaks), min(anon), min(file)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[20, 60, 120], help="upload sizes in MB")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    libc.mallopt(M_MMAP_THRESHOLD, 128 * 1024)
+    print(f"spooled to disk from {MultiPartParser.max_file_size / 2**20:.0f} MB")
+    print(f"{'upload (MB)':>11} {'mode':<7} {'ms':>7} {'peak (MB)':>10} {'anon (MB)':>10} {'file (MB)':>10}")
+    for size in args.sizes:
+        body = make_body(size * 2**20)
+        for mode, func in [("read", read), ("mapped", mapped)]:
+            elapsed, peak, anon, file = measure(body, func, args.iterations)
+            print(f"{size:>11} {mode:<7} {elapsed:>7.1f} {peak:>10.1f} {anon:>10.1f} {file:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+from numpy.typing import NDArray
+from ultralytics import YOLO
+
+from app.models.weapons_detector import WeaponsDetector
+
+# frame ranges in which the synthetic "weapon" is visible
+WEAPON_RANGES = [(60, 120), (200, 260)]
+WEAPON_SIZE = 60
+
+
+def weapon_box(index: int, width: int, height: int) -> tuple[int, int, int, int] | None:
+    """Ground truth box of the synthetic weapon in a frame, or None if it's not visible."""
+
+    for start, end in WEAPON_RANGES:
+        if start <= index < end:
+            x = int((index - start) / (end - start) * (width - WEAPON_SIZE))
+            y = height // 2 - WEAPON_SIZE // 2
+            return x, y, x + WEAPON_SIZE, y + WEAPON_SIZE
+    return None
+
+
+def make_clip(path: Path, frames: int = 300, fps: float = 30.0, size: tuple[int, int] = (640, 360)) -> Path:
+    """
+    Writes a synthetic clip with a hard scene cut halfway through and a red square moving across the frame
+    during `WEAPON_RANGES`.
+    """
+
+    width, height = size
+    gradient = np.tile(np.linspace(0, 200, width, dtype=np.uint8), (height, 1))
+    scenes = [cv2.merge([gradient, gradient, gradient]), cv2.merge([gradient[:, ::-1], gradient, gradient // 2])]
+    writer = cv2.VideoWriter(path.as_posix(), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(frames):
+        frame = scenes[0 if i < frames // 2 else 1].copy()
+        if (box := weapon_box(i, width, height)) is not None:
+            x1, y1, x2, y2 = box
+            frame[y1:y2, x1:x2] = (0, 0, 255)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def find_red_square(frame: NDArray[np.uint8]) -> NDArray[np.float32]:
+    """Detects the synthetic weapon by color. Returns boxes in the `xyxy, track id, conf, class` format."""
+
+    mask = cv2.inRange(frame, (0, 0, 200), (60, 60, 255))
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return np.empty((0, 7), dtype=np.float32)
+    x, y, w, h = cv2.boundingRect(points)
+    return np.array([[x, y, x + w, y + h, 1, 0.9, 0]], dtype=np.float32)
+
+
+def iou(a: tuple[float, ...], b: tuple[float, ...]) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def load_detector(model_path: str | Path) -> WeaponsDetector:
+    """Returns a detector with the given YOLO checkpoint or config instead of the weights the service copies."""
+
+    detector = WeaponsDetector("yoloV8")
+    detector.model = YOLO(str(model_path))
+    detector.names = detector.model.names
+    detector.loaded = True
+    return detector
@@ -0,0 +1,70 @@
+"""
+Measures video weapons detection throughput on CPU at different batch sizes.
+
+Reports both the detection step alone and the whole video pipeline (decoding, tracking, drawing and encoding),
+along with the time each pipeline stage spent working rather than waiting on the others.
+Without `--model-path`, a randomly initialized YOLOv8n is built from its architecture config, which has the same
+cost as the trained model without needing the weights.
+
+Usage: python -m benchmarks.video_batching [--model-path model.pt] [--frames 128] [--batch-sizes 1 4 8 16]
+"""
+
+import shutil
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import cv2
+import torch
+
+from app.models.video import StageTimings
+
+from .util import load_detector, make_clip
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model-path", type=str, default="yolov8n.yaml")
+    parser.add_argument("--frames", type=int, default=128)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--threads", type=int, default=0, help="Torch CPU threads (default: torch's default)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    detector = load_detector(args.model_path)
+    with TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        clip = make_clip(tmpdir / "clip.mp4", frames=args.frames)
+        capture = cv2.VideoCapture(clip.as_posix())
+        frames = [frame for ret, frame in iter(capture.read, (False, None)) if ret]
+        capture.release()
+
+        detector.detect(frames[:1], 0.25)  # warm up
+        print(
+            f"{'batch size':>10} {'detect fps':>11} {'pipeline fps':>13} "
+            f"{'decode (s)':>11} {'infer (s)':>10} {'encode (s)':>11}"
+        )
+        for batch_size in args.batch_sizes:
+            start = time.perf_counter()
+            for i in range(0, len(frames), batch_size):
+                detector.detect(frames[i : i + batch_size], 0.25)
+            detect_fps = len(frames) / (time.perf_counter() - start)
+
+            video_path = tmpdir / "input.mp4"
+            shutil.copy(clip, video_path)  # the detector deletes its input when done
+            timings: dict[str, StageTimings] = {}
+            start = time.perf_counter()
+            detector.predict_video(video_path, tmpdir / "detected.mp4", 0.25, batch_size=batch_size, timings=timings)
+            pipeline_fps = len(frames) / (time.perf_counter() - start)
+
+            print(
+                f"{batch_size:>10} {detect_fps:>11.1f} {pipeline_fps:>13.1f} "
+                f"{timings['decode'].busy:>11.2f} {timings['infer'].busy:>10.2f} {timings['encode'].busy:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the speed and detection recall of the video frame sampling strategies on a synthetic clip.
+
+By default, detection is simulated by finding a red square with a fixed latency per call, so the numbers reflect
+how many inference calls are skipped. Pass `--model-path` and `--video` to measure a real model on a real clip,
+in which case recall is measured against the detections of the `all` strategy.
+
+Usage: python -m benchmarks.video_sampling [--latency-ms 30] [--model-path model.pt --video clip.mp4]
+"""
+
+import shutil
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from app.models.video import get_sampler
+from app.models.weapons_detector import WeaponsDetector
+
+from .util import find_red_square, iou, load_detector, make_clip, weapon_box
+
+STRATEGIES: dict[str, dict[str, Any]] = {
+    "all": {"strategy": "all"},
+    "interval 3": {"strategy": "interval", "interval": 3},
+    "interval 10": {"strategy": "interval", "interval": 10},
+    "fps 5": {"strategy": "fps", "fps": 5},
+    "fps 2": {"strategy": "fps", "fps": 2},
+    "scene": {"strategy": "scene"},
+}
+
+
+class SyntheticDetector(WeaponsDetector):
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.clean_results = None
+        self.names = {0: "weapon"}
+
+    def detect(self, frames: list[NDArray[np.uint8]], confidence: float) -> list[NDArray[np.float32]]:
+        time.sleep(self.latency * len(frames))
+        return [find_red_square(frame) for frame in frames]
+
+    def associate(self, tracker: Any, boxes: NDArray[np.float32], frame: NDArray[np.uint8]) -> NDArray[np.float32]:
+        return boxes
+
+
+def run(detector: WeaponsDetector, clip: Path, sampling: dict[str, Any], tmpdir: Path) -> tuple[float, list[Any]]:
+    video_path = tmpdir / f"input_{clip.name}"
+    shutil.copy(clip, video_path)  # the detector deletes its input when done
+    boxes: list[Any] = []
+    start = time.perf_counter()
+    detector.predict_video(
+        video_path,
+        tmpdir / f"detected_{clip.name}",
+        0.25,
+        on_frame=lambda index, total, frame_boxes: boxes.append(frame_boxes),
+        sampler=get_sampler(sampling),
+    )
+    return time.perf_counter() - start, boxes
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Simulated inference latency per frame")
+    parser.add_argument("--model-path", type=Path, default=None, help="YOLO checkpoint to use instead")
+    parser.add_argument("--video", type=Path, default=None, help="Clip to use instead of the synthetic one")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        clip = args.video or make_clip(tmpdir / "synthetic.mp4")
+        detector = load_detector(args.model_path) if args.model_path else SyntheticDetector(args.latency_ms / 1000)
+
+        baseline_time, baseline = run(detector, clip, STRATEGIES["all"], tmpdir)
+        if args.video is None:
+            truth = [weapon_box(i, 640, 360) for i in range(len(baseline))]
+        else:
+            truth = [tuple(frame_boxes[0, :4]) if len(frame_boxes) else None for frame_boxes in baseline]
+
+        print(f"{'strategy':<12} {'time (s)':>9} {'speedup':>8} {'recall':>7} {'mean IoU':>9}")
+        for name, sampling in STRATEGIES.items():
+            elapsed, boxes = (baseline_time, baseline) if name == "all" else run(detector, clip, sampling, tmpdir)
+            hits = [iou(tuple(b[0, :4]), t) for b, t in zip(boxes, truth) if t is not None and len(b)]
+            positives = sum(t is not None for t in truth)
+            recall = len(hits) / positives if positives else float("nan")
+            mean_iou = sum(hits) / positives if positives else float("nan")
+            print(f"{name:<12} {elapsed:>9.2f} {baseline_time / elapsed:>7.1f}x {recall:>7.2f} {mean_iou:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
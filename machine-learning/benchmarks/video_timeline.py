@@ -0,0 +1,54 @@
+"""
+Compares the CPU time and disk usage of writing a full annotated video against the detection-only timeline,
+with and without clips around the detections.
+
+Detection is simulated by finding the red square of the synthetic clip, so the numbers only reflect the cost of
+decoding, tracking and encoding. Pass `--video` to use a real clip, which will only have detections with
+`--model-path`.
+
+Usage: python -m benchmarks.video_timeline [--model-path model.pt] [--video clip.mp4]
+"""
+
+import shutil
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .util import load_detector, make_clip
+from .video_sampling import SyntheticDetector
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model-path", type=Path, default=None, help="YOLO checkpoint to use instead")
+    parser.add_argument("--video", type=Path, default=None, help="Clip to use instead of the synthetic one")
+    args = parser.parse_args()
+
+    detector = load_detector(args.model_path) if args.model_path else SyntheticDetector(0.0)
+    with TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        clip = args.video or make_clip(tmpdir / "synthetic.mp4")
+
+        modes = {
+            "video": lambda path, out: detector.predict_video(path, out / f"detected_{clip.name}", 0.25),
+            "timeline": lambda path, out: detector.detect_video(path, 0.25),
+            "timeline + clips": lambda path, out: detector.detect_video(path, 0.25, clip_directory=out),
+        }
+        print(f"{'mode':<17} {'cpu (s)':>8} {'wall (s)':>9} {'written (MB)':>13}")
+        for name, process in modes.items():
+            output_dir = tmpdir / name.replace(" ", "")
+            output_dir.mkdir()
+            video_path = tmpdir / f"input_{clip.name}"
+            shutil.copy(clip, video_path)  # the detector deletes its input when done
+
+            cpu, wall = time.process_time(), time.perf_counter()
+            process(video_path, output_dir)
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+            written = sum(path.stat().st_size for path in output_dir.iterdir()) / 2**20
+            print(f"{name:<17} {cpu:>8.2f} {wall:>9.2f} {written:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the CPU latency of weapons detection with PyTorch against ONNX Runtime at different batch sizes.
+
+The checkpoint is exported to ONNX with dynamic batch and image sizes, as `export/models/yolo.py` does, and both
+runtimes are given the same number of threads. Frames are padded to a multiple of 32 rather than a square where the
+model allows it, as Ultralytics does for PyTorch. Latency covers the whole `detect` call: letterboxing, inference and
+NMS. Without `--model-path`, a randomly initialized YOLOv8n is built from its architecture config, which has the same
+cost as the trained model without needing the weights.
+
+Usage: python -m benchmarks.yolo_runtime [--model-path model.pt] [--batch-sizes 1 4 8] [--threads 2]
+"""
+
+import json
+import os
+import shutil
+import statistics
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import cv2
+import numpy as np
+import torch
+from numpy.typing import NDArray
+from ultralytics import YOLO
+
+from app.models.weapons_detector import WeaponsDetector
+
+from .util import load_detector, make_clip
+
+
+def export_detector(model_path: str, output_dir: Path, image_size: int) -> WeaponsDetector:
+    model = YOLO(model_path)
+    exported = model.export(format="onnx", imgsz=image_size, dynamic=True, simplify=False, verbose=False)
+    shutil.move(exported, output_dir / "model.onnx")
+    (output_dir / "config.json").write_text(json.dumps({"names": model.names, "imgsz": image_size}))
+    return WeaponsDetector("yoloV8", cache_dir=output_dir, providers=["CPUExecutionProvider"])
+
+
+def measure(detector: WeaponsDetector, frames: list[NDArray[np.uint8]], batch_size: int) -> float:
+    detector.detect(frames[:batch_size], 0.25)  # warm up
+    latencies = []
+    for i in range(0, len(frames) - batch_size + 1, batch_size):
+        start = time.perf_counter()
+        detector.detect(frames[i : i + batch_size], 0.25)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model-path", type=str, default="yolov8n.yaml")
+    parser.add_argument("--image-size", type=int, default=640)
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    # the service gives ONNX Runtime 2 threads on CPU. More threads than cores slow it down, since its threads spin
+    parser.add_argument("--threads", type=int, default=min(2, os.cpu_count() or 1), help="CPU threads of both runtimes")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch_detector = load_detector(args.model_path)
+    with TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        (tmpdir / "onnx").mkdir()
+        onnx_detector = export_detector(args.model_path, tmpdir / "onnx", args.image_size)
+        onnx_detector.sess_options.intra_op_num_threads = args.threads
+        onnx_detector.load()
+
+        capture = cv2.VideoCapture(make_clip(tmpdir / "clip.mp4", frames=args.frames).as_posix())
+        frames = [frame for ret, frame in iter(capture.read, (False, None)) if ret]
+        capture.release()
+
+        print(f"{'batch size':>10} {'runtime':<8} {'ms/batch':>9} {'ms/frame':>9}")
+        for batch_size in args.batch_sizes:
+            for runtime, detector in [("torch", torch_detector), ("onnx", onnx_detector)]:
+                latency = measure(detector, frames, batch_size)
+                print(f"{batch_size:>10} {runtime:<8} {latency:>9.1f} {latency / batch_size:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
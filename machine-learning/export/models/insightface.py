@@ -0,0 +1,47 @@
+"""
+Quantizes the face detection (RetinaFace) and recognition (ArcFace) models of an InsightFace model pack, such as
+`buffalo_l` in the facial-recognition folder of the model cache, to INT8. The models are exported upstream rather
+than here, so this runs on the downloaded pack and writes `model_int8.onnx` next to each `model.onnx`.
+
+Both models are convolutional and are calibrated with a folder of photos. The recognition model is calibrated best
+with face crops, but whole photos resized to its input size work too.
+
+Usage (from this directory): python -m models.insightface /cache/facial-recognition/buffalo_l images/
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnx
+from numpy.typing import NDArray
+
+from .optimize import ImageCalibrationReader, quantize
+
+
+def preprocess_detection(image: NDArray[np.uint8]) -> NDArray[np.float32]:
+    blob: NDArray[np.float32] = cv2.dnn.blobFromImage(image, 1 / 128, (640, 640), (127.5, 127.5, 127.5), swapRB=True)
+    return blob[0]
+
+
+def preprocess_recognition(image: NDArray[np.uint8]) -> NDArray[np.float32]:
+    blob: NDArray[np.float32] = cv2.dnn.blobFromImage(image, 1 / 127.5, (112, 112), (127.5, 127.5, 127.5), swapRB=True)
+    return blob[0]
+
+
+def to_int8(model_dir: Path | str, calibration_dir: Path | str) -> None:
+    model_dir = Path(model_dir)
+    for name, preprocess in [("detection", preprocess_detection), ("recognition", preprocess_recognition)]:
+        model_path = model_dir / name / "model.onnx"
+        input_name = onnx.load(model_path.as_posix(), load_external_data=False).graph.input[0].name
+        quantize(model_path, ImageCalibrationReader(calibration_dir, input_name, preprocess))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("model_dir", type=Path)
+    parser.add_argument("calibration_images", type=Path)
+    args = parser.parse_args()
+
+    to_int8(args.model_dir, args.calibration_images)
@@ -8,7 +8,7 @@ from transformers import AutoTokenizer
 
 from .openclip import OpenCLIPModelConfig
 from .openclip import to_onnx as openclip_to_onnx
-from .optimize import optimize
+from .optimize import optimize, quantize
 from .util import get_model_path
 
 _MCLIP_TO_OPENCLIP = {
@@ -35,6 +35,7 @@ def to_onnx(
         export_text_encoder(model, textual_path)
         openclip_to_onnx(_MCLIP_TO_OPENCLIP[model_name], output_dir_visual)
         optimize(textual_path)
+        quantize(textual_path)
 
 
 def export_text_encoder(model: MultilingualCLIP, output_path: Path | str) -> None:
@@ -7,7 +7,7 @@ import open_clip
 import torch
 from transformers import AutoTokenizer
 
-from .optimize import optimize
+from .optimize import optimize, quantize
 from .util import get_model_path, save_config
 
 
@@ -54,6 +54,7 @@ def to_onnx(
             export_image_encoder(model, model_cfg, visual_path)
 
             optimize(visual_path)
+            quantize(visual_path)
 
         if output_dir_textual is not None:
             output_dir_textual = Path(output_dir_textual)
@@ -63,6 +64,7 @@ def to_onnx(
             AutoTokenizer.from_pretrained(tokenizer_name).save_pretrained(output_dir_textual)
             export_text_encoder(model, model_cfg, textual_path)
             optimize(textual_path)
+            quantize(textual_path)
 
 
 def export_image_encoder(model: open_clip.CLIP, model_cfg: OpenCLIPModelConfig, output_path: Path | str) -> None:
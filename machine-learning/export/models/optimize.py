@@ -1,11 +1,27 @@
+import contextlib
+import tempfile
 from pathlib import Path
+from typing import Callable, Iterator
 
+import cv2
+import numpy as np
 import onnx
 import onnxruntime as ort
-import onnxsim
+from numpy.typing import NDArray
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
 
 
 def optimize_onnxsim(model_path: Path | str, output_path: Path | str) -> None:
+    # only needed to export models, not to quantize them in the tests and benchmarks
+    import onnxsim
+
     model_path = Path(model_path)
     output_path = Path(output_path)
     model = onnx.load(model_path.as_posix())
@@ -36,3 +52,87 @@ def optimize(model_path: Path | str) -> None:
     # onnxsim serializes large models as a blob, which uses much more memory when loading the model at runtime
     if not any(file.name.startswith("Constant") for file in model_path.parent.iterdir()):
         optimize_onnxsim(model_path, model_path)
+
+
+def get_quantized_path(model_path: Path | str) -> Path:
+    model_path = Path(model_path)
+    return model_path.with_name(f"{model_path.stem}_int8.onnx")
+
+
+class ImageCalibrationReader(CalibrationDataReader):  # type: ignore[misc]
+    """Feeds images from a folder to the model one at a time, preprocessed the way the service does for it."""
+
+    def __init__(
+        self,
+        image_dir: Path | str,
+        input_name: str,
+        preprocess: Callable[[NDArray[np.uint8]], NDArray[np.float32]],
+        max_images: int = 200,
+    ) -> None:
+        paths = sorted(path for path in Path(image_dir).rglob("*") if path.suffix.lower() in {".jpg", ".jpeg", ".png"})
+        if not paths:
+            raise ValueError(f"No calibration images found in '{image_dir}'")
+        self.paths = paths[:max_images]
+        self.input_name = input_name
+        self.preprocess = preprocess
+        self.inputs: Iterator[dict[str, NDArray[np.float32]]] = iter(self)
+
+    def __iter__(self) -> Iterator[dict[str, NDArray[np.float32]]]:
+        for path in self.paths:
+            image = cv2.imread(path.as_posix())
+            if image is not None:
+                yield {self.input_name: self.preprocess(image)[None]}
+
+    def get_next(self) -> dict[str, NDArray[np.float32]] | None:
+        return next(self.inputs, None)
+
+
+def quantize(
+    model_path: Path | str,
+    calibration: CalibrationDataReader | None = None,
+    nodes_to_exclude: list[str] | None = None,
+) -> Path:
+    """
+    Writes an INT8 copy of the model next to it, which the service runs instead when `MACHINE_LEARNING_QUANTIZED` is
+    set. Without calibration data, only the weights of matrix multiplications are quantized ahead of time and their
+    inputs are quantized as the model runs, which suits transformers. Convolutions are slower that way than in FP32,
+    so convolutional models need `calibration` inputs to fix the ranges of their activations in advance.
+    """
+
+    model_path = Path(model_path).absolute()
+    output_path = get_quantized_path(model_path)
+    # large models are saved with their weights in separate files, which the quantized model needs too
+    external_data = any(file.name.startswith("Constant") for file in model_path.parent.iterdir())
+    # ONNX Runtime saves the model to the working directory when shape inference fails during quantization
+    with tempfile.TemporaryDirectory() as tmpdir, contextlib.chdir(tmpdir):
+        preprocessed_path = Path(tmpdir) / model_path.name
+        quant_pre_process(
+            model_path.as_posix(),
+            preprocessed_path.as_posix(),
+            skip_symbolic_shape=True,
+            save_as_external_data=external_data,
+        )
+        if calibration is None:
+            quantize_dynamic(
+                preprocessed_path,
+                output_path,
+                op_types_to_quantize=["MatMul", "Gemm"],
+                per_channel=True,
+                weight_type=QuantType.QInt8,
+                nodes_to_exclude=nodes_to_exclude,
+                use_external_data_format=external_data,
+            )
+        else:
+            quantize_static(
+                preprocessed_path,
+                output_path,
+                calibration,
+                quant_format=QuantFormat.QDQ,
+                op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                nodes_to_exclude=nodes_to_exclude,
+                use_external_data_format=external_data,
+            )
+    return output_path
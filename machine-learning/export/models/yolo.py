@@ -0,0 +1,87 @@
+"""
+Exports a YOLOv8 checkpoint, such as the weapons detection weights, to a folder the machine learning service can run
+with ONNX Runtime or ArmNN instead of PyTorch. Point `MACHINE_LEARNING_WEAPONS_MODEL_PATH` at the folder to use it.
+
+With `--calibration-images`, a folder of images like the ones the service will scan, `model_int8.onnx` is written too.
+
+Usage (from this directory):
+python -m models.yolo train9_model_v1.pt weapons/ [--image-size 640] [--calibration-images images/]
+"""
+
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnx
+import torch
+from numpy.typing import NDArray
+from ultralytics import YOLO
+
+from .optimize import ImageCalibrationReader, optimize, quantize
+from .util import get_model_path, save_config
+
+
+def to_onnx(
+    checkpoint: Path | str,
+    output_dir: Path | str,
+    image_size: int | None = None,
+    calibration_dir: Path | str | None = None,
+) -> None:
+    """
+    Writes `model.onnx` with dynamic batch and image sizes and `config.json` with the class names and input size to
+    `output_dir`. The model takes letterboxed RGB images scaled to [0, 1] and outputs boxes before NMS.
+    If `calibration_dir` is given, the convolutions are also quantized to INT8 in `model_int8.onnx`.
+    """
+
+    output_dir = Path(output_dir)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # the export is written next to the checkpoint, so it's copied somewhere it can be cleaned up
+        checkpoint_path = Path(tmpdir) / "model.pt"
+        shutil.copyfile(checkpoint, checkpoint_path)
+        model = YOLO(checkpoint_path.as_posix())
+        if image_size is None:
+            imgsz = model.overrides.get("imgsz", 640)
+            assert isinstance(imgsz, int), "Only square input sizes are supported"
+            image_size = imgsz
+
+        assert isinstance(model.model, torch.nn.Module)
+        dfl = f"/model.{len(model.model.model) - 1}/dfl/"
+        exported = model.export(format="onnx", imgsz=image_size, dynamic=True, simplify=False, verbose=False)
+        model_path = get_model_path(output_dir)
+        shutil.move(exported, model_path)
+
+    save_config({"names": model.names, "imgsz": image_size}, output_dir / "config.json")
+    optimize(model_path)
+
+    if calibration_dir is not None:
+        # the head decodes box edges from a distribution over 16 bins, which is too coarse in INT8. The elementwise
+        # operations that scale the boxes and scores aren't quantized either, as in the INT8 exports of Ultralytics
+        nodes = [node.name for node in onnx.load(model_path.as_posix()).graph.node if node.name.startswith(dfl)]
+        calibration = ImageCalibrationReader(calibration_dir, "images", lambda image: letterbox(image, image_size))
+        quantize(model_path, calibration, nodes_to_exclude=nodes)
+
+
+def letterbox(image: NDArray[np.uint8], size: int) -> NDArray[np.float32]:
+    """Resizes a BGR image to fit a square of `size` and pads it the way Ultralytics does."""
+
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    top, left = (size - resized.shape[0]) // 2, (size - resized.shape[1]) // 2
+    bottom, right = size - resized.shape[0] - top, size - resized.shape[1] - left
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1), dtype=np.float32) / 255
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("checkpoint", type=Path)
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--image-size", type=int, default=None)
+    parser.add_argument("--calibration-images", type=Path, default=None)
+    args = parser.parse_args()
+
+    to_onnx(args.checkpoint, args.output_dir, args.image_size, args.calibration_images)
@@ -29,6 +29,13 @@ def _(parser: ArgumentParser) -> None:
             "setting this to 0 blows up the number of faces to the thousands."
         ),
     )
+    parser.add_argument("--weapons-min-score", type=float, default=0.2)
+    parser.add_argument(
+        "--weapons-batch-size",
+        type=int,
+        default=16,
+        help="Number of images per request to the batch endpoint. Divide its requests/s by this to compare.",
+    )
     parser.add_argument("--image-size", type=int, default=1000)
 
 
@@ -88,3 +95,28 @@ class RecognitionFormDataLoadTest(InferenceLoadTest):
         files = {"image": self.data}
 
         self.client.post("/predict", data=data, files=files)
+
+
+class WeaponsDetectionFormDataLoadTest(InferenceLoadTest):
+    @task
+    def detect(self) -> None:
+        data = [
+            ("modelName", "yoloV8"),
+            ("modelType", "weapons-detection"),
+            (
+                "options",
+                json.dumps({"mode": "image", "minScore": self.environment.parsed_options.weapons_min_score}),
+            ),
+        ]
+        files = {"image": self.data}
+        self.client.post("/predict", data=data, files=files)
+
+
+class WeaponsDetectionBatchLoadTest(InferenceLoadTest):
+    @task
+    def detect(self) -> None:
+        batch_size = self.environment.parsed_options.weapons_batch_size
+        data = [("assetIds", f"asset{i}") for i in range(batch_size)]
+        data.append(("options", json.dumps({"minScore": self.environment.parsed_options.weapons_min_score})))
+        files = [("images", self.data) for _ in range(batch_size)]
+        self.client.post("/predict/weapons", data=data, files=files, name=f"/predict/weapons ({batch_size} images)")
@@ -7,6 +7,12 @@ export LD_BIND_NOW=1
 : "${MACHINE_LEARNING_PORT:=3003}"
 : "${MACHINE_LEARNING_WORKERS:=1}"
 : "${MACHINE_LEARNING_WORKER_TIMEOUT:=3600}"
+: "${MACHINE_LEARNING_SHARE_MODELS:=false}"
+
+# the master loads the preloaded models before forking the workers, which then share their memory
+case "$MACHINE_LEARNING_SHARE_MODELS" in
+	[Tt]rue | 1) set -- --preload ;;
+esac
 
 gunicorn app.main:app \
 	-k app.config.CustomUvicornWorker \
@@ -14,4 +20,5 @@ gunicorn app.main:app \
 	-b $MACHINE_LEARNING_HOST:$MACHINE_LEARNING_PORT \
 	-t $MACHINE_LEARNING_WORKER_TIMEOUT \
 	--log-config-json log_conf.json \
-	--graceful-timeout 0
+	--graceful-timeout 0 \
+	"$@"
@@ -82,6 +82,7 @@ const { version } = JSON.parse(readFileSync('./package.json', 'utf8'));
 export const serverVersion = Version.fromString(version);
 
 export const APP_MEDIA_LOCATION = process.env.IMMICH_MEDIA_LOCATION || './upload';
+export const MACHINE_LEARNING_MEDIA_LOCATION = process.env.IMMICH_MACHINE_LEARNING_MEDIA_LOCATION || '';
 
 export const WEB_ROOT_PATH = join(process.env.IMMICH_WEB_ROOT || '/usr/src/app/www', 'index.html');
 
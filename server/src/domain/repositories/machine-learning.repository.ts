@@ -32,6 +32,18 @@ export interface DetectWeaponsResult {
   filePath: string; //Path to the image
 }
 
+export interface DetectedWeapon {
+  boundingBox: BoundingBox;
+  className: string;
+  score: number;
+}
+
+export interface DetectWeaponsImageResult extends DetectWeaponsResult {
+  imageWidth: number;
+  imageHeight: number;
+  weapons: DetectedWeapon[];
+}
+
 export enum ModelType {
   FACIAL_RECOGNITION = 'facial-recognition',
   CLIP = 'clip',
@@ -53,6 +65,10 @@ export interface IMachineLearningRepository {
   encodeImage(url: string, input: VisionModelInput, config: CLIPConfig): Promise<number[]>;
   encodeText(url: string, input: TextModelInput, config: CLIPConfig): Promise<number[]>;
   detectFaces(url: string, input: VisionModelInput, config: RecognitionConfig): Promise<DetectFaceResult[]>;
-  detectWeaponsInImage(url: string, input: VisionModelInput, config: WeaponsDetectConfig): Promise<DetectWeaponsResult>;
+  detectWeaponsInImage(
+    url: string,
+    input: VisionModelInput,
+    config: WeaponsDetectConfig,
+  ): Promise<DetectWeaponsImageResult>;
   detectWeaponsInVideo(url: string, input: VideoModelInput, config: WeaponsDetectConfig): Promise<DetectWeaponsResult>;
 }
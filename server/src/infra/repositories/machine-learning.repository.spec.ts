@@ -0,0 +1,72 @@
+import { ModelType } from '@app/domain';
+import { existsSync, mkdirSync, mkdtempSync, readdirSync, rmSync, writeFileSync } from 'node:fs';
+import { tmpdir } from 'node:os';
+import { join } from 'node:path';
+import { MachineLearningRepository } from './machine-learning.repository';
+
+const config = { enabled: true, modelName: 'yolov8', modelType: ModelType.WEAPONS_DETECTION };
+
+describe(MachineLearningRepository.name, () => {
+  let sut: MachineLearningRepository;
+  let fixtures: string;
+  let mediaLocation: string;
+  let resultsLocation: string;
+
+  beforeEach(() => {
+    fixtures = mkdtempSync(join(tmpdir(), 'immich-ml-'));
+    mediaLocation = join(fixtures, 'upload');
+    resultsLocation = join(fixtures, 'ml-results');
+    mkdirSync(join(mediaLocation, 'library', 'user'), { recursive: true });
+    mkdirSync(join(fixtures, 'external'));
+    mkdirSync(resultsLocation);
+    writeFileSync(join(mediaLocation, 'library', 'user', 'video.mp4'), 'video');
+    writeFileSync(join(fixtures, 'external', 'video.mp4'), 'video');
+
+    sut = new MachineLearningRepository();
+    sut.mediaLocation = mediaLocation;
+    sut.resultsLocation = resultsLocation;
+  });
+
+  afterEach(() => {
+    rmSync(fixtures, { recursive: true, force: true });
+  });
+
+  describe('getFormData', () => {
+    it('should send the path in the shared media location without copying the video', async () => {
+      sut.sharedMediaLocation = '/media';
+
+      const formData = await sut.getFormData({ videoPath: join(mediaLocation, 'library', 'user', 'video.mp4') }, config);
+
+      expect(formData.get('videoFilePath')).toEqual('/media/library/user/video.mp4');
+      expect(readdirSync(resultsLocation)).toEqual([]);
+    });
+
+    it('should copy the video if the media location is not shared', async () => {
+      sut.sharedMediaLocation = '';
+
+      const formData = await sut.getFormData({ videoPath: join(mediaLocation, 'library', 'user', 'video.mp4') }, config);
+
+      expect(formData.get('videoFilePath')).toEqual(join(resultsLocation, 'video.mp4'));
+      expect(existsSync(join(resultsLocation, 'video.mp4'))).toBe(true);
+    });
+
+    it('should copy videos outside of the media location', async () => {
+      sut.sharedMediaLocation = '/media';
+
+      const formData = await sut.getFormData({ videoPath: join(fixtures, 'external', 'video.mp4') }, config);
+
+      expect(formData.get('videoFilePath')).toEqual(join(resultsLocation, 'video.mp4'));
+      expect(existsSync(join(resultsLocation, 'video.mp4'))).toBe(true);
+    });
+
+    it('should copy videos that only share a prefix with the media location', async () => {
+      sut.sharedMediaLocation = '/media';
+      mkdirSync(`${mediaLocation}-other`);
+      writeFileSync(join(`${mediaLocation}-other`, 'video.mp4'), 'video');
+
+      const formData = await sut.getFormData({ videoPath: join(`${mediaLocation}-other`, 'video.mp4') }, config);
+
+      expect(formData.get('videoFilePath')).toEqual(join(resultsLocation, 'video.mp4'));
+    });
+  });
+});
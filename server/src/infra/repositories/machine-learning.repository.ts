@@ -1,4 +1,5 @@
 import {
+  APP_MEDIA_LOCATION,
   CLIPConfig,
   CLIPMode,
   DetectFaceResult,
@@ -10,17 +11,25 @@ import {
   VisionModelInput,
   VideoModelInput,
   WeaponsDetectConfig,
+  DetectWeaponsImageResult,
   DetectWeaponsResult,
+  MACHINE_LEARNING_MEDIA_LOCATION,
   MediaMode,
 } from '@app/domain';
 import { Injectable } from '@nestjs/common';
 import { readFile } from 'node:fs/promises';
-import { copyFileSync } from 'node:fs'; 
+import { copyFileSync } from 'node:fs';
+import { basename, join, relative, resolve, sep } from 'node:path';
 
 const errorPrefix = 'Machine learning request';
 
 @Injectable()
 export class MachineLearningRepository implements IMachineLearningRepository {
+  mediaLocation = APP_MEDIA_LOCATION;
+  // where the machine learning service mounts the media location read-only, if it does
+  sharedMediaLocation = MACHINE_LEARNING_MEDIA_LOCATION;
+  resultsLocation = '/usr/src/app/ml-results';
+
   private async predict<T>(url: string, input: TextModelInput | VisionModelInput | VideoModelInput, config: ModelConfig): Promise<T> {
     const formData = await this.getFormData(input, config);
 
@@ -55,8 +64,8 @@ export class MachineLearningRepository implements IMachineLearningRepository {
     } as CLIPConfig);
   }
 
-  detectWeaponsInImage(url: string, input: VisionModelInput, config: WeaponsDetectConfig): Promise<DetectWeaponsResult> {
-    return this.predict<DetectWeaponsResult>(url, input, { ...config, modelType: ModelType.WEAPONS_DETECTION, mode: MediaMode.IMAGE} as WeaponsDetectConfig);
+  detectWeaponsInImage(url: string, input: VisionModelInput, config: WeaponsDetectConfig): Promise<DetectWeaponsImageResult> {
+    return this.predict<DetectWeaponsImageResult>(url, input, { ...config, modelType: ModelType.WEAPONS_DETECTION, mode: MediaMode.IMAGE} as WeaponsDetectConfig);
   }
   detectWeaponsInVideo(url: string, input: VideoModelInput, config: WeaponsDetectConfig): Promise<DetectWeaponsResult> {
     return this.predict<DetectWeaponsResult>(url, input, { ...config, modelType: ModelType.WEAPONS_DETECTION, mode: MediaMode.VIDEO} as WeaponsDetectConfig);
@@ -80,10 +89,7 @@ export class MachineLearningRepository implements IMachineLearningRepository {
       formData.append('image', new Blob([await readFile(input.imagePath)]));
     } 
     else if ('videoPath' in input) {
-      const tempVideoPath = `/usr/src/app/ml-results/${input.videoPath.split('/').pop()}`;
-      copyFileSync(input.videoPath, tempVideoPath);
-      formData.append('videoFilePath', tempVideoPath);
-      
+      formData.append('videoFilePath', this.getVideoPath(input.videoPath));
     }
     else if ('text' in input) {
       formData.append('text', input.text);
@@ -93,4 +99,18 @@ export class MachineLearningRepository implements IMachineLearningRepository {
 
     return formData;
   }
+
+  private getVideoPath(videoPath: string): string {
+    const mediaLocation = resolve(this.mediaLocation);
+    const path = resolve(videoPath);
+    if (this.sharedMediaLocation && path.startsWith(`${mediaLocation}${sep}`)) {
+      // read in place by the machine learning service, which saves copying multi-GB files for every request
+      return join(this.sharedMediaLocation, relative(mediaLocation, path));
+    }
+
+    // videos outside the media location, such as in external libraries, are copied into the shared results volume
+    const tempVideoPath = join(this.resultsLocation, basename(videoPath));
+    copyFileSync(videoPath, tempVideoPath);
+    return tempVideoPath;
+  }
 }